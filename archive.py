@@ -0,0 +1,142 @@
+import os
+import hashlib
+import zipfile
+import threading
+
+from verification import HASH_ALGORITHM
+
+###
+### Config
+###
+ARCHIVE_EXTENSION = '.cbz'
+
+###
+### Classes
+###
+class chapterArchive():
+    # Pages of one chapter written straight into <directory>.cbz.part as stored (not deflated) zip members. Page threads call add()
+    # concurrently, the zip is only touched under the lock. finalize() renames the .part into place, so a *.cbz on disk is always whole.
+    # An earlier .part is appended to, an existing .cbz is copied over minus the members listed in replace.
+    def __init__(self, path, replace=()):
+        self.path = path
+        self.part_path = "".join([path, '.part'])
+        self.lock = threading.Lock()
+        self.zip = None
+        if (os.path.isfile(self.part_path)):
+            try:
+                if (replace): # Members can't be dropped from a zip in place, the .part is rebuilt without them.
+                    os.replace(self.part_path, "".join([self.part_path, '.old']))
+                    self.copyFrom("".join([self.part_path, '.old']), replace)
+                    os.remove("".join([self.part_path, '.old']))
+                else:
+                    self.zip = zipfile.ZipFile(self.part_path, 'a', zipfile.ZIP_STORED)
+            except zipfile.BadZipFile: # Killed before the central directory was written, nothing in it can be trusted.
+                if (self.zip is not None):
+                    self.zip.close()
+                    self.zip = None
+                for stale in (self.part_path, "".join([self.part_path, '.old'])):
+                    if (os.path.isfile(stale)):
+                        os.remove(stale)
+        if (self.zip is None):
+            self.copyFrom(path if os.path.isfile(path) else None, replace)
+        self.names = set(self.zip.namelist())
+
+    def copyFrom(self, source, replace): # A new .part holding source's members minus replace.
+        self.zip = zipfile.ZipFile(self.part_path, 'w', zipfile.ZIP_STORED)
+        if (source is not None):
+            with zipfile.ZipFile(source) as old:
+                for info in old.infolist():
+                    if (info.filename not in replace):
+                        self.zip.writestr(info, old.read(info.filename))
+
+    def has(self, name):
+        with self.lock:
+            return name in self.names
+
+    def add(self, name, data): # Returns the page's manifest record.
+        with self.lock:
+            if (name not in self.names):
+                self.zip.writestr(name, data)
+                self.names.add(name)
+        return {'size': len(data), 'mtime': None, 'sha1': hashlib.new(HASH_ALGORITHM, data).hexdigest()}
+
+    def close(self): # Keeps the .part for a later run to append to.
+        with self.lock:
+            if (self.zip):
+                self.zip.close()
+                self.zip = None
+
+    def finalize(self):
+        self.close()
+        os.replace(self.part_path, self.path)
+        return self.path
+
+###
+### Functions
+###
+def archivePath(directory): # mangahere/tokyo_ghoul/tokyo_ghoul_c001 -> mangahere/tokyo_ghoul/tokyo_ghoul_c001.cbz
+    return "".join([directory, ARCHIVE_EXTENSION])
+
+def memberName(image_file_path): # 'mangahere/tokyo_ghoul/tokyo_ghoul_c001\\001.jpg' -> '001.jpg'
+    return image_file_path.replace('\\', '/').rsplit('/', 1)[-1]
+
+def archiveMembers(path):
+    # {name: size} from the central directory only, no page is read. Looks at a .part too, for chapters still in progress.
+    for candidate in (path, "".join([path, '.part'])):
+        try:
+            with zipfile.ZipFile(candidate) as archive:
+                return {info.filename: info.file_size for info in archive.infolist()}
+        except (OSError, zipfile.BadZipFile):
+            continue
+    return {}
+
+def verifyArchiveFast(path, names, manifest):
+    # Same contract as verification.verifyPagesFast: a page is good when its member exists with the size in the manifest.
+    bad = []
+    members = archiveMembers(path)
+    manifest = list(manifest) if manifest else []
+    manifest += [None] * (len(names) - len(manifest))
+    for i, name in enumerate(names):
+        size = members.get(name)
+        if (not size or (manifest[i] is not None and manifest[i].get('size') != size)):
+            bad.append(i)
+            manifest[i] = None
+        elif (manifest[i] is None):
+            manifest[i] = {'size': size, 'mtime': None, 'sha1': None} # Hashed on the next --deep.
+    return bad, manifest
+
+def verifyArchiveDeep(path, names, manifest):
+    # Reads every member, which also checks its CRC, and compares hashes with the manifest.
+    bad = []
+    manifest = list(manifest) if manifest else []
+    manifest += [None] * (len(names) - len(manifest))
+    try:
+        archive = zipfile.ZipFile(path)
+    except (OSError, zipfile.BadZipFile):
+        return list(range(0, len(names))), [None] * len(names)
+    with archive:
+        members = set(archive.namelist())
+        for i, name in enumerate(names):
+            try:
+                data = archive.read(name) if name in members else None
+            except (zipfile.BadZipFile, OSError):
+                data = None
+            sha1 = hashlib.new(HASH_ALGORITHM, data).hexdigest() if data else None
+            if (not sha1 or (manifest[i] is not None and manifest[i].get('sha1') not in (None, sha1))):
+                bad.append(i)
+                manifest[i] = None
+            else:
+                manifest[i] = {'size': len(data), 'mtime': None, 'sha1': sha1}
+    return bad, manifest
+
+def packDirectory(directory, paths):
+    # Existing page files -> <directory>.cbz. Returns the manifest, or None when a page is missing and nothing was written.
+    if (not all(os.path.isfile(path) for path in paths)):
+        return None
+    archive = chapterArchive(archivePath(directory))
+    manifest = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            manifest.append(archive.add(memberName(path), f.read()))
+    archive.finalize()
+    return manifest
@@ -0,0 +1,59 @@
+import asyncio
+import time
+import concurrent.futures
+
+from http_client import hostOf
+
+###
+### Config
+###
+DEFAULT_RATE        = 2.0 # Requests per second allowed per host.
+DEFAULT_CONCURRENCY = 8   # Image transfers in flight at once across all hosts.
+
+###
+### Classes
+###
+class hostRateLimiter():
+    # Hands out evenly spaced request slots per host. Waiting for a slot is an asyncio.sleep, so the event loop keeps
+    # queueing and running other pages instead of blocking a thread like http_client.hostThrottle.
+    def __init__(self, rate=DEFAULT_RATE):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = {} # {'z.mhcdn.net': 1408950000.5}
+
+    async def wait(self, url):
+        if (self.interval <= 0):
+            return 0.0
+        host = hostOf(url)
+        now = time.monotonic()
+        slot = max(now, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + self.interval # Reserve the slot before sleeping so other coroutines queue up behind it.
+        delay = slot - now
+        if (delay > 0):
+            await asyncio.sleep(delay)
+        return delay
+
+###
+### Functions
+###
+async def downloadPageAsync(fetch, path, url, limiter, semaphore, executor):
+    async with semaphore:
+        await limiter.wait(url)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, fetch, path, url) # The transfer itself runs on the shared pooled session.
+
+
+async def downloadChaptersAsync(fetch, chapters, rate=DEFAULT_RATE, concurrency=DEFAULT_CONCURRENCY):
+    # chapters: [(pages_src, image_files_paths), ...] Every page of every chapter is scheduled at once, the limiter and semaphore pace them.
+    limiter = hostRateLimiter(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        tasks = []
+        for urls, paths in chapters:
+            tasks.append(asyncio.gather(*[downloadPageAsync(fetch, path, url, limiter, semaphore, executor) for path, url in zip(paths, urls)], return_exceptions=True))
+        results = await asyncio.gather(*tasks)
+    return [[r is True for r in chapter_results] for chapter_results in results] # [[True, True, False ...], ...] per chapter, per page.
+
+
+def downloadChapters(fetch, chapters, rate=DEFAULT_RATE, concurrency=DEFAULT_CONCURRENCY):
+    # Blocking entry point for the rest of mangaget. fetch is called as fetch(path, url), e.g. requestFile.
+    return asyncio.run(downloadChaptersAsync(fetch, chapters, rate, concurrency))
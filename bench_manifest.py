@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+import click
+
+from helper import mangaNumbering
+from manifest import readChapterFile, readSeries, writeSeriesFile
+
+###
+### Config
+###
+# Iterates every chapter of the series the way downloadManga did before the compact layout: the master file and then every
+# chapter dict loaded up front. Prints peak RSS in KB.
+BEFORE = '''import sys, json, resource
+master = json.loads(open(sys.argv[1]).read())
+datas = [json.loads(open(json_file).read()) for json_file in master.get('chapter_json_files')]
+pages = sum(len(data.get('pages_src')) for data in datas)
+print(pages, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+# The same walk through the streaming reader, one chapter in memory at a time.
+AFTER = '''import sys, resource
+sys.path.insert(0, sys.argv[2])
+from manifest import seriesChapters, readChapterFile
+pages = 0
+for chapter in seriesChapters(sys.argv[1])[1]:
+    pages += len(readChapterFile(chapter['json_file']).get('pages_src'))
+print(pages, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+# Interpreter plus the imports AFTER needs, subtracted from both to show what the series itself costs.
+EMPTY = '''import sys, json, resource
+sys.path.insert(0, sys.argv[2])
+import manifest
+print(0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+###
+### Functions
+###
+def legacySeries(directory, chapters, pages):
+    # A downloaded mangahere series in the original layout: master file plus a chapter file per chapter with pages_and_src,
+    # pages_src, image_files_paths and page_manifest, paths relative to directory. Returns the master file. No page files, only their records.
+    root_directory = 'mangahere'
+    base_directory = os.path.join(root_directory, 'bench')
+    os.makedirs(os.path.join(directory, base_directory))
+    numbers = ["".join(['c', mangaNumbering(str(i + 1))]) for i in range(0, chapters)]
+    urls = ["".join(['http://www.mangahere.co/manga/bench/', number, '/']) for number in numbers]
+    directories = [os.path.join(base_directory, "".join(['bench_', number])) for number in numbers]
+    for number, url, chapter_directory in zip(numbers, urls, directories):
+        page_numbers = [mangaNumbering(str(i + 1)) for i in range(0, pages)]
+        srcs = ["".join(['http://z.mhcdn.net/store/manga/3249/01-', number[1:], '.0/compressed/bench_', page, '.jpg?v=11216726214']) for page in page_numbers]
+        data = {'downloaded': 'Downloaded', 'chapter_number': number, 'len': pages,
+                'pages_and_src': [{'page': page, 'src': src} for page, src in zip(page_numbers, srcs)],
+                'pages_src': srcs,
+                'image_files_paths': ["".join([chapter_directory, '\\', page, '.jpg']) for page in page_numbers],
+                'chapter_url': url, 'directory': chapter_directory, 'base_directory': base_directory,
+                'page_manifest': [{'size': 180000 + i, 'mtime': 1408960000.123456 + i, 'sha1': '%040x' % (i * 7919 + len(url))} for i in range(0, pages)],
+                'failed_pages': []}
+        with open(os.path.join(directory, "".join([chapter_directory, '.json'])), 'w') as f:
+            json.dump(data, f)
+    master_file = os.path.join(root_directory, 'bench_chapters.json')
+    with open(os.path.join(directory, master_file), 'w') as f:
+        json.dump({'chapter_urls': urls, 'chapter_directories': directories, 'chapter_numbers': numbers, 'root_directory': root_directory,
+                   'base_directory': base_directory, 'chapter_json_files': ["".join([d, '.json']) for d in directories],
+                   'manga_name': 'bench', 'search_url': 'http://www.mangahere.co/manga/bench/', 'file_path': master_file}, f)
+    return master_file
+
+def seriesBytes(directory, master_file): # (master file bytes, chapter files bytes)
+    base_directory = os.path.join(directory, os.path.dirname(master_file), 'bench')
+    return os.path.getsize(os.path.join(directory, master_file)), sum(entry.stat().st_size for entry in os.scandir(base_directory) if entry.name.endswith('.json'))
+
+def peakRss(snippet, master_file, cwd): # (pages seen, peak RSS in KB) of a fresh interpreter running snippet.
+    done = subprocess.run([sys.executable, '-c', snippet, master_file, os.path.dirname(os.path.abspath(__file__))], cwd=cwd, capture_output=True, text=True, check=True)
+    pages, rss = done.stdout.split()
+    return int(pages), int(rss)
+
+def report(name, master_bytes, chapter_bytes, pages, rss, empty_rss):
+    print("".join([name.ljust(8), str(round(master_bytes / 1000, 1)).rjust(9), ' KB master ', str(round(chapter_bytes / 1000000, 2)).rjust(7), ' MB chapters ',
+                   str(pages).rjust(7), ' pages ', str(round(rss / 1000, 1)).rjust(7), ' MB peak RSS (', str(round((rss - empty_rss) / 1000, 1)), ' MB over an empty run)']))
+
+@click.command()
+@click.option('--chapters', default=2000, help='Chapters in the generated series.')
+@click.option('--pages', default=40, help='Pages per chapter.')
+def benchmark(chapters, pages):
+    """Sizes of a generated series' files in the original and the compact layout, and peak RSS of walking every chapter of it."""
+    directory = tempfile.mkdtemp(prefix='mangaget-manifest-')
+    try:
+        master_file = legacySeries(directory, chapters, pages)
+        empty_rss = peakRss(EMPTY, master_file, directory)[1]
+        before = seriesBytes(directory, master_file) + peakRss(BEFORE, master_file, directory)
+        cwd = os.getcwd()
+        os.chdir(directory) # Series files hold paths relative to the library, like mangaget run from it.
+        try:
+            series = readSeries(master_file)
+            for json_file in series.get('chapter_json_files'):
+                readChapterFile(json_file) # Rewrites it in the compact layout.
+            writeSeriesFile(series, master_file)
+        finally:
+            os.chdir(cwd)
+        after = seriesBytes(directory, master_file) + peakRss(AFTER, master_file, directory)
+        report('before', *before, empty_rss)
+        report('after', *after, empty_rss)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+
+from mangabee_parsers import mangabeeHTMLGetImageSrcs
+from mangahere_parsers import mangahereHTMLGetImageSrcs
+from helper import streamImageSrc
+
+###
+### Config
+###
+FIXTURES   = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+CHUNK_SIZE = 8192 # Same as STREAM_CHUNK_SIZE in mangaget.py.
+ROUNDS     = 200
+
+###
+### Functions
+###
+def chunked(html, size):
+    for i in range(0, len(html), size):
+        yield html[i:i + size]
+
+def fullParse(parser_class, html): # What buildPagesAndSrc did: download everything, then parse everything.
+    parser = parser_class()
+    parser.feed(html)
+    return parser.src, len(html)
+
+def streamParse(parser_class, html): # The streaming path: parse as chunks arrive, stop at the <img>.
+    parser = parser_class()
+    consumed = [0]
+    def counting(chunks):
+        for chunk in chunks:
+            consumed[0] += len(chunk)
+            yield chunk
+    src = streamImageSrc(parser, counting(chunked(html, CHUNK_SIZE)))
+    return src, consumed[0]
+
+def bench(name, parse, parser_class, html, rounds):
+    start = time.perf_counter()
+    for i in range(0, rounds):
+        src, consumed = parse(parser_class, html)
+    elapsed = time.perf_counter() - start
+    print("".join([name.ljust(28), str(round(elapsed / rounds * 1000000)).rjust(8), ' us/page ', str(consumed).rjust(8), ' bytes read']))
+    return src
+
+def main(rounds=ROUNDS):
+    for site, parser_class in (('mangahere', mangahereHTMLGetImageSrcs), ('mangabee', mangabeeHTMLGetImageSrcs)):
+        html = open(os.path.join(FIXTURES, "".join([site, '_page.html'])), encoding='utf-8').read()
+        full = bench("".join([site, ' full parse']), fullParse, parser_class, html, rounds)
+        stream = bench("".join([site, ' streaming']), streamParse, parser_class, html, rounds)
+        if (full != stream):
+            print("".join(['src mismatch on ', site, ': ', str(full), ' != ', str(stream)]))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else ROUNDS))
@@ -0,0 +1,230 @@
+import sys
+import time
+import zlib
+import random
+import threading
+import urllib.parse
+import http.server
+
+import click
+
+###
+### Config
+###
+FILLER = '\n'.join(['<li class="c%d">lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor</li>' % (i % 7) for i in range(0, 200)]) # Bulk the real pages carried around the bits we parse.
+
+###
+### Classes
+###
+class standInConfig():
+    def __init__(self, chapters=1000, pages=20, image_size=200000, latency=0.0, throttle=0, error_rate=0.0, series=('tokyo_ghoul',)):
+        self.chapters = chapters       # Chapters per series.
+        self.pages = pages             # Pages per chapter.
+        self.image_size = image_size   # Bytes per synthetic image.
+        self.latency = latency         # Seconds added before every response.
+        self.throttle = throttle       # Bytes per second per response, 0 for unlimited.
+        self.error_rate = error_rate   # Fraction of requests answered with a 503.
+        self.series = list(series)     # Series names every search returns.
+        self.chapter_counts = {}       # {'tokyo_ghoul': 20} overrides chapters for one series.
+        self.opaque_srcs = False       # Tack a per page token onto mangabee image srcs so they can't be predicted from each other.
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+
+    def chaptersOf(self, name):
+        return self.chapter_counts.get(name, self.chapters)
+
+    def mirror(self, latency=None, error_rate=None):
+        # Same series and images, its own delay, errors and counters. Serves as an image mirror of this one.
+        config = standInConfig(self.chapters, self.pages, self.image_size, self.latency if latency is None else latency, self.throttle,
+                               self.error_rate if error_rate is None else error_rate, self.series)
+        config.chapter_counts = self.chapter_counts
+        config.opaque_srcs = self.opaque_srcs
+        return config
+
+
+class standInHandler(http.server.BaseHTTPRequestHandler):
+    # Serves html in the formats mangahere_parsers.py / mangabee_parsers.py expect, plus synthetic images with Range support.
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # Headers and body go out in separate writes, don't let delayed ACKs stall them.
+    site = None   # 'mangahere' or 'mangabee', set on the per-site subclass.
+    config = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond()
+
+    def respond(self, head=False):
+        config = self.config
+        with config.lock:
+            config.requests += 1
+        if (config.latency):
+            time.sleep(config.latency)
+        if (config.error_rate and random.random() < config.error_rate):
+            return self.send(503, b'Service Unavailable', 'text/plain', head)
+        path = urllib.parse.urlsplit(self.path)
+        parts = [urllib.parse.unquote(p) for p in path.path.split('/') if p]
+        if (parts[:1] == ['img']):
+            return self.sendImage(parts, head)
+        html = self.mangahere(parts, path.query) if self.site == 'mangahere' else self.mangabee(parts)
+        if (html is None):
+            return self.send(404, b'Not Found', 'text/plain', head)
+        body = html.encode('utf-8')
+        etag = "".join(['"', '%08x' % zlib.crc32(body), '"'])
+        if (self.headers.get('If-None-Match') == etag): # Conditional request for a page that hasn't changed.
+            return self.send(304, b'', 'text/html; charset=utf-8', head, etag=etag)
+        return self.send(200, body, 'text/html; charset=utf-8', head, etag=etag)
+
+    def base(self):
+        return "".join(['http://', self.headers.get('Host')])
+
+    ### mangahere ###
+    def mangahere(self, parts, query):
+        base = self.base()
+        if (parts == ['search.php']):
+            links = ''.join(['<dl><dt><a class="manga_info name_one" href="%s/manga/%s/">%s</a></dt></dl>\n' % (base, name, name) for name in self.config.series])
+            return page('<div class="result_search">\n%s</div>' % links)
+        if (len(parts) == 2 and parts[0] == 'manga'):             # /manga/<name>/
+            name = parts[1]
+            links = ''.join(['<li><span class="left"><a class="color_0077" href="%s/manga/%s/c%03d/">%s %d</a></span></li>\n' % (base, name, i, name, i) for i in range(self.config.chaptersOf(name), 0, -1)])
+            return page('<div class="detail_list"><ul>\n%s</ul></div>\n<div class="all_commet"><a href="%s/manga/other/">other</a></div>' % (links, base))
+        if (len(parts) in (3, 4) and parts[0] == 'manga'):        # /manga/<name>/c001/ and /manga/<name>/c001/2.html
+            name, chapter = parts[1], parts[2]
+            number = int(parts[3].split('.')[0]) if len(parts) == 4 else 1
+            options = ''.join(['<option value="%s/manga/%s/%s/%s">%d</option>\n' % (base, name, chapter, '' if i == 1 else '%d.html' % i, i) for i in range(1, self.config.pages + 1)])
+            select = '<select class="wid60" onchange="change_page(this)">\n%s</select>' % options
+            img = '<section class="read_img" id="viewer"><a href="#"><img src="%s/img/%s/%s/%03d.jpg" id="image"></a></section>' % (base, name, chapter, number)
+            return page('<section class="readpage_top">%s</section>\n%s\n<section class="readpage_footer">%s</section>' % (select, img, select))
+        return None
+
+    ### mangabee ###
+    def mangabee(self, parts):
+        base = self.base()
+        if (parts[:2] == ['manga-list', 'search']):
+            links = ''.join(['<div class="nde"><div class="cvr"><a href="%s/%s/"><img src="%s/img/cover.jpg"></a></div></div>\n' % (base, name, base) for name in self.config.series])
+            return page(links)
+        if (len(parts) in (2, 3)):                                # /<name>/<chapter> and /<name>/<chapter>/<page>
+            name, chapter = parts[0], parts[1]
+            number = int(parts[2]) if len(parts) == 3 else 1
+            chapters = ''.join(['<option value="%d">%d - %s %d</option>\n' % (i, i, name, i) for i in range(self.config.chaptersOf(name), 0, -1)])
+            pages = ''.join(['<option value="%d">%d</option>\n' % (i, i) for i in range(1, self.config.pages + 1)])
+            nav = '<div class="wpm_nav"><select class="cbo_wpm_chp">\n%s</select>\n<select class="cbo_wpm_pag">\n%s</select></div>' % (chapters, pages)
+            token = '?t=%08x' % zlib.crc32(('%s/%s/%d' % (name, chapter, number)).encode('utf-8')) if self.config.opaque_srcs else ''
+            img = '<div class="prw"><a href="#"><img src="%s/img/%s/%s/%03d.jpg%s" class="manga-page"></a></div>' % (base, name, chapter, number, token)
+            return page('%s\n<div class="clr"></div>\n%s\n%s' % (nav, img, nav))
+        return None
+
+    ### images ###
+    def sendImage(self, parts, head):
+        body = syntheticImage('/'.join(parts), self.config.image_size)
+        start, end = 0, len(body) - 1
+        status = 200
+        byte_range = self.headers.get('Range')
+        if (byte_range and byte_range.startswith('bytes=')):
+            first, last = byte_range[6:].split('-', 1)
+            start = int(first) if first else 0
+            end = min(int(last), end) if last else end
+            if (start >= len(body)):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % len(body))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+        return self.send(status, body[start:end + 1], 'image/jpeg', head, content_range=(start, end, len(body)) if status == 206 else None)
+
+    def send(self, status, body, content_type, head=False, content_range=None, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if (status != 304):
+            self.send_header('Content-Length', str(len(body)))
+        if (etag):
+            self.send_header('ETag', etag)
+        if (content_range):
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % content_range)
+        self.end_headers()
+        if (head):
+            return
+        throttle = self.config.throttle
+        step = max(1024, throttle // 10) if throttle else max(1, len(body))
+        try:
+            for i in range(0, len(body), step):
+                self.wfile.write(body[i:i + step])
+                if (throttle):
+                    time.sleep(step / throttle)
+        except (BrokenPipeError, ConnectionResetError): # Client hung up early, e.g. streaming parsers.
+            self.close_connection = True
+            return
+        with self.config.lock:
+            self.config.bytes += len(body)
+
+
+class standInServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address): # Clients hanging up mid-response is expected, e.g. the streaming parsers.
+        if (not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError))):
+            http.server.ThreadingHTTPServer.handle_error(self, request, client_address)
+
+###
+### Functions
+###
+def page(body):
+    return '<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>stand-in</title></head>\n<body>\n<ul class="header">%s</ul>\n%s\n<ul class="footer">%s</ul>\n</body>\n</html>\n' % (FILLER, body, FILLER)
+
+_image_cache = {}
+def syntheticImage(key, size):
+    # JPEG markers around filler, with the key up front so every page hashes differently.
+    filler = _image_cache.get(size)
+    if (filler is None):
+        rng = random.Random(size)
+        filler = bytes(rng.getrandbits(8) for i in range(0, min(size, 65536)))
+        filler = (filler * (size // len(filler) + 1))[:size]
+        _image_cache[size] = filler
+    head = b''.join([b'\xff\xd8\xff\xe0', key.encode('utf-8')])
+    return b''.join([head, filler[len(head):max(len(head), size - 2)], b'\xff\xd9'])
+
+def startStandIn(site, config, port=0, host='127.0.0.1'):
+    # Starts one site's stand-in on a background thread. Returns (server, 'http://127.0.0.1:port').
+    handler = type("".join([site, 'Handler']), (standInHandler,), {'site': site, 'config': config})
+    server = standInServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, "".join(['http://', host, ':', str(server.server_port)])
+
+@click.command()
+@click.option('--mangahere_port', default=8801, help='Port for the mangahere stand-in.')
+@click.option('--mangabee_port', default=8802, help='Port for the mangabee stand-in.')
+@click.option('--chapters', default=1000, help='Chapters per series.')
+@click.option('--pages', default=20, help='Pages per chapter.')
+@click.option('--image_size', default=200000, help='Bytes per synthetic image.')
+@click.option('--latency', default=0.0, help='Seconds of delay added to every response.')
+@click.option('--throttle', default=0, help='Bytes per second per response. 0 for unlimited.')
+@click.option('--error_rate', default=0.0, help='Fraction of requests answered with a 503.')
+@click.option('--opaque_srcs', is_flag=True, help='Make mangabee image srcs unpredictable from one another.')
+@click.option('--mirror_latency', multiple=True, type=float, help='Start an image mirror of each site with this latency. Repeat for more mirrors.')
+def serve(mangahere_port, mangabee_port, chapters, pages, image_size, latency, throttle, error_rate, opaque_srcs, mirror_latency):
+    """Local stand-in for mangahere and mangabee."""
+    config = standInConfig(chapters, pages, image_size, latency, throttle, error_rate)
+    config.opaque_srcs = opaque_srcs
+    for site, port in (('mangahere', mangahere_port), ('mangabee', mangabee_port)):
+        server, url = startStandIn(site, config, port)
+        print("".join([site, ' stand-in on ', url]))
+        hosts = [url.split('//', 1)[1]]
+        for seconds in mirror_latency:
+            hosts.append(startStandIn(site, config.mirror(latency=seconds))[1].split('//', 1)[1])
+        if (mirror_latency):
+            print("".join(['  mirrors: --mirrors ', ','.join(hosts)]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import statistics
+import subprocess
+
+import click
+
+from bench_server import standInConfig, startStandIn
+
+###
+### Config
+###
+WATCHED = ('mangahere_parsers', 'mangabee_parsers', 'eventlet', 'PIL', 'natsort', 'sqlite3', 'asyncio') # Modules worth knowing about.
+
+# Runs mangaget.py as __main__ and prints sys.modules on the way out. -X importtime would miss the adapters, which are
+# imported through importlib.import_module.
+RUNNER = '''import sys, atexit, runpy
+atexit.register(lambda: sys.stderr.write('MODULES ' + ' '.join(sorted(sys.modules)) + chr(10)))
+sys.argv = sys.argv[1:]
+sys.path.insert(0, __import__('os').path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+###
+### Functions
+###
+def importedModules(stderr): # Module names RUNNER printed.
+    for line in stderr.splitlines():
+        if (line.startswith('MODULES ')):
+            return set(line.split(' ')[1:])
+    return set()
+
+def timeCommand(tree, args, cwd, rounds):
+    # (median seconds, modules imported by the last run) for python <tree>/mangaget.py <args>.
+    times = []
+    stderr = ''
+    for i in range(0, rounds):
+        started = time.perf_counter()
+        done = subprocess.run([sys.executable, '-c', RUNNER, os.path.join(tree, 'mangaget.py')] + args, cwd=cwd, capture_output=True, text=True)
+        times.append(time.perf_counter() - started)
+        stderr = done.stderr
+    return statistics.median(times), importedModules(stderr)
+
+def report(name, seconds, modules):
+    watched = [module for module in WATCHED if module in modules]
+    print("".join([name.ljust(24), str(round(seconds * 1000)).rjust(6), ' ms ', str(len(modules)).rjust(5), ' modules  loaded: ', ', '.join(watched) if watched else '-']))
+
+@click.command()
+@click.option('--tree', default=os.path.dirname(os.path.abspath(__file__)), help='mangaget checkout to time, e.g. an older one to compare with.')
+@click.option('--rounds', default=5, help='Runs per command, the median is reported.')
+@click.option('--chapters', default=3, help='Chapters in the stand-in series downloaded by the single series run.')
+def benchmark(tree, rounds, chapters):
+    """Times mangaget --help and a one series --batch run in fresh interpreters, and lists the heavy modules each one imported."""
+    config = standInConfig(chapters=chapters, pages=5, image_size=20000, series=('startup',))
+    server, url = startStandIn('mangahere', config)
+    directory = tempfile.mkdtemp(prefix='mangaget-startup-')
+    try:
+        with open(os.path.join(directory, 'one.txt'), 'w') as f:
+            f.write("".join(['mangahere | ', url, '/manga/startup/\n']))
+        report('mangaget --help', *timeCommand(tree, ['--help'], directory, rounds))
+        seconds, modules = timeCommand(tree, ['--batch', 'one.txt', '--update'], directory, 1) # Downloads once, later rounds find nothing new.
+        report('one series (download)', seconds, modules)
+        report('one series (up to date)', *timeCommand(tree, ['--batch', 'one.txt', '--update'], directory, rounds))
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    benchmark()
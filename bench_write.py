@@ -0,0 +1,76 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+import click
+
+from bench_server import standInConfig, startStandIn
+
+###
+### Config
+###
+# Downloads every page with requestFile of the tree given, one after another so the numbers are the write loop and not thread
+# contention. Prints CPU seconds, wall seconds and bytes of the download loop only.
+RUNNER = '''import os, sys, time
+sys.path.insert(0, sys.argv[1])
+import mangaget
+args = sys.argv[4:]
+if (hasattr(mangaget, 'configureWriter') and args):
+    mangaget.configureWriter(int(args[0]) * 1024, args[1] == 'preallocate', args[2])
+url, pages = sys.argv[2], int(sys.argv[3])
+paths = ['%03d.jpg' % i for i in range(0, pages)]
+mangaget.requestFile('warm.jpg', url + '/img/bench/c000/000.jpg') # Connection, imports and first use out of the way.
+cpu, wall = time.process_time(), time.perf_counter()
+for i, path in enumerate(paths):
+    mangaget.requestFile(path, url + '/img/bench/c001/%03d.jpg' % (i + 1))
+if (hasattr(mangaget, 'getWriter')): # What downloadPages does once a chapter is done.
+    mangaget.getWriter().syncChapter(paths)
+cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+print(cpu, wall, sum(os.path.getsize(path) for path in paths))
+'''
+
+###
+### Functions
+###
+def runTree(tree, url, pages, settings, cwd):
+    done = subprocess.run([sys.executable, '-c', RUNNER, tree, url, str(pages)] + list(settings), cwd=cwd, capture_output=True, text=True, check=True)
+    cpu, wall, size = done.stdout.split()
+    return float(cpu), float(wall), int(size)
+
+def report(name, cpu, wall, size):
+    megs = size / 1000000
+    print("".join([name.ljust(32), str(round(megs, 1)).rjust(7), ' MB ', str(round(cpu * 1000 / megs, 2)).rjust(7), ' ms CPU/MB ',
+                   str(round(megs / wall, 1)).rjust(7), ' MB/s']))
+
+@click.command()
+@click.option('--tree', default=None, help='Another mangaget checkout to compare with, e.g. one from before the readinto write path.')
+@click.option('--pages', default=200, help='Pages downloaded per run.')
+@click.option('--image_size', default=2000000, help='Bytes per page.')
+@click.option('--rounds', default=3, help='Runs per setting, the one with the least CPU is reported.')
+def benchmark(tree, pages, image_size, rounds):
+    """CPU per MB of downloading pages from the local stand-in, per read size, preallocation and fsync policy."""
+    config = standInConfig(chapters=1, pages=pages, image_size=image_size, series=('bench',))
+    server, url = startStandIn('mangahere', config)
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = [("".join([kb, 'KB reads', ', preallocated' if allocate == 'preallocate' else '', '' if fsync == 'never' else "".join([', fsync ', fsync])]), here, (kb, allocate, fsync))
+            for kb, allocate, fsync in (('4', 'no', 'never'), ('64', 'no', 'never'), ('256', 'no', 'never'), ('1024', 'no', 'never'),
+                                        ('256', 'preallocate', 'never'), ('256', 'no', 'chapter'), ('256', 'no', 'file'))]
+    if (tree):
+        runs.insert(0, ("".join(['--tree ', os.path.basename(os.path.abspath(tree))]), os.path.abspath(tree), ()))
+    try:
+        for name, checkout, settings in runs:
+            results = []
+            for i in range(0, rounds):
+                directory = tempfile.mkdtemp(prefix='mangaget-write-')
+                try:
+                    results.append(runTree(checkout, url, pages, settings, directory))
+                finally:
+                    shutil.rmtree(directory, ignore_errors=True)
+            report(name, *min(results))
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+import json
+import socket
+import shutil
+import tempfile
+import multiprocessing
+
+import click
+
+from bench_server import standInConfig, startStandIn
+
+###
+### Config
+###
+BIG_SERIES   = 'bench_big'   # The long series, used for search, setup and page resolution.
+SMALL_SERIES = 'bench_small' # Downloaded in full and then re-verified with --check.
+
+###
+### Functions
+###
+def freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def runStandIn(ports, settings, chapter_counts, opaque_srcs=False):
+    # Runs in its own process so the server doesn't compete with mangaget for the GIL.
+    config = standInConfig(series=(BIG_SERIES, SMALL_SERIES), **settings)
+    config.chapter_counts = chapter_counts
+    config.opaque_srcs = opaque_srcs
+    for site, port in ports.items():
+        startStandIn(site, config, port)
+    while True:
+        time.sleep(3600)
+
+def waitForPort(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def peakRssMegs():
+    try:
+        import resource
+    except ImportError: # Windows.
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 if sys.platform != 'darwin' else peak / 1048576, 1) # KB on Linux, bytes on macOS.
+
+def directoryBytes(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            if (name.endswith('.jpg')):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def measure(results, site, name, work, chapters=0, pages=0, data_path=None):
+    start = time.perf_counter()
+    before = directoryBytes(data_path) if data_path else 0
+    work()
+    elapsed = time.perf_counter() - start
+    written = (directoryBytes(data_path) - before) if data_path else 0
+    row = {'site': site, 'scenario': name, 'seconds': round(elapsed, 3),
+           'chapters_per_sec': round(chapters / elapsed, 2) if chapters else None,
+           'pages_per_sec': round(pages / elapsed, 2) if pages else None,
+           'mb_per_sec': round(written / 1000000 / elapsed, 2) if written else None,
+           'peak_rss_mb': peakRssMegs()}
+    results.append(row)
+    print("".join([site.ljust(10), name.ljust(10), str(row['seconds']).rjust(9), 's',
+                   '  chapters/s ', str(row['chapters_per_sec']).rjust(8),
+                   '  pages/s ', str(row['pages_per_sec']).rjust(9),
+                   '  MB/s ', str(row['mb_per_sec']).rjust(7),
+                   '  peak RSS ', str(row['peak_rss_mb']), 'MB']))
+    return row
+
+def runSite(mangaget, site, chapters, pages, resolve_chapters, download_chapters, searches, results):
+    search_results = []
+    measure(results, site, 'search', lambda: search_results.extend([mangaget.search('bench', site) for i in range(0, searches)][-1]))
+    big_url = [url for url in search_results if BIG_SERIES in url][0]
+    small_url = [url for url in search_results if SMALL_SERIES in url][0]
+
+    master = {}
+    def setup():
+        master.update(mangaget.createMasterChapterIntegrityFile(mangaget.initializeSetup(big_url, site), site))
+    measure(results, site, 'setup', setup, chapters=chapters)
+
+    measure(results, site, 'resolve', lambda: mangaget.updateIntegrityFiles(master['file_path'], 1, resolve_chapters),
+            chapters=resolve_chapters, pages=resolve_chapters * (pages + 1))
+
+    small = {}
+    def download():
+        small.update(mangaget.createMasterChapterIntegrityFile(mangaget.initializeSetup(small_url, site), site))
+        mangaget.updateIntegrityFiles(small['file_path'])
+        mangaget.downloadManga(small['file_path'])
+    measure(results, site, 'download', download, chapters=download_chapters, pages=download_chapters * pages, data_path=site)
+
+    measure(results, site, 'check', lambda: mangaget.checkChapterIntegrity(SMALL_SERIES, site),
+            chapters=download_chapters, pages=download_chapters * pages)
+
+@click.command()
+@click.option('--chapters', default=1000, help='Chapters in the long series.')
+@click.option('--pages', default=20, help='Pages per chapter.')
+@click.option('--resolve_chapters', default=0, help='Chapters of the long series to resolve page srcs for. 0 for all.')
+@click.option('--download_chapters', default=10, help='Chapters in the series that gets downloaded and re-verified.')
+@click.option('--image_size', default=200000, help='Bytes per synthetic image.')
+@click.option('--latency', default=0.0, help='Seconds of delay the stand-in adds to every response.')
+@click.option('--throttle', default=0, help='Bytes per second per response from the stand-in. 0 for unlimited.')
+@click.option('--error_rate', default=0.0, help='Fraction of stand-in responses that are 503s.')
+@click.option('--searches', default=20, help='Search requests to time.')
+@click.option('--sites', default='mangahere,mangabee', help='Comma separated sites to run.')
+@click.option('--engine', default='threads', type=click.Choice(['threads', 'async']), help='Download engine to benchmark.')
+@click.option('--mangabee_resolve', default='full', type=click.Choice(['full', 'predict']), help='How mangabee page srcs are resolved.')
+@click.option('--predict_confirm', default='head', type=click.Choice(['head', 'download']), help='How predicted mangabee srcs are confirmed.')
+@click.option('--opaque_srcs', is_flag=True, help='Make the stand-in\'s mangabee srcs unpredictable, to time the fallback.')
+@click.option('--cache', is_flag=True, help='Put the html response cache in front of the run, with every entry revalidated (TTL 0).')
+@click.option('--keep_sleeps', is_flag=True, help='Keep the politeness sleeps. They dominate wall time, so they are off by default.')
+@click.option('--output', default=None, help='Write the results as json to this file.')
+@click.option('--workdir', default=None, help='Directory to download into. A temporary one is used and removed by default.')
+def benchmark(chapters, pages, resolve_chapters, download_chapters, image_size, latency, throttle, error_rate, searches, sites, engine, mangabee_resolve, predict_confirm, opaque_srcs, cache, keep_sleeps, output, workdir):
+    """Runs mangaget end to end against a local stand-in for mangahere and mangabee."""
+    sites = [site.strip() for site in sites.split(',') if site.strip()]
+    ports = {site: freePort() for site in sites}
+    settings = dict(chapters=chapters, pages=pages, image_size=image_size, latency=latency, throttle=throttle, error_rate=error_rate)
+    server = multiprocessing.Process(target=runStandIn, args=(ports, settings, {SMALL_SERIES: download_chapters}, opaque_srcs), daemon=True)
+    server.start()
+    for port in ports.values():
+        if (not waitForPort(port)):
+            print('Stand-in server did not start.')
+            sys.exit(1)
+
+    output = os.path.abspath(output) if output else None
+    cwd = os.getcwd()
+    directory = os.path.abspath(workdir) if workdir else tempfile.mkdtemp(prefix='mangaget-bench-')
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory) # mangaget writes its trees and log relative to the working directory.
+    results = []
+    metrics = None
+    try:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import mangaget
+        for site in sites:
+            mangaget.getSite(site).url = "".join(['http://127.0.0.1:', str(ports.get(site))])
+        mangaget.download_engine = engine
+        mangaget.mangabee_resolve = mangabee_resolve
+        mangaget.predict_confirm = predict_confirm
+        if (cache):
+            mangaget.cache = mangaget.responseCache('.mangaget_cache', ttls={'search': 0, 'setup': 0, 'page_resolve': 0})
+        if (not keep_sleeps):
+            mangaget.randomSleep = lambda start, to: 0
+        for site in sites:
+            runSite(mangaget, site, chapters, pages, resolve_chapters if resolve_chapters else chapters, download_chapters, searches, results)
+        metrics = mangaget.getMetrics().summary()
+    finally:
+        os.chdir(cwd)
+        server.terminate()
+        if (not workdir):
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if (output):
+        with open(output, 'w') as f:
+            json.dump({'settings': dict(settings, engine=engine, cache=cache, mangabee_resolve=mangabee_resolve, predict_confirm=predict_confirm, opaque_srcs=opaque_srcs), 'results': results, 'metrics': metrics}, f, indent=2)
+
+if __name__ == "__main__":
+    benchmark()
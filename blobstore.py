@@ -0,0 +1,153 @@
+import os
+import hashlib
+import logging
+import sqlite3
+import zipfile
+import threading
+
+from helper import timestamp
+from verification import HASH_ALGORITHM, hashFile
+
+###
+### Config
+###
+DEFAULT_BLOB_DIRECTORY = 'blobs'
+PARTIAL_HASH_BYTES     = 65536 # Head of a page hashed to tell it apart from other pages of the same size.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    sha1           TEXT PRIMARY KEY,
+    size           INTEGER NOT NULL,
+    partial        TEXT NOT NULL,
+    path           TEXT NOT NULL,
+    member         TEXT
+);
+CREATE INDEX IF NOT EXISTS blobs_head ON blobs (size, partial);
+'''
+
+###
+### Classes
+###
+class blobStore():
+    # Pages stored once under <root>/ab/abcdef..., keyed by their sha1. Chapter directories hard link to the blob, so a credits
+    # page repeated in 300 chapters takes the disk space of one. Pages inside a .cbz can't be links, their index entry points at
+    # the archive member instead (path, member) so the bytes can still be copied instead of downloaded again.
+    # The index also keys every blob by (size, hash of its first PARTIAL_HASH_BYTES), which is all a download has seen by the
+    # time it can stop reading.
+    def __init__(self, root=DEFAULT_BLOB_DIRECTORY):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(os.path.join(root, 'index.db'), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self.sizes = set(row['size'] for row in self.conn.execute('SELECT size FROM blobs')) # Checked on every download, kept in memory.
+        self.reused = 0         # Pages taken from the store instead of the network.
+        self.reused_bytes = 0   # Bytes not downloaded because of that.
+        self.reclaimed = 0      # Bytes of duplicate files replaced by links.
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def blobPath(self, sha1):
+        return os.path.join(self.root, sha1[:2], sha1)
+
+    def hasSize(self, size):
+        return size in self.sizes
+
+    def find(self, sha1):
+        with self.lock:
+            return self.valid(self.conn.execute('SELECT * FROM blobs WHERE sha1 = ?', (sha1,)).fetchone())
+
+    def lookup(self, size, partial):
+        with self.lock:
+            return self.valid(self.conn.execute('SELECT * FROM blobs WHERE size = ? AND partial = ?', (size, partial)).fetchone())
+
+    def valid(self, row): # Drops entries whose file was deleted out from under the store.
+        if (row is None or os.path.isfile(row['path']) or (row['member'] is not None and os.path.isfile("".join([row['path'], '.part'])))):
+            return row
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM blobs WHERE sha1 = ?', (row['sha1'],))
+        return None
+
+    def read(self, row): # The blob's bytes, None when it can't be read any more.
+        try:
+            if (row['member'] is None):
+                with open(row['path'], 'rb') as f:
+                    return f.read()
+            with zipfile.ZipFile(row['path'] if os.path.isfile(row['path']) else "".join([row['path'], '.part'])) as archive: # Chapter still in progress.
+                return archive.read(row['member'])
+        except (OSError, KeyError, zipfile.BadZipFile):
+            return None
+
+    def linkTo(self, row, output): # output becomes the blob, a hard link when the blob is a file. True on success.
+        temporary = "".join([output, '.link'])
+        try:
+            if (row['member'] is None):
+                os.link(row['path'], temporary)
+            else:
+                data = self.read(row)
+                if (data is None):
+                    return False
+                with open(temporary, 'wb') as f:
+                    f.write(data)
+            os.replace(temporary, output)
+        except OSError as exc:
+            logging.debug("".join([timestamp(), ' Could not link ', output, ' to blob ', row['sha1'], ': ', repr(exc)]))
+            return False
+        self.countReuse(row['size'])
+        return True
+
+    def countReuse(self, size):
+        with self.lock:
+            self.reused += 1
+            self.reused_bytes += size
+
+    def addFile(self, path, sha1=None):
+        # Stores a page file, or replaces it with a link to the blob already holding the same bytes. Returns the bytes reclaimed.
+        reclaimed = 0
+        try:
+            sha1 = sha1 if sha1 else hashFile(path)
+            blob = self.blobPath(sha1)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            try:
+                os.link(path, blob) # First copy seen becomes the blob.
+            except FileExistsError:
+                pass
+            if (not os.path.samefile(blob, path)):
+                reclaimed = os.path.getsize(path)
+                temporary = "".join([path, '.link'])
+                os.link(blob, temporary)
+                os.replace(temporary, path)
+            row = self.find(sha1)
+            if (row is None or row['member'] is not None):
+                with open(blob, 'rb') as f:
+                    self.index(sha1, os.path.getsize(blob), partialHash(f.read(PARTIAL_HASH_BYTES)), blob, None)
+        except OSError as exc: # No hard links on this file system, or the page went away.
+            logging.debug("".join([timestamp(), ' Could not add ', path, ' to the blob store: ', repr(exc)]))
+        with self.lock:
+            self.reclaimed += reclaimed
+        return reclaimed
+
+    def addMember(self, archive_path, member, data):
+        # Indexes a page stored in a .cbz. Blob files win over members, a member only fills the gap.
+        sha1 = hashlib.new(HASH_ALGORITHM, data).hexdigest()
+        if (self.find(sha1) is None):
+            self.index(sha1, len(data), partialHash(data[:PARTIAL_HASH_BYTES]), archive_path, member)
+
+    def index(self, sha1, size, partial, path, member):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO blobs (sha1, size, partial, path, member) VALUES (?, ?, ?, ?, ?)', (sha1, size, partial, path, member))
+            self.sizes.add(size)
+
+    def statsLine(self):
+        return "".join(['Blob store: ', str(self.reused), ' pages (', str(round(self.reused_bytes / 1000000, 2)), 'MB) reused instead of downloaded, ',
+                        str(round(self.reclaimed / 1000000, 2)), 'MB of duplicates replaced by links'])
+
+###
+### Functions
+###
+def partialHash(data):
+    return hashlib.new(HASH_ALGORITHM, data).hexdigest()
@@ -0,0 +1,241 @@
+import os
+import glob
+import sqlite3
+import threading
+
+from manifest import readSeries, readChapterFile
+
+###
+### Config
+###
+DEFAULT_CATALOG = 'mangaget.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS series (
+    id             INTEGER PRIMARY KEY,
+    manga_site     TEXT NOT NULL,
+    manga_name     TEXT NOT NULL,
+    search_url     TEXT,
+    base_directory TEXT,
+    UNIQUE (manga_site, manga_name)
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    id             INTEGER PRIMARY KEY,
+    series_id      INTEGER NOT NULL REFERENCES series(id),
+    position       INTEGER NOT NULL,
+    chapter_number TEXT,
+    chapter_url    TEXT NOT NULL,
+    directory      TEXT NOT NULL UNIQUE,
+    resolved       INTEGER NOT NULL DEFAULT 0,
+    downloaded     INTEGER NOT NULL DEFAULT 0,
+    length         INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id             INTEGER PRIMARY KEY,
+    chapter_id     INTEGER NOT NULL REFERENCES chapters(id),
+    position       INTEGER NOT NULL,
+    page           TEXT NOT NULL,
+    src            TEXT,
+    path           TEXT NOT NULL,
+    size           INTEGER,
+    mtime          REAL,
+    sha1           TEXT,
+    downloaded     INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (chapter_id, position)
+);
+CREATE TABLE IF NOT EXISTS failed_pages (
+    chapter_id     INTEGER NOT NULL REFERENCES chapters(id),
+    position       INTEGER NOT NULL,
+    page           TEXT,
+    stage          TEXT NOT NULL,
+    error          TEXT,
+    attempts       INTEGER NOT NULL DEFAULT 0,
+    page_url       TEXT,
+    site           TEXT,
+    time           TEXT,
+    PRIMARY KEY (chapter_id, position)
+);
+CREATE TABLE IF NOT EXISTS processed_pages (
+    chapter_id     INTEGER NOT NULL REFERENCES chapters(id),
+    settings       TEXT NOT NULL,
+    position       INTEGER NOT NULL,
+    directory      TEXT,
+    size           INTEGER,
+    PRIMARY KEY (chapter_id, settings, position)
+);
+CREATE INDEX IF NOT EXISTS chapters_state ON chapters (series_id, downloaded, position);
+CREATE INDEX IF NOT EXISTS pages_state ON pages (chapter_id, downloaded);
+CREATE INDEX IF NOT EXISTS pages_missing ON pages (downloaded) WHERE downloaded = 0;
+CREATE INDEX IF NOT EXISTS pages_path ON pages (path);
+'''
+
+###
+### Classes
+###
+class mangaCatalog():
+    # Series, chapters and pages in one SQLite file. Every write is its own transaction, so a crash loses at most the page in flight.
+    def __init__(self, path=DEFAULT_CATALOG):
+        self.path = path
+        self.lock = threading.RLock() # One connection shared by the worker threads, serialised here.
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    ### Series and chapters ###
+    def saveSeries(self, master_data):
+        # master_data is what createMasterChapterIntegrityFile writes to <manga>_chapters.json.
+        with self.lock, self.conn:
+            self.conn.execute('INSERT INTO series (manga_site, manga_name, search_url, base_directory) VALUES (?, ?, ?, ?) '
+                              'ON CONFLICT (manga_site, manga_name) DO UPDATE SET search_url=excluded.search_url, base_directory=excluded.base_directory',
+                              (master_data.get('root_directory'), master_data.get('manga_name'), master_data.get('search_url'), master_data.get('base_directory')))
+            series_id = self.seriesId(master_data.get('root_directory'), master_data.get('manga_name'))
+            rows = zip(master_data.get('chapter_numbers'), master_data.get('chapter_urls'), master_data.get('chapter_directories'))
+            for position, (chapter_number, chapter_url, directory) in enumerate(rows):
+                self.conn.execute('INSERT INTO chapters (series_id, position, chapter_number, chapter_url, directory) VALUES (?, ?, ?, ?, ?) '
+                                  'ON CONFLICT (directory) DO UPDATE SET position=excluded.position, chapter_url=excluded.chapter_url',
+                                  (series_id, position, str(chapter_number), chapter_url, directory))
+        return series_id
+
+    def seriesId(self, manga_site, manga_name):
+        with self.lock:
+            row = self.conn.execute('SELECT id FROM series WHERE manga_site = ? AND manga_name = ?', (manga_site, manga_name)).fetchone()
+        return row['id'] if row else None
+
+    def chapterId(self, directory):
+        with self.lock:
+            row = self.conn.execute('SELECT id FROM chapters WHERE directory = ?', (directory,)).fetchone()
+        return row['id'] if row else None
+
+    def hasChapter(self, directory): # Page srcs have been resolved for this chapter.
+        with self.lock:
+            row = self.conn.execute('SELECT resolved FROM chapters WHERE directory = ?', (directory,)).fetchone()
+        return bool(row and row['resolved'])
+
+    def saveChapter(self, data):
+        # data is a chapter integrity dict from generateChapterIntegrityData. Upserts its pages in one transaction, rows past the
+        # chapter's length are dropped. Pages marked as they landed keep their rows until this overwrites them with the same state.
+        manifest = data.get('page_manifest') or [None] * len(data.get('image_files_paths'))
+        downloaded = 1 if data.get('downloaded') == 'Downloaded' else 0
+        with self.lock, self.conn:
+            chapter_id = self.chapterId(data.get('directory'))
+            if (chapter_id is None): # Chapter json imported without its master record.
+                cursor = self.conn.execute('INSERT INTO chapters (series_id, position, chapter_number, chapter_url, directory) VALUES (0, 0, ?, ?, ?)',
+                                           (str(data.get('chapter_number')), data.get('chapter_url'), data.get('directory')))
+                chapter_id = cursor.lastrowid
+            self.conn.execute('UPDATE chapters SET resolved = 1, downloaded = ?, length = ?, chapter_url = ? WHERE id = ?',
+                              (downloaded, data.get('len'), data.get('chapter_url'), chapter_id))
+            for position, (dic, path, record) in enumerate(zip(data.get('pages_and_src'), data.get('image_files_paths'), manifest)):
+                record = record or {}
+                self.conn.execute('INSERT INTO pages (chapter_id, position, page, src, path, size, mtime, sha1, downloaded) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                                  'ON CONFLICT (chapter_id, position) DO UPDATE SET page=excluded.page, src=excluded.src, path=excluded.path, '
+                                  'size=excluded.size, mtime=excluded.mtime, sha1=excluded.sha1, downloaded=excluded.downloaded',
+                                  (chapter_id, position, dic.get('page'), dic.get('src'), path, record.get('size'), record.get('mtime'), record.get('sha1'), 1 if record else 0))
+            self.conn.execute('DELETE FROM pages WHERE chapter_id = ? AND position >= ?', (chapter_id, len(data.get('image_files_paths'))))
+            self.conn.execute('DELETE FROM failed_pages WHERE chapter_id = ?', (chapter_id,))
+            for entry in data.get('failed_pages') or []:
+                self.conn.execute('INSERT INTO failed_pages (chapter_id, position, page, stage, error, attempts, page_url, site, time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                  (chapter_id, entry.get('position'), entry.get('page'), entry.get('stage'), entry.get('error'), entry.get('attempts', 0),
+                                   entry.get('page_url'), entry.get('site'), entry.get('time')))
+            self.conn.execute('DELETE FROM processed_pages WHERE chapter_id = ?', (chapter_id,))
+            for settings, processed in (data.get('processed') or {}).items():
+                for position, size in enumerate(processed.get('sizes')):
+                    self.conn.execute('INSERT INTO processed_pages (chapter_id, settings, position, directory, size) VALUES (?, ?, ?, ?, ?)',
+                                      (chapter_id, settings, position, processed.get('directory'), size))
+        return chapter_id
+
+    def loadChapter(self, directory):
+        # Same shape as the chapter json file so the rest of mangaget doesn't care where it came from.
+        with self.lock:
+            chapter = self.conn.execute('SELECT chapters.*, series.base_directory, series.manga_site FROM chapters LEFT JOIN series ON series.id = chapters.series_id '
+                                        'WHERE directory = ?', (directory,)).fetchone()
+            if (chapter is None or not chapter['resolved']):
+                return None
+            pages = self.conn.execute('SELECT * FROM pages WHERE chapter_id = ? ORDER BY position', (chapter['id'],)).fetchall()
+            failed = self.conn.execute('SELECT * FROM failed_pages WHERE chapter_id = ? ORDER BY position', (chapter['id'],)).fetchall()
+            outputs = self.conn.execute('SELECT * FROM processed_pages WHERE chapter_id = ? ORDER BY settings, position', (chapter['id'],)).fetchall()
+        processed = {}
+        for row in outputs: # {settings tag: {'directory', 'sizes'}} like the json file.
+            processed.setdefault(row['settings'], {'directory': row['directory'], 'sizes': []})['sizes'].append(row['size'])
+        manifest = [{'size': p['size'], 'mtime': p['mtime'], 'sha1': p['sha1']} if p['downloaded'] else None for p in pages]
+        return {'downloaded':        'Downloaded' if chapter['downloaded'] else 'Not Downloaded.',
+                'chapter_number':    chapter['chapter_number'],
+                'len':               chapter['length'],
+                'pages_and_src':     [{'page': p['page'], 'src': p['src']} for p in pages],
+                'pages_src':         [p['src'] for p in pages],
+                'image_files_paths': [p['path'] for p in pages],
+                'chapter_url':       chapter['chapter_url'],
+                'directory':         chapter['directory'],
+                'base_directory':    chapter['base_directory'] or os.path.dirname(chapter['directory']),
+                'page_manifest':     manifest,
+                'failed_pages':      [{key: row[key] for key in row.keys() if key != 'chapter_id' and row[key] is not None} for row in failed],
+                'processed':         processed,
+                'manga_site':        chapter['manga_site']}
+
+    ### Page state ###
+    def markPage(self, directory, position, record):
+        # record: {'size', 'mtime', 'sha1'} once the page is on disk, None when it went missing.
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE pages SET size = ?, mtime = ?, sha1 = ?, downloaded = ? '
+                              'WHERE chapter_id = (SELECT id FROM chapters WHERE directory = ?) AND position = ?',
+                              (record.get('size') if record else None, record.get('mtime') if record else None,
+                               record.get('sha1') if record else None, 1 if record else 0, directory, position))
+
+    def markPagePath(self, path, record): # markPage for a page known by its file path, as it lands during a download.
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE pages SET size = ?, mtime = ?, sha1 = ?, downloaded = 1 WHERE path = ?',
+                              (record.get('size'), record.get('mtime'), record.get('sha1'), path))
+
+    def markChapter(self, directory, downloaded):
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE chapters SET downloaded = ? WHERE directory = ?', (1 if downloaded else 0, directory))
+
+    ### Queries ###
+    def missingChapters(self, manga_site, manga_name, start=0, end=0):
+        # Directories of chapters not fully downloaded, in reading order. start/end are 1-based like --select.
+        # Chapters with failed pages are included, their retry only touches those pages.
+        query = 'SELECT directory FROM chapters WHERE series_id = ? AND (downloaded = 0 OR id IN (SELECT chapter_id FROM failed_pages))'
+        params = [self.seriesId(manga_site, manga_name)]
+        if (start > 0):
+            query += ' AND position >= ?'
+            params.append(start - 1)
+        if (end > 0):
+            query += ' AND position < ?'
+            params.append(end)
+        with self.lock:
+            rows = self.conn.execute(query + ' ORDER BY position', params).fetchall()
+        return [row['directory'] for row in rows]
+
+    def missingPages(self, directory=None):
+        # [(directory, position, src, path), ...] for one chapter or the whole library.
+        query = 'SELECT chapters.directory, pages.position, pages.src, pages.path FROM pages JOIN chapters ON chapters.id = pages.chapter_id WHERE pages.downloaded = 0'
+        params = []
+        if (directory):
+            query += ' AND chapters.directory = ?'
+            params.append(directory)
+        with self.lock:
+            rows = self.conn.execute(query + ' ORDER BY chapters.directory, pages.position', params).fetchall()
+        return [tuple(row) for row in rows]
+
+###
+### Functions
+###
+def importJsonTree(catalog, root_directories=('mangahere', 'mangabee')):
+    # One-shot import of existing <site>/<manga>_chapters.json and their chapter json files.
+    series = 0
+    chapters = 0
+    for root_directory in root_directories:
+        for master_file in sorted(glob.glob(os.path.join(root_directory, '*_chapters.json'))):
+            master_data = readSeries(master_file)
+            catalog.saveSeries(master_data)
+            series += 1
+            for json_file in master_data.get('chapter_json_files'):
+                if (os.path.isfile(json_file)):
+                    catalog.saveChapter(readChapterFile(json_file))
+                    chapters += 1
+    return series, chapters
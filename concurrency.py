@@ -0,0 +1,123 @@
+import time
+import threading
+import logging
+
+from helper import timestamp
+from http_client import hostOf
+
+###
+### Config
+###
+DEFAULT_INITIAL        = 4    # Requests in flight per host before anything has been observed.
+DEFAULT_MINIMUM        = 1
+DEFAULT_MAXIMUM        = 50   # What buildPagesAndSrc used to run with unconditionally.
+DEFAULT_LATENCY_TARGET = 2.0  # Seconds to response headers. Slower than this counts as the server struggling.
+DEFAULT_BACKOFF        = 0.5  # Limit is multiplied by this on a struggle signal.
+BACKOFF_STATUSES       = (429, 503) # Statuses that mean slow down, as opposed to a missing page.
+
+###
+### Classes
+###
+class hostLimit():
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.successes = 0       # Since the last increase. One full window of them earns +1.
+        self.last_decrease = 0.0
+
+    def summary(self):
+        return {'limit': self.limit, 'in_flight': self.in_flight}
+
+
+class aimdController():
+    # Additive increase, multiplicative decrease of requests in flight per host, like TCP's congestion window. Every response
+    # under the latency target counts towards growing the limit by one per window, a 429/503, connection error or slow response
+    # cuts it in half. Responses that were already in flight when the cut happened don't cut it again.
+    # With fixed set the limit is pinned, e.g. from --workers.
+    def __init__(self, initial=DEFAULT_INITIAL, minimum=DEFAULT_MINIMUM, maximum=DEFAULT_MAXIMUM, latency_target=DEFAULT_LATENCY_TARGET, backoff=DEFAULT_BACKOFF, fixed=None):
+        self.initial = fixed if fixed else initial
+        self.minimum = minimum
+        self.maximum = fixed if fixed else maximum
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.fixed = fixed
+        self.hosts = {}  # {'z.mhcdn.net': hostLimit}
+        self.condition = threading.Condition()
+
+    def hostLimitOf(self, host):
+        limit = self.hosts.get(host)
+        if (limit is None):
+            limit = self.hosts[host] = hostLimit(self.initial)
+        return limit
+
+    def acquire(self, url): # Blocks until the host has a free slot. Returns the time the request may start.
+        host = hostOf(url)
+        with self.condition:
+            limit = self.hostLimitOf(host)
+            while (limit.in_flight >= limit.limit):
+                self.condition.wait()
+            limit.in_flight += 1
+        return time.time()
+
+    def release(self, url, started, latency=None, status=None, error=None):
+        # latency: seconds to response headers, status: http status, error: exception if the request never got a response.
+        host = hostOf(url)
+        with self.condition:
+            limit = self.hostLimitOf(host)
+            limit.in_flight -= 1
+            if (not self.fixed):
+                if (error is not None or status in BACKOFF_STATUSES or (latency is not None and latency > self.latency_target)):
+                    self.decrease(host, limit, started, self.reason(latency, status, error))
+                elif (status is not None and status < 400):
+                    self.increase(host, limit)
+            self.condition.notify_all()
+
+    def increase(self, host, limit):
+        limit.successes += 1
+        if (limit.successes >= limit.limit and limit.limit < self.maximum):
+            limit.successes = 0
+            limit.limit += 1
+            logging.info("".join([timestamp(), ' Concurrency ', host, ': ', str(limit.limit - 1), ' -> ', str(limit.limit)]))
+
+    def decrease(self, host, limit, started, reason):
+        limit.successes = 0
+        if (started < limit.last_decrease): # Sent before the last cut, it is reporting the same congestion.
+            return
+        old = limit.limit
+        limit.limit = max(self.minimum, int(limit.limit * self.backoff))
+        limit.last_decrease = time.time()
+        logging.info("".join([timestamp(), ' Concurrency ', host, ': ', str(old), ' -> ', str(limit.limit), ' (', reason, ')']))
+
+    def reason(self, latency, status, error):
+        if (error is not None):
+            return type(error).__name__
+        if (status in BACKOFF_STATUSES):
+            return "".join(['http ', str(status)])
+        return "".join([str(round(latency, 2)), 's to first byte'])
+
+    def stats(self):
+        with self.condition:
+            return {host: limit.summary() for host, limit in self.hosts.items()}
+
+    def statsLines(self):
+        return ["".join(['Concurrency ', host, ': ', str(s['limit']), ' in flight allowed']) for host, s in sorted(self.stats().items())]
+
+###
+### Functions
+###
+_controller = None
+_controller_lock = threading.Lock()
+
+def configureController(fixed=None, latency_target=DEFAULT_LATENCY_TARGET, initial=DEFAULT_INITIAL, maximum=DEFAULT_MAXIMUM):
+    global _controller
+    with _controller_lock:
+        _controller = aimdController(initial=initial, maximum=maximum, latency_target=latency_target, fixed=fixed)
+    return _controller
+
+def getController():
+    global _controller
+    if (_controller is None):
+        with _controller_lock:
+            if (_controller is None):
+                _controller = aimdController()
+    return _controller
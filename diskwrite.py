@@ -0,0 +1,161 @@
+import io
+import os
+import threading
+
+import requests
+import urllib3.exceptions
+
+###
+### Config
+###
+READ_SIZE      = 256 * 1024 # Bytes asked of the connection per read. One loop iteration and one write() per read, instead of per 1KB.
+FSYNC_POLICIES = ('never', 'file', 'chapter')
+# never:   the OS writes pages out when it likes. A crash can leave recent pages empty or short, --check catches them.
+# file:    each page is flushed to the disk before it's renamed into place.
+# chapter: a chapter's pages and its directory are flushed once the chapter is done. One wait per chapter instead of per page.
+
+###
+### Classes
+###
+class pageWriter():
+    # Page bodies from the response to disk. The body is read with readinto() into one reusable buffer per download thread and
+    # written from it, so the loop allocates nothing of its own per read. With preallocate the page's Content-Length is
+    # reserved on disk before the first write.
+    def __init__(self, read_size=READ_SIZE, preallocate=False, fsync='never'):
+        self.read_size = max(4096, read_size)
+        self.preallocate = preallocate and hasattr(os, 'posix_fallocate') # Not on Windows or macOS, pages are then written as before.
+        self.fsync = fsync
+        self.local = threading.local()
+
+    def buffer(self): # memoryview over this thread's buffer.
+        buffer = getattr(self.local, 'buffer', None)
+        if (buffer is None):
+            buffer = self.local.buffer = memoryview(bytearray(self.read_size))
+        return buffer
+
+    def reserves(self, total):
+        return self.preallocate and bool(total)
+
+    def reserve(self, f, total):
+        try:
+            os.posix_fallocate(f.fileno(), 0, total)
+        except OSError: # Filesystems without fallocate (some network mounts), it's only a hint.
+            pass
+
+    ### Reading ###
+    def readHead(self, raw, size): # Up to size bytes from the start of the body, e.g. for the blob store's partial hash.
+        head = bytearray(size)
+        view = memoryview(head)
+        length = 0
+        while length < size:
+            n = readInto(raw, view[length:])
+            if (not n):
+                break
+            length += n
+        return bytes(view[:length])
+
+    def copy(self, raw, f, head=b'', reserved=False, digest=None):
+        # Bytes written. head, then the rest of raw's body, into f. digest (a hashlib object) is fed the same bytes, so a page's
+        # sha1 is known once it's written instead of being read back from disk for it.
+        view = self.buffer()
+        written = 0
+        try:
+            if (head):
+                f.write(head)
+                written += len(head)
+                if (digest is not None):
+                    digest.update(head)
+            while True:
+                n = readInto(raw, view)
+                if (not n):
+                    break
+                f.write(view[:n])
+                written += n
+                if (digest is not None):
+                    digest.update(view[:n])
+        finally:
+            if (reserved): # Cut back to what arrived, so the file never looks bigger than what was downloaded.
+                f.truncate()
+        if (self.fsync == 'file'):
+            f.flush()
+            os.fsync(f.fileno())
+        return written
+
+    def readAll(self, raw, total, head=b''):
+        # The whole body in memory, for pages going into a .cbz. With Content-Length it's read straight into one buffer of
+        # that size. Shorter than total when the connection ended early.
+        if (not total):
+            body = io.BytesIO()
+            self.copy(raw, body, head)
+            return body.getvalue()
+        body = bytearray(total)
+        view = memoryview(body)
+        length = len(head)
+        view[:length] = head
+        while length < total:
+            n = readInto(raw, view[length:])
+            if (not n):
+                break
+            length += n
+        return body if length == total else body[:length]
+
+    ### Durability ###
+    def syncChapter(self, paths): # With fsync 'chapter': every page of a finished chapter that made it to disk, then their directories.
+        if (self.fsync != 'chapter'):
+            return
+        syncFiles(paths)
+
+    def syncArchive(self, path): # A .cbz once it's closed. Its pages are written in one file, so 'file' and 'chapter' both flush it here.
+        if (self.fsync != 'never'):
+            syncFiles([path])
+
+###
+### Functions
+###
+def readInto(raw, view):
+    # raw.readinto(view) with urllib3's errors raised as the requests exceptions iter_content would have raised, so retryCall
+    # classifies them the same.
+    try:
+        return raw.readinto(view)
+    except urllib3.exceptions.ProtocolError as exc:
+        raise requests.exceptions.ChunkedEncodingError(exc)
+    except urllib3.exceptions.DecodeError as exc:
+        raise requests.exceptions.ContentDecodingError(exc)
+    except urllib3.exceptions.ReadTimeoutError as exc:
+        raise requests.exceptions.ConnectionError(exc)
+    except urllib3.exceptions.SSLError as exc:
+        raise requests.exceptions.SSLError(exc)
+
+def syncFiles(paths):
+    directories = set()
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError: # A page that failed, nothing to flush.
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        directories.add(os.path.dirname(path) or '.')
+    for directory in directories: # The renames into place. Directories can't be opened on Windows, there it's the files only.
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+_writer = pageWriter()
+
+def configureWriter(read_size=READ_SIZE, preallocate=False, fsync='never'):
+    global _writer
+    _writer = pageWriter(read_size, preallocate, fsync)
+    return _writer
+
+def getWriter():
+    return _writer
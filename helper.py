@@ -1,10 +1,12 @@
 import time
+import logging
 import re
 from random import randint
 import datetime
 import os
 import json
 import glob
+import zipfile
 
 def sortAlphanumeric(data):
     data = sorted(data, key=lambda item: (int(item.partition(' ')[0])
@@ -44,10 +46,40 @@ def randomSleep(start, to):
 def timestamp():
     return str(datetime.datetime.fromtimestamp(time.time()).strftime('[%Y-%m-%d %H:%M:%S]'))
 
-def imageFileCount(path):
+def mangaNumbering(s):
+    if (len(s) == 1):
+        return "".join(['00',s])
+    elif (len(s) == 2):
+        return "".join(['0',s]) # 019, 020, 021 ...
+    elif (len(s) == 3):
+        return s                # 100, 211, 321 ... 599
+
+    logging.info('Abnormal numbering encountered') # Multiple requests.
+    return "".join(['0',s])
+
+def imageFileCount(path): # Pages in a chapter directory, or in its .cbz going by the zip's central directory alone.
+    archive = path if path.endswith('.cbz') else "".join([path, '.cbz'])
+    if (os.path.isfile(archive)):
+        with zipfile.ZipFile(archive) as cbz:
+            return len([name for name in cbz.namelist() if name.endswith('.jpg')])
     img_files = glob.glob(os.path.join(path, '*.jpg'))
     return len(img_files)
 
+def contentRangeTotal(content_range):
+    # 'bytes 100-999/1000' or 'bytes */1000' -> 1000
+    if (not content_range or '/' not in content_range):
+        return None
+    total = content_range.rsplit('/', 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+def streamImageSrc(parser, chunks):
+    # Feeds html chunks to a mangahereHTMLGetImageSrcs/mangabeeHTMLGetImageSrcs and stops as soon as it has seen the <img>.
+    for chunk in chunks:
+        parser.feed(chunk)
+        if (parser.src):
+            break
+    return parser.src
+
 def writeToJson(data, directory):
     with open(directory, 'w') as outfile: # This file is used to manage the integrity of the chapter downloaded.
         json.dump(data, outfile)
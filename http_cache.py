@@ -0,0 +1,149 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+###
+### Config
+###
+DEFAULT_CACHE_DIR = '.mangaget_cache'
+DEFAULT_MAX_BYTES = 200 * 1000000
+DEFAULT_TTLS      = {'search': 3600,               # Search results, an hour.
+                     'setup': 600,                 # Chapter lists grow, revalidate after ten minutes.
+                     'page_resolve': 30 * 86400}   # Chapter and page html practically never change.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key           TEXT PRIMARY KEY,
+    url           TEXT NOT NULL,
+    kind          TEXT NOT NULL,
+    etag          TEXT,
+    last_modified TEXT,
+    stored        REAL NOT NULL,
+    accessed      REAL NOT NULL,
+    size          INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+'''
+
+###
+### Classes
+###
+class responseCache():
+    # On-disk cache for html responses (never images). Bodies are files under directory, validators and LRU order live in index.db.
+    # Within a phase's TTL an entry is served without touching the network, after that it is revalidated with If-None-Match/If-Modified-Since.
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, ttls=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls if ttls else {})
+        self.lock = threading.Lock()
+        self.hits = 0        # Served without a request.
+        self.revalidated = 0 # Served after a 304.
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self.total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def keyOf(self, url, kind):
+        return hashlib.sha1("".join([kind, ' ', url]).encode('utf-8')).hexdigest()
+
+    def pathOf(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def lookup(self, url, kind='html'):
+        key = self.keyOf(url, kind)
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM entries WHERE key = ?', (key,)).fetchone()
+        if (row is None or not os.path.isfile(self.pathOf(key))):
+            return None
+        return dict(row)
+
+    def isFresh(self, entry, phase):
+        return entry is not None and time.time() - entry['stored'] < self.ttls.get(phase, 0)
+
+    def validators(self, entry): # Headers that turn the next request into a conditional one.
+        headers = {}
+        if (entry and entry.get('etag')):
+            headers['If-None-Match'] = entry['etag']
+        if (entry and entry.get('last_modified')):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def body(self, entry, revalidated=False):
+        try:
+            with open(self.pathOf(entry['key']), encoding='utf-8') as f:
+                text = f.read()
+        except OSError: # Evicted under us.
+            return None
+        now = time.time()
+        with self.lock, self.conn:
+            if (revalidated): # Server said 304, the copy is good for another TTL.
+                self.revalidated += 1
+                self.conn.execute('UPDATE entries SET accessed = ?, stored = ? WHERE key = ?', (now, now, entry['key']))
+            else:
+                self.hits += 1
+                self.conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, entry['key']))
+        return text
+
+    def store(self, url, text, etag=None, last_modified=None, kind='html'):
+        key = self.keyOf(url, kind)
+        path = self.pathOf(key)
+        data = text.encode('utf-8')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = "".join([path, '.', str(threading.get_ident()), '.tmp'])
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        now = time.time()
+        with self.lock, self.conn:
+            self.misses += 1
+            old = self.conn.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            self.total += len(data) - (old['size'] if old else 0)
+            self.conn.execute('INSERT OR REPLACE INTO entries (key, url, kind, etag, last_modified, stored, accessed, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                              (key, url, kind, etag, last_modified, now, now, len(data)))
+        if (self.total > self.max_bytes):
+            self.evict()
+
+    def evict(self):
+        # Drop least recently used entries until we are back under 90% of the cap.
+        target = self.max_bytes * 0.9
+        with self.lock, self.conn:
+            rows = self.conn.execute('SELECT key, size FROM entries ORDER BY accessed').fetchall()
+            for row in rows:
+                if (self.total <= target):
+                    break
+                try:
+                    os.remove(self.pathOf(row['key']))
+                except OSError:
+                    pass
+                self.conn.execute('DELETE FROM entries WHERE key = ?', (row['key'],))
+                self.total -= row['size']
+
+    def statsLine(self):
+        return "".join(['Cache: ', str(self.hits), ' fresh hits, ', str(self.revalidated), ' revalidated (304), ', str(self.misses), ' fetched, ',
+                        str(round(self.total / 1000000, 1)), 'MB stored'])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+###
+### Functions
+###
+def parseTtls(text):
+    # 'search=3600,setup=600' -> {'search': 3600, 'setup': 600}
+    ttls = {}
+    for item in filter(None, [part.strip() for part in (text or '').split(',')]):
+        phase, equals, seconds = item.partition('=')
+        if (phase.strip() not in DEFAULT_TTLS or not equals):
+            raise ValueError("".join(['expected phase=seconds with phase one of ', ', '.join(DEFAULT_TTLS), ', got ', repr(item)]))
+        try:
+            ttls[phase.strip()] = float(seconds)
+        except ValueError:
+            raise ValueError("".join(['seconds must be a number, got ', repr(item)]))
+    return ttls
@@ -0,0 +1,169 @@
+import time
+import threading
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.poolmanager import PoolManager
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+###
+### Config
+###
+DEFAULT_HEADERS = {'User-Agent':'Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.125 Safari/537.36',
+                   'Content-Type':'text/plain; charset=utf-8', 'Accept':'*/*', 'Accept-Encoding':'gzip,deflate,sdch,text'}
+DEFAULT_POOL_HOSTS   = 10   # Number of hosts we keep pools open for. mangahere + its CDN, mangabee + its CDNs..
+DEFAULT_POOL_MAXSIZE = 50   # Keep-alive sockets kept per host. Matches the 50 workers in buildPagesAndSrc.
+DEFAULT_TIMEOUT      = (10, 30) # (connect, read) seconds.
+DEFAULT_HOST_RATE    = 0    # Requests per second per host across every thread, 0 for unlimited.
+DEFAULT_POOL_TIMEOUT = 60   # Seconds a thread waits for a free socket with pool_block before the request fails like a refused connection.
+
+###
+### Classes
+###
+class timedHTTPConnectionPool(HTTPConnectionPool):
+    # requests never passes urllib3 a pool_timeout, so with block=True a thread waits for a free socket forever. A response
+    # nobody released would then hang every later request to its host. pool_timeout bounds the wait, EmptyPoolError after it.
+    pool_timeout = None
+
+    def _get_conn(self, timeout=None):
+        return HTTPConnectionPool._get_conn(self, self.pool_timeout if timeout is None else timeout)
+
+class timedHTTPSConnectionPool(timedHTTPConnectionPool, HTTPSConnectionPool):
+    pass
+
+
+class trackingPoolManager(PoolManager):
+    # Remembers every connection pool handed out so we can read urllib3's own connection/request counters per host.
+    def __init__(self, *args, pool_timeout=None, **kwargs):
+        PoolManager.__init__(self, *args, **kwargs)
+        self.pool_classes_by_scheme = {'http': timedHTTPConnectionPool, 'https': timedHTTPSConnectionPool}
+        self.pool_timeout = pool_timeout
+        self.seen_pools = {} # {'z.mhcdn.net': [<HTTPConnectionPool>, ...]}
+        self.seen_lock = threading.Lock()
+
+    def connection_from_host(self, host, port=None, scheme='http', pool_kwargs=None):
+        pool = PoolManager.connection_from_host(self, host, port=port, scheme=scheme, pool_kwargs=pool_kwargs)
+        with self.seen_lock:
+            pools = self.seen_pools.setdefault(host, [])
+            if not any(p is pool for p in pools): # A pool evicted from the LRU gets replaced with a new one, keep both for the totals.
+                pool.pool_timeout = self.pool_timeout
+                pools.append(pool)
+        return pool
+
+
+class trackingHTTPAdapter(HTTPAdapter):
+    def __init__(self, pool_timeout=DEFAULT_POOL_TIMEOUT, **kwargs):
+        self.pool_timeout = pool_timeout # Set before HTTPAdapter.__init__, it calls init_poolmanager.
+        HTTPAdapter.__init__(self, **kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = trackingPoolManager(num_pools=connections, maxsize=maxsize, block=block, pool_timeout=self.pool_timeout, **pool_kwargs)
+
+    def send(self, request, **kwargs):
+        try:
+            return HTTPAdapter.send(self, request, **kwargs)
+        except EmptyPoolError as exc: # No socket freed up within pool_timeout. A ConnectionError, so retryCall backs off and tries again.
+            raise requests.exceptions.ConnectionError(exc, request=request)
+
+
+class hostThrottle():
+    # Blocking counterpart of async_download.hostRateLimiter. Shared by every thread of every series in a batch run,
+    # so the per host budget holds no matter how many chapters are in flight.
+    def __init__(self, rate=DEFAULT_HOST_RATE):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = {} # {'z.mhcdn.net': 1408950000.5}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        if (self.interval <= 0):
+            return 0.0
+        host = hostOf(url)
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval # Reserve the slot before sleeping so other threads queue up behind it.
+        delay = slot - now
+        if (delay > 0):
+            time.sleep(delay)
+        return delay
+
+
+class httpClient():
+    # One keep-alive session shared by every thread. urllib3's pools are thread-safe, so the 50 workers in
+    # buildPagesAndSrc and the image workers in downloadConcurrently all check sockets in and out of the same pools.
+    # With pool_block a thread waits for a free socket instead of opening one past pool_maxsize, which makes pool_maxsize a hard
+    # per host connection cap, and pool_timeout how long a thread waits for one. host_rate spaces requests to each host out evenly.
+    def __init__(self, pool_hosts=DEFAULT_POOL_HOSTS, pool_maxsize=DEFAULT_POOL_MAXSIZE, timeout=DEFAULT_TIMEOUT, headers=None, pool_block=False, host_rate=DEFAULT_HOST_RATE, pool_timeout=DEFAULT_POOL_TIMEOUT):
+        self.timeout = timeout
+        self.throttle = hostThrottle(host_rate)
+        self.adapter = trackingHTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize, pool_block=pool_block, pool_timeout=pool_timeout)
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        if (headers):
+            self.session.headers.update(headers)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        self.throttle.wait(url)
+        return self.session.get(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('allow_redirects', True)
+        self.throttle.wait(url)
+        return self.session.head(url, **kwargs)
+
+    def stats(self):
+        # {'z.mhcdn.net': {'requests': 120, 'connections': 2, 'reused': 118}, ...}
+        results = {}
+        manager = self.adapter.poolmanager
+        with manager.seen_lock:
+            items = [(host, list(pools)) for host, pools in manager.seen_pools.items()]
+        for host, pools in items:
+            num_requests = sum(pool.num_requests for pool in pools)
+            num_connections = sum(pool.num_connections for pool in pools)
+            results[host] = {'requests': num_requests, 'connections': num_connections, 'reused': max(num_requests - num_connections, 0)}
+        return results
+
+    def close(self):
+        self.session.close()
+
+###
+### Functions
+###
+_client = None
+_client_lock = threading.Lock()
+
+def configureClient(pool_hosts=DEFAULT_POOL_HOSTS, pool_maxsize=DEFAULT_POOL_MAXSIZE, timeout=DEFAULT_TIMEOUT, headers=None, pool_block=False, host_rate=DEFAULT_HOST_RATE, pool_timeout=DEFAULT_POOL_TIMEOUT):
+    # Replace the shared client. Call before any requests go out, e.g. from the click command.
+    global _client
+    with _client_lock:
+        if (_client):
+            _client.close()
+        _client = httpClient(pool_hosts, pool_maxsize, timeout, headers, pool_block, host_rate, pool_timeout)
+    return _client
+
+def getClient():
+    global _client
+    if (_client is None):
+        with _client_lock:
+            if (_client is None):
+                _client = httpClient()
+    return _client
+
+def hostOf(url):
+    return urllib.parse.urlsplit(url).hostname or ''
+
+def connectionStatsLines(stats):
+    lines = []
+    for host in sorted(stats):
+        s = stats[host]
+        lines.append("".join([host, ': ', str(s['requests']), ' requests over ', str(s['connections']), ' connections (', str(s['reused']), ' reused)']))
+    return lines
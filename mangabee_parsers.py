@@ -1,4 +1,10 @@
 from html.parser import HTMLParser
+import os
+
+import natsort
+
+from sites import siteAdapter
+from helper import mangabeeUrlify, onlyNumbers, mangaNumbering
 
 class mangabeeSearchParser(HTMLParser):
     def __init__(self):
@@ -169,3 +175,55 @@ class mangabeeHTMLGetImageSrcs(HTMLParser):
 
     def handle_data(self, data):
         pass
+
+class mangabeeSite(siteAdapter):
+    name        = 'mangabee'
+    url         = 'http://www.mangabee.com'
+    predictable = True # Srcs are the page number in a fixed template, see learnSrcPattern in mangaget.py.
+    mirror_domains = ('mangareader.net',) # i1.mangareader.net, i2.mangareader.net ...
+
+    def searchUrl(self, manga_name):
+        return self.url + '/manga-list/search/%s/name-az/1' % mangabeeUrlify(manga_name)
+
+    def searchResults(self, html):
+        parser = mangabeeSearchParser()
+        parser.feed(html)
+        return parser.urls
+
+    def seriesSlug(self, manga_name):
+        return mangabeeUrlify(manga_name).replace('+', '-').lower() # 'Blood C' -> 'blood-c', series urls use - where searches use +.
+
+    def chapterListUrl(self, series_url): # The reader's chapter dropdown, on the first page of chapter 1.
+        return series_url + '1/1'
+
+    def chapterUrls(self, html, series_url):
+        parser = mangabeeSetupParser()
+        parser.feed(html)
+        # chapter_numbers = [e for e in parser.chapters if 'Raw' not in e] # all chapters with Raw are untranslated so filter them out.
+        chapter_numbers = [e[:4] for e in parser.chapters]
+        chapter_numbers = [onlyNumbers(e) for e in chapter_numbers] # Leave only the numbers floats and strip chracters such as -, whitespace.
+        chapter_numbers = sorted(filter(None, chapter_numbers), key=float)
+        return ["".join([series_url, chapter_number]) for chapter_number in chapter_numbers] # ['http://www.mangabee.com/blood-c/1', ...]
+
+    def mangaName(self, first_chapter_url):
+        return first_chapter_url.rsplit('/',2)[1]  # parse the url for something like this this: 'tokyo_ghoul'
+
+    def chapterNumber(self, chapter_url):
+        return chapter_url.rsplit('/',1)[1]
+
+    def chapterDirectory(self, base_directory, manga_name, chapter_number):
+        return os.path.join( base_directory, "".join([manga_name, '_', mangaNumbering(str(chapter_number))]) ) # 'mangabee/Tokyo_Ghoul/Tokyo_Ghoul_001 ... Tokyo_Ghoul_135'
+
+    def sortChapters(self, chapter_numbers, chapter_directories):
+        return natsort.natsorted(chapter_numbers, key=float), natsort.natsorted(chapter_directories)
+
+    def pageList(self, html, chapter_url):
+        parser = mangabeeHTMLGetImageUrls()
+        parser.feed(html)
+        return [self.pageUrl(chapter_url, page_number) for page_number in parser.page_numbers], parser.page_numbers
+
+    def pageUrl(self, chapter_url, page):
+        return "".join([chapter_url, '/', page])
+
+    def srcParser(self):
+        return mangabeeHTMLGetImageSrcs()
@@ -1,99 +1,79 @@
 import sys
 import os
+import time
+import threading
+import itertools
+import hashlib
 import logging
 import glob
 import fnmatch
+import zipfile
 
 import concurrent.futures
-import urllib.parse
-import gzip
 import natsort
-from pprint import pprint
 
 # Pip install frameworks.
 import requests
-import eventlet
 import click
 
-# Custom parsers.
-from mangabee_parsers import *
-from mangahere_parsers import *
-
 # Helpers.
 from helper import *
+from http_client import configureClient, getClient, connectionStatsLines
+from async_download import downloadChapters
+from pipeline import chapterPipeline
+from verification import pageRecord, fileDigest, verifyPagesFast, verifyPagesDeep, shutdownHashPool, scanTree, HASH_ALGORITHM
+from catalog import mangaCatalog, importJsonTree
+from metrics import getMetrics, recordResponse, recordError
+from http_cache import responseCache, parseTtls
+from concurrency import configureController, getController
+from retry import fetchError, raiseForResponse, retryCall, failureRecord
+from postprocess import imagePostProcessor, processSettings, processedPath, pillowAvailable
+from blobstore import blobStore, partialHash, PARTIAL_HASH_BYTES
+from archive import chapterArchive, archivePath, memberName, archiveMembers, verifyArchiveFast, verifyArchiveDeep, packDirectory
+from sites import siteNames, getSite, loadedSites
+from mirrors import configureMirrors, getMirrors, parseMirrorGroups
+from reporting import startLogging, getProgress
+from manifest import pagePath, readChapterFile, writeChapterFile, writeSeriesFile, seriesHeader, seriesChapters, readSeries
+from reader import startReader
+from diskwrite import configureWriter, getWriter, READ_SIZE
 
 
 
 ###
 ### Config
 ###
-logging.basicConfig(filename='mangaget.py.log', filemode='a+', level=logging.DEBUG)
-requests_log = logging.getLogger("requests")
-requests_log.setLevel(logging.WARNING) #Disable logging for requests by setting it to WARNING which we won't use.
+LOG_FILE = 'mangaget.py.log'
+
+STREAM_CHUNK_SIZE  = 8192  # Bytes of page html parsed at a time while looking for the image src.
+STREAM_DRAIN_LIMIT = 16384 # Read up to this much past the image src to keep the connection reusable.
+REPAIR_CHAPTERS    = 4     # Chapters --verify_library repairs at once. The controller still decides requests in flight per host.
+AUDIT_REPORT_LINES = 50    # Damaged chapters listed one per line before the report only counts the rest.
+ASYNC_CHAPTERS     = 8     # Chapters the async engine schedules at once. The next batch is read from disk once these are done.
 
 ###
 ### Functions
 ###
 
-def search(manga_name, manga_site): # Makes 1 http request..
-    mangabee_url  = 'http://www.mangabee.com/manga-list/search/%s/name-az/1' % mangabeeUrlify(manga_name)
-    mangahere_url = 'http://www.mangahere.co/search.php?name=%s' % urllib.parse.quote(mangahereUrlify(manga_name))
-    results       = None
-    parser        = None
-
-    if (manga_site == 'mangahere'):
-        req = requestContentWithHeaders(mangahere_url)
-        parser = mangahereSearchParser()
-    elif (manga_site == 'mangabee'):
-        req = requestContentWithHeaders(mangabee_url)
-        parser = mangabeeSearchParser()
-    else:
-        printAndLogInfo("".join(['Not a valid manga site: ', manga_site, '. Try \'mangabee\' or \'mangahere\'']))
-        return False
+def configureLogging(level='info'): # Called by the command, so importing mangaget (benchmark.py, --help) doesn't open the log file.
+    startLogging(LOG_FILE, logging.DEBUG if level == 'debug' else logging.INFO) # Records are written by a background thread, download threads never wait on the disk.
 
-    parser.feed(req)         # req contains all the html from url.
-    results = parser.urls    # Save our results.
-    parser.close             # Free the parser resource.
 
-    return results # Example: ['http://www.mangahere.co/manga/boku_to_kanojo_no_game_sensou/', 'http://www.mangahere.co/manga/no_game_no_life/', 'http://www.mangahere.co/manga/ore_to_ichino_no_game_doukoukai_katsudou_nisshi/']
+def search(manga_name, manga_site): # Makes 1 http request..
+    if (manga_site not in siteNames()):
+        printAndLogInfo("".join(['Not a valid manga site: ', manga_site, '. Try ', ' or '.join(["".join(['\'', name, '\'']) for name in siteNames()])]))
+        return False
+    site = getSite(manga_site)
+    req = retryCall(requestContentWithHeaders, site.searchUrl(manga_name))
+    return site.searchResults(req) # Example: ['http://www.mangahere.co/manga/boku_to_kanojo_no_game_sensou/', 'http://www.mangahere.co/manga/no_game_no_life/', 'http://www.mangahere.co/manga/ore_to_ichino_no_game_doukoukai_katsudou_nisshi/']
 
 
 def initializeSetup(url, manga_site): # Makes 1 http request..
-    src      = None
-    chapters = None
-    pages    = None
-    urls     = None
-
-    if (manga_site == 'mangahere'):
-        parser = mangahereVolumeChapterParser() # Grabs all the chapters from the manga's html page.
-        req = requestWithHeaders(url)
-        parser.feed(req.text)
-        urls = parser.urls
-        results = dict(chapter_urls=urls, search_url=url)
-        parser.close
-
-        return results # {['http://www.mangahere.co/manga/hack_legend_of_twilight/v03/c000.4/' ... 'http://www.mangahere.co/manga/hack_legend_of_twilight/v03/c000.3/'}
-    elif (manga_site == 'mangabee'):
-        chapter_urls = []
-        parser = mangabeeSetupParser()
-        req = requestWithHeaders(url + '1/1')
-
-        parser.feed(req.text)
-
-        # chapter_numbers = [e for e in parser.chapters if 'Raw' not in e] # all chapters with Raw are untranslated so filter them out.
-        chapter_numbers = [e[:4] for e in parser.chapters]
-        chapter_numbers = [onlyNumbers(e) for e in chapter_numbers] # Leave only the numbers floats and strip chracters such as -, whitespace.
-        chapter_numbers = sorted(filter(None, chapter_numbers), key=float)
-
-        for chapter_number in chapter_numbers:
-            chapter_urls.append( "".join([url, chapter_number]))
-        parser.close
-        results = dict(chapter_urls=chapter_urls, search_url=url)
-
-        return results # {'chapters': ['1', ... '9'], 'src': ['http://i3.mangareader.net/blood-c/1/blood-c-2691771.jpg'], 'url': ['http://www.mangabee.com/blood-c/1/1'], 'pages': ['1', ...', '40']}
-    else:
-        printAndLogInfo("".join(['Not a valid manga site: ', manga_site, '. Try \'mangabee\' or \'mangahere\'']))
+    if (manga_site not in siteNames()):
+        printAndLogInfo("".join(['Not a valid manga site: ', manga_site, '. Try ', ' or '.join(["".join(['\'', name, '\'']) for name in siteNames()])]))
         return False
+    site = getSite(manga_site)
+    html = retryCall(requestTextWithHeaders, site.chapterListUrl(url), 'setup')
+    return dict(chapter_urls=site.chapterUrls(html, url), search_url=url) # {'chapter_urls': ['http://www.mangahere.co/manga/hack_legend_of_twilight/v03/c000.4/', ...], 'search_url': url}
 
 
 def createMasterChapterIntegrityFile(setup, manga_site): # 0 http requests.
@@ -111,16 +91,11 @@ def createMasterChapterIntegrityFile(setup, manga_site): # 0 http requests.
     data                = {} # For our json integrity file that manages all the chapters.
 
     ### Create directories ###
-    if (manga_site == 'mangahere'):
-        if (len(first_chapter_url.split('/')) < 8):
-            manga_name = first_chapter_url.rsplit('/',4)[2]  # volume based: ['http:', '', 'www.mangahere.co', 'manga', 'hack_legend_of_twilight', 'v01', 'c000', ''] count: 8
-        else:
-            manga_name = first_chapter_url.rsplit('/',4)[1]  # !volumebased: ['http:', '', 'www.mangahere.co', 'manga', 'tora_kiss_a_school_odyssey', 'c001.1', '']  count: 7
-    elif (manga_site == 'mangabee'):
-        manga_name = chapter_urls[0].rsplit('/',2)[1]  # parse the url for something like this this: 'tokyo_ghoul'
+    site = getSite(manga_site)
+    manga_name = site.mangaName(first_chapter_url)
 
     if not os.path.exists(root_directory):
-        os.mkdir(root_directory)           # directory: ..mangahere/ ..mangabee/
+        os.makedirs(root_directory, exist_ok=True) # directory: ..mangahere/ ..mangabee/ exist_ok because --batch sets series up in parallel.
         logging.info("".join([timestamp(), ' Created directory: ', root_directory]))
 
     base_directory = os.path.join(root_directory, manga_name) # ..mangahere/tokyo_ghouls/ ..mangabee/tokyo_ghouls/
@@ -128,25 +103,14 @@ def createMasterChapterIntegrityFile(setup, manga_site): # 0 http requests.
         os.mkdir(base_directory) # ..mangahere/tokyo_ghouls/ ..mangabee/tokyo_ghouls/
         logging.info("".join([timestamp(), ' Created directory: ', base_directory]))
 
-    if (manga_site == 'mangahere'):
-        for i in range( 0, len(chapter_urls) ):
-            chapter_number = chapter_urls[i].rsplit('/',2)[1] # Use the part of the url for chapter numbering instead of var i in the for loop.
-            chapter_directory = os.path.join( base_directory, "".join( [manga_name, '_', chapter_number] ) )  # 'mangahere\Tokyo_Ghoul\Tokyo_Ghoul\Tokyo_Ghoul_001 ... Tokyo_Ghoul_019 ... Tokyo_Ghoul_135'
-            chapter_directories.append(chapter_directory)
-            chapter_numbers.append(chapter_number)
-        chapter_numbers = sorted(chapter_numbers)
-        chapter_directories = sorted(chapter_directories)
-    elif (manga_site == 'mangabee'):
-        for i in range( 0, len(chapter_urls) ):
-            chapter_number = chapter_urls[i].rsplit('/',1)[1]
-            chapter_directory = os.path.join( base_directory, "".join([manga_name, '_', mangaNumbering(str(chapter_number))]) ) # 'manga/Tokyo_Ghoul/Tokyo_Ghoul/Tokyo_Ghoul_001 ... Tokyo_Ghoul_019 ... Tokyo_Ghoul_135'
-            chapter_directories.append(chapter_directory)
-            chapter_numbers.append(chapter_number)
-        chapter_numbers = natsort.natsorted(chapter_numbers, key=float)
-        chapter_directories = natsort.natsorted(chapter_directories)
+    for i in range( 0, len(chapter_urls) ):
+        chapter_number, chapter_directory = site.chapterLayout(chapter_urls[i], base_directory, manga_name)
+        chapter_directories.append(chapter_directory)
+        chapter_numbers.append(chapter_number)
+    chapter_numbers, chapter_directories = site.sortChapters(chapter_numbers, chapter_directories)
 
     for i in range( 0, len(chapter_urls) ):
-        if not os.path.exists(chapter_directories[i]):
+        if (output_format == 'directory' and not os.path.exists(chapter_directories[i])): # --format cbz keeps pages in <directory>.cbz instead.
             os.mkdir(chapter_directories[i])
         chapter_json_files.append("".join([chapter_directories[i], '.json']))
 
@@ -161,70 +125,241 @@ def createMasterChapterIntegrityFile(setup, manga_site): # 0 http requests.
     data['manga_name']          = manga_name
     data['search_url']          = search_url
     data['file_path']           = file_path
-    writeToJson(data, file_path) # ../mangahere/akame_ga_kiru_chapters.json
+    writeSeriesFile(data, file_path) # ../mangahere/akame_ga_kiru_chapters.json, a header line then one line per chapter.
+    if (catalog):
+        catalog.saveSeries(data)
 
     return data #Json data.
 
 
-def updateIntegrityFiles(chapters_json_file, start=0, end=0): #Gets the manga_site from the master integrity file.
-    json_data = open(chapters_json_file).read()
-    data = json.loads(json_data)
-    updated_json_files = data.get('chapter_json_files')
-    chapter_numbers    = data.get('chapter_numbers')
-    base_directory     = data.get('base_directory')
-    chapter_urls       = data.get('chapter_urls')
-    manga_name         = data.get('manga_name')
-    manga_site         = data.get('root_directory')
-    printAndLogInfo("".join([timestamp(), ' Building chapter integrity files. This can take awhile if there are many chapters. e.g 100+...']))
-    if (end == 0 or end >= len(updated_json_files)):
-        end = len(updated_json_files)
+def updateMasterChapterIntegrityFile(setup, manga_site): # 0 http requests.
+    # Diffs a freshly parsed chapter list against the stored master record. Only added chapters get directories, and the master
+    # file is only rewritten when something changed. Returns (master data, {'added': [urls], 'changed': [urls], 'removed': [urls]}).
+    chapter_urls   = natsort.natsorted(setup.get('chapter_urls'))
+    site           = getSite(manga_site)
+    manga_name     = site.mangaName(chapter_urls[0])
+    file_path      = os.path.join( manga_site, "".join([manga_name, '_', 'chapters.json']) )
+    changes        = {'added': [], 'changed': [], 'removed': []}
+
+    if (not os.path.isfile(file_path)): # First time we see this series.
+        data = createMasterChapterIntegrityFile(setup, manga_site)
+        changes['added'] = list(data.get('chapter_urls'))
+        return data, changes
+
+    data           = readSeries(file_path)
+    base_directory = data.get('base_directory')
+    rows           = [list(row) for row in zip(data.get('chapter_numbers'), data.get('chapter_urls'), data.get('chapter_directories'))] # [number, url, directory], kept together.
+    known_urls     = set(data.get('chapter_urls'))
+    fresh_urls     = set(chapter_urls)
+    row_by_number  = {row[0]: row for row in rows}
+
+    for chapter_url in chapter_urls:
+        if (chapter_url in known_urls):
+            continue
+        chapter_number, chapter_directory = site.chapterLayout(chapter_url, base_directory, manga_name)
+        if (chapter_number in row_by_number): # Same chapter under a new url, e.g. moved to another volume. Keeps its directory.
+            changes['changed'].append(chapter_url)
+            known_urls.discard(row_by_number[chapter_number][1])
+            row_by_number[chapter_number][1] = chapter_url
+        else:
+            changes['added'].append(chapter_url)
+            row_by_number[chapter_number] = [chapter_number, chapter_url, chapter_directory]
+            rows.append(row_by_number[chapter_number])
+            if (output_format == 'directory' and not os.path.exists(chapter_directory)):
+                os.mkdir(chapter_directory)
+    changes['removed'] = sorted(known_urls - fresh_urls) # Gone from the site. Kept on disk and in the record.
+
+    if (not changes['added'] and not changes['changed']):
+        return data, changes
+
+    order = {number: i for i, number in enumerate(site.sortChapters([row[0] for row in rows], [row[2] for row in rows])[0])} # The site's chapter order, by number only.
+    rows.sort(key=lambda row: order[row[0]])
+    data['chapter_numbers']     = [row[0] for row in rows]
+    data['chapter_urls']        = [row[1] for row in rows]
+    data['chapter_directories'] = [row[2] for row in rows]
+    data['chapter_json_files']  = ["".join([directory, '.json']) for directory in data.get('chapter_directories')]
+    data['search_url'] = setup.get('search_url')
+    writeSeriesFile(data, file_path)
+    if (catalog):
+        catalog.saveSeries(data)
+
+    return data, changes
+
+
+def updateSeries(url, manga_site): # Multiple requests, proportional to the new chapters.
+    # Incremental run for a series we already have: resolve and download only chapters that are new or moved since last time.
+    setup = initializeSetup(url, manga_site)
+    data, changes = updateMasterChapterIntegrityFile(setup, manga_site)
+    printAndLogInfo("".join([timestamp(), ' ', data.get('manga_name'), ': ', str(len(changes['added'])), ' new, ', str(len(changes['changed'])), ' changed, ',
+                             str(len(changes['removed'])), ' no longer listed chapters.']))
+    for chapter_url in changes['removed']:
+        logging.info("".join([timestamp(), ' No longer listed: ', chapter_url]))
+
+    json_files = []
+    rows = {url: (number, directory) for url, number, directory in zip(data.get('chapter_urls'), data.get('chapter_numbers'), data.get('chapter_directories'))}
+    for chapter_url in changes['added']:
+        chapter_number, chapter_directory = getSite(manga_site).chapterLayout(chapter_url, data.get('base_directory'), data.get('manga_name'))
+        json_file = "".join([chapter_directory, '.json'])
+        if (createIntegrityChapterJsonFile(chapter_url, data.get('base_directory'), chapter_directory, chapter_number, json_file, manga_site)):
+            printAndLogInfo("".join([timestamp(), ' Created ', json_file]))
+            json_files.append(json_file)
+    if (json_files):
+        downloadManga(data.get('file_path'), json_files=json_files)
+    for chapter_url in changes['changed']:
+        moveChapter(chapter_url, *rows[chapter_url], data.get('base_directory'), manga_site)
+    return data, changes
+
+
+def moveChapter(chapter_url, chapter_number, directory, base_directory, manga_site): # Multiple requests. A chapter listed under a new url.
+    # Its record is kept, pages already on disk included: only the url and, when the site serves other images, the srcs change.
+    # verify then downloads just the pages that don't check out.
+    json_file = "".join([directory, '.json'])
+    old = readChapter(json_file) if chapterResolved(json_file) else None
+    fresh = resolveChapter(chapter_url, base_directory, directory, chapter_number, manga_site)
+    if (old is None):
+        if (fresh is None):
+            return False
+        writeChapter(fresh, json_file)
+        downloadManga(None, json_files=[json_file])
+        return True
+    old['chapter_url'] = chapter_url
+    if (fresh is not None and fresh.get('pages_src') != old.get('pages_src')):
+        if (len(fresh.get('pages_src')) == len(old.get('pages_src'))):
+            fresh['page_manifest'] = old.get('page_manifest') # Same pages under new srcs, what's on disk still counts.
+            fresh['downloaded'] = old.get('downloaded')
+        printAndLogInfo("".join([timestamp(), ' ', directory, ': image srcs changed with the chapter url.']))
+        old = fresh
+    writeChapter(old, json_file)
+    printAndLogInfo("".join([timestamp(), ' Moved ', directory, ' to ', chapter_url]))
+    verify(json_file, pause=False)
+    return True
+
+
+def readBatchFile(path):
+    # One series per line: 'site | url' or 'site | search term | pick'. pick is first (default), exact, or a result number. # starts a comment.
+    entries = []
+    for line in open(path, encoding='utf-8'):
+        line = line.split('#', 1)[0].strip()
+        if (not line):
+            continue
+        fields = [field.strip() for field in line.split('|')]
+        if (len(fields) < 2 or fields[0] not in siteNames()):
+            printAndLogInfo("".join([timestamp(), ' Skipping batch line: ', line]))
+            continue
+        entries.append(dict(site=fields[0], target=fields[1], pick=fields[2] if len(fields) > 2 and fields[2] else 'first'))
+    return entries
+
+
+def pickSearchResult(search_term, search_results, pick='first', manga_site='mangahere'): # The non-interactive version of 'Enter a number: '.
+    if (not search_results):
+        return None
+    if (pick == 'exact'):
+        wanted = getSite(manga_site).seriesSlug(search_term)
+        matches = [url for url in search_results if url.rstrip('/').rsplit('/', 1)[1].lower() == wanted]
+        return matches[0] if matches else None
+    if (pick.isdigit()):
+        return search_results[int(pick)] if int(pick) < len(search_results) else None
+    return search_results[0]
+
+
+def batchSeries(entry, update=False): # Search (if needed), set up, resolve and download one series. Returns a summary row.
+    site   = entry.get('site')
+    target = entry.get('target')
+    row    = dict(site=site, target=target, url=None, status='failed', chapters=0, downloaded=0, seconds=0.0, error=None)
+    label  = "".join(['[', site, ' ', target, ']'])
+    started = time.time()
+    try:
+        url = target
+        if (not target.startswith('http')):
+            url = pickSearchResult(target, search(target, site), entry.get('pick'), site)
+            if (url is None):
+                row['status'] = 'no match'
+                printAndLogInfo("".join([timestamp(), ' ', label, ' No search result matches pick=', entry.get('pick')]))
+                return row
+        row['url'] = url
+        printAndLogInfo("".join([timestamp(), ' ', label, ' Using ', url]))
+        if (update):
+            master_json_file = updateSeries(url, site)[0].get('file_path')
+        else:
+            master_json_file = createMasterChapterIntegrityFile(initializeSetup(url, site), site).get('file_path')
+            updateIntegrityFiles(master_json_file)
+            downloadManga(master_json_file)
+        for chapter in seriesChapters(master_json_file)[1]: # One chapter in memory at a time.
+            row['chapters'] += 1
+            if (chapterResolved(chapter['json_file']) and readChapter(chapter['json_file']).get('downloaded') == 'Downloaded'):
+                row['downloaded'] += 1
+        row['status'] = 'ok'
+    except Exception as e: # One broken series must not take the rest of the batch down.
+        row['error'] = "".join([type(e).__name__, ': ', str(e)])
+        logging.exception("".join([timestamp(), ' ', label, ' failed']))
+    row['seconds'] = round(time.time() - started, 1)
+    printAndLogInfo("".join([timestamp(), ' ', label, ' ', row['status'], ': ', str(row['downloaded']), '/', str(row['chapters']), ' chapters downloaded in ', str(row['seconds']), 's']))
+    return row
+
+
+def runBatch(entries, series_workers=4, update=False):
+    # Series run side by side on threads. They share the pooled client, so --max_connections and --host_rate are one budget for all of them.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, series_workers)) as executor:
+        rows = list(executor.map(lambda entry: batchSeries(entry, update), entries))
+    print('\nBatch summary:')
+    for row in rows:
+        print("".join([row['status'].ljust(9), ' ', row['site'].ljust(10), ' ', (str(row['downloaded']) + '/' + str(row['chapters'])).rjust(9), ' ',
+                       str(row['seconds']).rjust(8), 's  ', row['url'] or row['target'], '  ' + row['error'] if row['error'] else '']))
+    return rows
+
+
+def chapterJobs(chapters_json_file, start=0, end=0): # 0 http requests. Everything createIntegrityChapterJsonFile needs per selected chapter, one at a time.
+    header, chapters = seriesChapters(chapters_json_file)
     if (start > 0):
         start -= 1
-    #print("".join([str(start), ' and ', str(end)]))
-    for i in range(start, end):
-    # for i in range(0, 1): # Testing one chapter.
-        if (os.path.isfile(updated_json_files[i])):
+    for i, chapter in enumerate(chapters):
+        if (end and i >= end):
+            break
+        if (i >= start):
+            yield dict(chapter_url=chapter['chapter_url'], base_directory=header.get('base_directory'), directory=chapter['directory'],
+                       chapter_number=chapter['chapter_number'], json_file=chapter['json_file'], manga_site=header.get('root_directory'))
+
+
+def updateIntegrityFiles(chapters_json_file, start=0, end=0): #Gets the manga_site from the master integrity file.
+    printAndLogInfo("".join([timestamp(), ' Building chapter integrity files. This can take awhile if there are many chapters. e.g 100+...']))
+    for job in chapterJobs(chapters_json_file, start, end):
+        if (chapterResolved(job['json_file'])):
             pass
         else:
-            if (manga_site == 'mangahere'):
-                chapter_directory = os.path.join( base_directory, "".join( [manga_name, '_', chapter_numbers[i]] ) )
-                createIntegrityChapterJsonFile(chapter_urls[i], base_directory, chapter_directory, chapter_numbers[i], updated_json_files[i], manga_site)
-                printAndLogInfo("".join([timestamp(), ' Created ', updated_json_files[i]]))
-            elif (manga_site == 'mangabee'):
-                chapter_directory = os.path.join( base_directory, "".join( [manga_name, '_', mangaNumbering(str(chapter_numbers[i]))] ) )
-                createIntegrityChapterJsonFile(chapter_urls[i], base_directory, chapter_directory, chapter_numbers[i], updated_json_files[i], manga_site)
-                printAndLogInfo("".join([timestamp(), ' Created ', updated_json_files[i]]))
+            createIntegrityChapterJsonFile(job['chapter_url'], job['base_directory'], job['directory'], job['chapter_number'], job['json_file'], job['manga_site'])
+            printAndLogInfo("".join([timestamp(), ' Created ', job['json_file']]))
     return True
 
 
 def createIntegrityChapterJsonFile(chapter_url, base_directory, directory, chapter_number, chapter_json_file, manga_site):
+    data = resolveChapter(chapter_url, base_directory, directory, chapter_number, manga_site)
+    if (data is None):
+        return False
+    writeChapter(data, chapter_json_file)
+    return True
+
+
+def resolveChapter(chapter_url, base_directory, directory, chapter_number, manga_site): # Multiple requests. The chapter's integrity data, None when it doesn't add up.
     pages_and_src     = []
     page_urls         = [] # Holds a reference to the image on mangahere's CDN. You need to parse its HTML for that CDN image link.
     page_numbers      = []
     pages_src         = [] # Holds all the urls to the images on Mangahere's CDN.
     image_files_paths = []
 
-    req = requestWithHeaders(chapter_url)  # Makes 1 http request.s
+    failures          = [] # Dead letters for pages whose src couldn't be resolved.
 
-    if (manga_site == 'mangahere'):
-        parser = mangahereHTMLGetImageUrls()
-        parser.feed(req.text)
-        page_urls = parser.page_urls
-        page_numbers = parser.page_numbers
-    elif (manga_site == 'mangabee'):
-        parser = mangabeeHTMLGetImageUrls()
-        parser.feed(req.text)
-        page_numbers = parser.page_numbers
-        for page_number in page_numbers:
-            page_urls.append("".join([chapter_url, '/', page_number]))
+    html = retryCall(requestTextWithHeaders, chapter_url, 'page_resolve')  # Makes 1 http request.s
 
-    parser.close # Close parser to free it.
+    page_urls, page_numbers = getSite(manga_site).pageList(html, chapter_url)
 
     for page in page_numbers:
-        file_path = "".join([directory, '\\', mangaNumbering(page), '.jpg'])
+        file_path = pagePath(directory, mangaNumbering(page))
         image_files_paths.append( file_path )
 
-    pages_and_src = buildPagesAndSrc(page_urls, page_numbers, manga_site) # Makes multiple requests
+    if (getSite(manga_site).predictable and mangabee_resolve == 'predict'):
+        pages_and_src = predictPagesAndSrc(html, page_urls, page_numbers, manga_site, failures) # 1 request plus cheap confirmations.
+    if (not pages_and_src):
+        pages_and_src = buildPagesAndSrc(page_urls, page_numbers, manga_site, failures) # Makes multiple requests
     pages_and_src = sorted(pages_and_src, key=lambda k: k['page'])
 
     for dic in pages_and_src:
@@ -234,17 +369,19 @@ def createIntegrityChapterJsonFile(chapter_url, base_directory, directory, chapt
 
     ### Create integrity json file ###
     if ( len(pages_and_src) == len(image_files_paths) == len(page_urls) == len(page_numbers) ): # Number of items in each match so proceed.
-        data = generateChapterIntegrityData(directory, base_directory, chapter_url, image_files_paths, pages_and_src, pages_src, length, chapter_number , 'Not Downloaded.')
-
-        writeToJson(data, chapter_json_file)
+        positions = {dic.get('page'): i for i, dic in enumerate(pages_and_src)}
+        failed_pages = [dict(entry, position=positions.get(entry['page'])) for entry in failures]
+        if (failed_pages):
+            printAndLogInfo("".join([timestamp(), ' ', directory, ': ', str(len(failed_pages)), ' pages could not be resolved. Kept as failed pages, the next run retries only those.']))
+        data = generateChapterIntegrityData(directory, base_directory, chapter_url, image_files_paths, pages_and_src, pages_src, length, chapter_number , 'Not Downloaded.', failed_pages=failed_pages, manga_site=manga_site)
     else:
         logging.debug("".join([timestamp(), ' Number of image_srcs, file_paths, and page_urls do not match. Check page numbering for that chapter on mangahere', image_files_paths[0]]))
-        return False
+        return None
 
-    return True
+    return data
 
 
-def downloadManga(master_json_file, index=0):
+def downloadManga(master_json_file, index=0, json_files=None): # json_files: only these chapters, e.g. the new ones from updateSeries.
     def download(data):
         pages_src         = data.get('pages_src')
         image_files_paths = data.get('image_files_paths')
@@ -254,38 +391,134 @@ def downloadManga(master_json_file, index=0):
 
         if (data['downloaded'] == 'Not Downloaded.'):
             printAndLogInfo("".join(['\nDownloading ', data.get('chapter_url'), ' ...\n']))
-            downloadConcurrently( pages_src, image_files_paths )
-            data['downloaded'] = 'Downloaded'
-            logging.info("".join([timestamp(), ' ', chapter_url, ' successfully downloaded.']))
-            seconds = str(randomSleep(1,2)) # Introduce an artificial delay after you downloaded a whole chapter.
-            print("".join(['Downloaded. Waited ', seconds, ' seconds to prevent being timedout by server...']))
-            writeToJson(data, "".join([directory, '.json']))
+            downloadChapter(data) # Pages that failed for good are in failed_pages, later runs retry only those.
+            logChapterDownloaded(data)
+            seconds = randomSleep(1,2) # Introduce an artificial delay after you downloaded a whole chapter.
+            if (seconds):
+                getProgress().write("".join(['Waited ', str(seconds), ' seconds to prevent being timedout by server...']))
+            writeChapter(data, "".join([directory, '.json']))
+        elif (data.get('failed_pages')):
+            retryDeadLetters(data)
         else:
-            print("".join([chapter_url, ' Already downloaded']))
-
-    master_json_data = open(master_json_file).read()
-    master_data = json.loads(master_json_data)
-    if (not index): # If there isn't a chapter range specified
-        for json_file in master_data.get('chapter_json_files'):
-            json_data = open(json_file).read()
-            data = json.loads(json_data)
-            download(data)
-    elif(index[0] == 0 and index[0] == 0):
-        for json_file in master_data.get('chapter_json_files'):
-            json_data = open(json_file).read()
-            data = json.loads(json_data)
+            getProgress().write("".join([chapter_url, ' Already downloaded']))
+
+    def downloadAll(datas): # Async engine: every page of every chapter is scheduled at once and paced per host.
+        pending = []
+        for data in datas:
+            if (data['downloaded'] == 'Not Downloaded.'):
+                pending.append(data)
+            elif (data.get('failed_pages')):
+                retryDeadLetters(data)
+            else:
+                getProgress().write("".join([data.get('chapter_url'), ' Already downloaded']))
+        if (not pending):
+            return
+        printAndLogInfo("".join(['\nDownloading ', str(len(pending)), ' chapters with the async engine...\n']))
+        failures = {}
+        chapters = []
+        owners   = {} # {page path: chapter data}
+        lock     = threading.Lock()
+        for data in pending: # Pages without a src stay in failed_pages.
+            pairs = [(src, path) for src, path in zip(data.get('pages_src'), data.get('image_files_paths')) if src]
+            chapters.append(([src for src, path in pairs], [path for src, path in pairs]))
+            owners.update({path: data for path in data.get('image_files_paths')})
+            getProgress().startChapter(data.get('directory'), chapters[-1][1])
+
+        def archiveOf(data): # With --format cbz the chapter's .cbz.part is opened once its first page is fetched, not all of them up front.
+            with lock:
+                if ('archive' not in data):
+                    data['archive'] = openChapterArchive(data)
+                return data['archive']
+
+        results = downloadChapters(lambda path, url: requestFile(path, url, failures, archiveOf(owners[path])), chapters, request_rate, async_concurrency)
+        for data, pages_ok in zip(pending, results):
+            getProgress().endChapter(data.get('directory'))
+            archive = data.pop('archive', None)
+            if (not all(pages_ok)):
+                resolveFailedPredictions(data, archive)
+            updateDeadLetters(data, failures, archive)
+            closeChapterArchive(data, archive)
+            data['page_manifest'] = chapterManifest(data)
+            data['downloaded'] = 'Downloaded'
+            processChapter(data)
+            logChapterDownloaded(data)
+            writeChapter(data, "".join([data.get('directory'), '.json']))
+
+    if (json_files is not None):
+        pass
+    elif (catalog): # One indexed query instead of opening every chapter file to read its downloaded flag.
+        start, end = (index[0], index[1]) if index else (0, 0)
+        master_data = seriesHeader(master_json_file)
+        json_files = ["".join([directory, '.json']) for directory in catalog.missingChapters(master_data.get('root_directory'), master_data.get('manga_name'), start, end)]
+    else: # With a chapter range, (1, 3) = chapters from 1 to 3 download.
+        start, end = (index[0], index[1]) if index else (0, 0)
+        json_files = (job['json_file'] for job in chapterJobs(master_json_file, start, end))
+
+    datas = (data for data in (readChapter(json_file) for json_file in json_files) if data) # Read as they are downloaded, not all up front.
+    if (download_engine == 'async'):
+        while True: # Bounded batches, so only a few chapters' page lists are in memory and the first pages start right away.
+            batch = list(itertools.islice(datas, ASYNC_CHAPTERS))
+            if (not batch):
+                break
+            downloadAll(batch)
+    else:
+        for data in datas:
             download(data)
-    else: # If there is a chapter range specified: (1, 3) = chapters from 1 to 3 download.
-        i = 0
-        for json_file in master_data.get('chapter_json_files'):
-            if i in range(index[0]-1, index[1]):
-                json_data = open(json_file).read()
-                data = json.loads(json_data)
-                download(data)
-            i += 1
 
 
-def generateChapterIntegrityData(directory, base_directory, chapter_url, image_files_paths, pages_and_src, pages_src, length, chapter_number , downloaded):
+def pipelineManga(master_json_file, index=0, workers=(4, 2, 1)):
+    # Resolves, downloads and verifies chapters in overlapping stages instead of resolving every chapter before the first download.
+    def resolve(job): # Multiple requests.
+        if (not chapterResolved(job['json_file'])):
+            if (not createIntegrityChapterJsonFile(job['chapter_url'], job['base_directory'], job['directory'], job['chapter_number'], job['json_file'], job['manga_site'])):
+                return None
+            printAndLogInfo("".join([timestamp(), ' Created ', job['json_file']]))
+        return readChapter(job['json_file'])
+
+    def download(data):
+        if (data['downloaded'] == 'Not Downloaded.'):
+            printAndLogInfo("".join(['\nDownloading ', data.get('chapter_url'), ' ...\n']))
+            downloadChapter(data)
+            logChapterDownloaded(data)
+            writeChapter(data, "".join([data.get('directory'), '.json']))
+        elif (data.get('failed_pages')):
+            retryDeadLetters(data)
+        else:
+            getProgress().write("".join([data.get('chapter_url'), ' Already downloaded']))
+        return data
+
+    def check(data):
+        verify("".join([data.get('directory'), '.json']))
+        return data
+
+    start, end = (index[0], index[1]) if index else (0, 0)
+    pipeline = chapterPipeline([('resolve', resolve, workers[0]), ('download', download, workers[1]), ('verify', check, workers[2])])
+    pipeline.run(chapterJobs(master_json_file, start, end))
+    printAndLogInfo("".join([timestamp(), ' Pipeline: ', pipeline.statsLine()]))
+    for line in pipeline.failureLines():
+        printAndLogInfo(line)
+
+
+def chapterResolved(json_file): # The chapter's page srcs are known, so it can be downloaded.
+    if (catalog):
+        return catalog.hasChapter(os.path.splitext(json_file)[0])
+    return os.path.isfile(json_file)
+
+
+def readChapter(json_file): # Chapter integrity data from the --catalog database, or its json file.
+    if (catalog):
+        return catalog.loadChapter(os.path.splitext(json_file)[0])
+    return readChapterFile(json_file)
+
+
+def writeChapter(data, json_file):
+    if (catalog):
+        catalog.saveChapter(data)
+    else:
+        writeChapterFile(data, json_file) # Compact: each page once, paths derived.
+
+
+def generateChapterIntegrityData(directory, base_directory, chapter_url, image_files_paths, pages_and_src, pages_src, length, chapter_number , downloaded, page_manifest=None, failed_pages=None, manga_site=None):
     data = {}
     ### Build a manga chapter integrity json file. ###
     data['downloaded']        = downloaded
@@ -297,51 +530,473 @@ def generateChapterIntegrityData(directory, base_directory, chapter_url, image_f
     data['chapter_url']       = chapter_url
     data['directory']         = directory
     data['base_directory']    = base_directory
+    data['page_manifest']     = page_manifest if page_manifest else [None] * length # [{'size': .., 'mtime': .., 'sha1': ..}, ...] filled in once pages are downloaded.
+    data['failed_pages']      = failed_pages if failed_pages else [] # Dead letters: [{'position': 3, 'page': '004', 'stage': 'resolve'/'download', 'error': 'http_503', 'attempts': 5, ...}]
+    data['manga_site']        = manga_site # Site the chapter was resolved from, e.g. for resolveFailedPredictions.
 
     return data
 
 
-def buildPagesAndSrc(page_urls, page_numbers, manga_site): # Multiple Requests.
+def buildPagesAndSrc(page_urls, page_numbers, manga_site, failures=None): # Multiple Requests.
+    # Pages that still fail after their retries come back with a None src, and a dead letter entry goes into failures.
     pages_and_src = []
-    if (manga_site == 'mangahere'):
-        parser = mangahereHTMLGetImageSrcs()
-    elif (manga_site == 'mangabee'):
-        parser = mangabeeHTMLGetImageSrcs()
 
     ### Concurrently find image src on each html page. ###
-    with concurrent.futures.ThreadPoolExecutor(max_workers=50) as executor: # Multiple (small) requests. max_workers Was 15 but was too slow.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=getController().maximum) as executor: # Multiple (small) requests. The controller decides how many run at once per host.
         # Download the load operations and mark each future with its URL
-        future_to_url = {executor.submit(requestContentWithHeadersAndKey, url, page): [url,page] for url,page in zip(page_urls,page_numbers)}
+        future_to_url = {executor.submit(retryCall, requestImageSrc, url, page, manga_site): [url,page] for url,page in zip(page_urls,page_numbers)}
         for future in concurrent.futures.as_completed(future_to_url):
             url = future_to_url[future]
             try:
-                html_data = future.result()
-                parser.feed(html_data.get('html'))
-                pages_and_src.append( {'page': mangaNumbering(html_data['page']), 'src':parser.src} )
-                parser.reset # Clear contents of parser.
-            except Exception as exc:
-                printAndLogDebug( timestamp(), ' %r generated an exception: %s' % (url, exc) )
+                src_data = future.result()
+                pages_and_src.append( {'page': mangaNumbering(src_data['page']), 'src':src_data['src']} )
+            except requests.exceptions.RequestException as exc:
+                printAndLogDebug( "".join([timestamp(), ' %r generated an exception: %s' % (url, exc)]) )
+                pages_and_src.append( {'page': mangaNumbering(url[1]), 'src': None} )
+                if (failures is not None):
+                    failures.append(dict(failureRecord(exc), page=mangaNumbering(url[1]), page_url=url[0], site=manga_site, stage='resolve'))
 
 
     return pages_and_src
 
 
-def checkChapterIntegrity(search_string, manga_site):
+def downloadChapter(data, first_page=0): # Multiple requests. Every page with a src, then the manifest and failed pages are recorded on data.
+    failures = {}
+    archive = openChapterArchive(data)
+    order = list(range(first_page, len(data.get('pages_src')))) + list(range(0, first_page)) # From the page a reader asked for on, see fetchChapter.
+    downloadPages([data.get('pages_src')[i] for i in order], [data.get('image_files_paths')[i] for i in order], failures, archive, data.get('directory'))
+    resolveFailedPredictions(data, archive)
+    updateDeadLetters(data, failures, archive)
+    closeChapterArchive(data, archive)
+    data['downloaded'] = 'Downloaded'
+    data['page_manifest'] = chapterManifest(data) # Size and hash of every page for --check.
+    processChapter(data)
+
+
+def processChapter(data, redo=()):
+    # With --process_format: hands the chapter's pages that weren't converted as they downloaded to the post processor, waits
+    # for them and records each output's size under data['processed'][<settings tag>]. redo: positions whose source was replaced.
+    if (post_processor is None):
+        return None
+    image_files_paths = data.get('image_files_paths')
+    outputs = [processedPath(path, post_processor.tag) for path in image_files_paths]
+    for i in redo:
+        if (os.path.isfile(outputs[i])):
+            os.remove(outputs[i])
+    present = pagesPresent(data)
+    todo = [i for i in range(0, len(image_files_paths)) if present[i]]
+    if (archived(data) and not all(os.path.isfile(outputs[i]) for i in todo)): # Pages are zip members, the pool gets their bytes.
+        archive_file = archivePath(data.get('directory'))
+        with zipfile.ZipFile(archive_file if os.path.isfile(archive_file) else "".join([archive_file, '.part'])) as cbz:
+            for i in todo:
+                post_processor.submit(image_files_paths[i], None if os.path.isfile(outputs[i]) else cbz.read(memberName(image_files_paths[i])))
+    else:
+        for i in todo:
+            post_processor.submit(image_files_paths[i]) # Skipped when already converted with these settings.
+    processed = data.get('processed') or {}
+    processed[post_processor.tag] = {'directory': os.path.dirname(outputs[0]) if outputs else None, 'sizes': post_processor.sizes(image_files_paths)}
+    data['processed'] = processed
+    return processed[post_processor.tag]
+
+
+def archived(data): # Pages live in <directory>.cbz, either from --format cbz or from --to_cbz.
+    archive = archivePath(data.get('directory'))
+    return output_format == 'cbz' or os.path.isfile(archive) or os.path.isfile("".join([archive, '.part']))
+
+
+def openChapterArchive(data, replace=()): # None when the chapter is kept as a directory of files.
+    return chapterArchive(archivePath(data.get('directory')), replace) if archived(data) else None
+
+
+def closeChapterArchive(data, archive): # Into place once every page is in, otherwise the .part waits for the failed pages.
+    if (archive is None):
+        return
+    if (data.get('failed_pages')):
+        archive.close()
+    else:
+        archive.finalize()
+    getWriter().syncArchive(archive.path if os.path.isfile(archive.path) else archive.part_path)
+
+
+def pagesPresent(data, archive=None): # [True, False, ..] per page. Archives are read from their central directory, or the open writer.
+    if (archive is not None):
+        return [archive.has(memberName(path)) for path in data.get('image_files_paths')]
+    if (archived(data)):
+        members = archiveMembers(archivePath(data.get('directory')))
+        return [memberName(path) in members for path in data.get('image_files_paths')]
+    return [os.path.isfile(path) for path in data.get('image_files_paths')]
+
+
+def chapterManifest(data):
+    # Pages fetched this run come with the record hashed as they streamed in, only the others are read and hashed here.
+    paths = data.get('image_files_paths')
+    manifest = [landedRecord(path, False) for path in paths]
+    rest = [i for i in range(0, len(paths)) if manifest[i] is None]
+    if (rest and archived(data)):
+        archive = archivePath(data.get('directory'))
+        source = archive if os.path.isfile(archive) else "".join([archive, '.part'])
+        records = verifyArchiveDeep(source, [memberName(paths[i]) for i in rest], None)[1]
+        for i, record in zip(rest, records):
+            manifest[i] = record
+    elif (rest):
+        for i in rest:
+            manifest[i] = pageRecord(paths[i])
+    return manifest
+
+
+def convertChapter(json_file): # Packs a downloaded chapter's page files into <directory>.cbz and removes them. True when it did.
+    data = readChapter(json_file)
+    if (not data or data.get('downloaded') != 'Downloaded' or os.path.isfile(archivePath(data.get('directory')))):
+        return False
+    manifest = packDirectory(data.get('directory'), data.get('image_files_paths'))
+    if (manifest is None):
+        printAndLogInfo("".join([timestamp(), ' ', data.get('directory'), ' is missing pages, run --check before converting it.']))
+        return False
+    data['page_manifest'] = manifest
+    writeChapter(data, json_file)
+    for path in data.get('image_files_paths'):
+        os.remove(path)
+    if (os.path.isdir(data.get('directory')) and not os.listdir(data.get('directory'))):
+        os.rmdir(data.get('directory'))
+    return True
+
+
+def fetchChapter(job, first_page=0): # Multiple requests. One chapter for the reader: resolved if it isn't, then its missing pages from first_page on.
+    if (not chapterResolved(job['json_file'])):
+        if (not createIntegrityChapterJsonFile(job['chapter_url'], job['base_directory'], job['directory'], job['chapter_number'], job['json_file'], job['manga_site'])):
+            return False
+        logging.info("".join([timestamp(), ' Created ', job['json_file']]))
+    data = readChapter(job['json_file'])
+    if (data['downloaded'] == 'Not Downloaded.'):
+        if (output_format == 'directory' and not os.path.exists(data.get('directory'))):
+            os.makedirs(data.get('directory'), exist_ok=True)
+        downloadChapter(data, first_page)
+        logChapterDownloaded(data)
+        writeChapter(data, job['json_file'])
+    elif (data.get('failed_pages') or not all(pagesPresent(data))):
+        verify(job['json_file'], pause=False)
+    return True
+
+
+def serveLibrary(port, ahead, focus=None):
+    # Reader on localhost until Ctrl-C. Chapters are fetched as they are read, focus: a series file to open first.
+    server, url = startReader(siteNames(), lambda json_file: readChapter(json_file) if chapterResolved(json_file) else None, fetchChapter, port, ahead=ahead)
+    if (focus):
+        header = seriesHeader(focus)
+        url = "".join([url, header.get('root_directory'), '/', header.get('manga_name'), '/'])
+    printAndLogInfo("".join([timestamp(), ' Reading at ', url, ' (Ctrl-C to stop)']))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        printAndLogInfo("".join([timestamp(), ' Stopping the reader...']))
+    server.stop()
+
+
+def libraryChapters(root_directories=None): # Json files of every resolved chapter of every series on disk, under every site by default.
+    json_files = []
+    for root_directory in root_directories if root_directories else siteNames():
+        for master_file in sorted(glob.glob(os.path.join(root_directory, '*_chapters.json'))):
+            json_files += [chapter['json_file'] for chapter in seriesChapters(master_file)[1] if chapterResolved(chapter['json_file'])]
+    return json_files
+
+
+def convertLibrary(root_directories=None, workers=None):
+    # Every downloaded chapter of every series to .cbz, chapters side by side. Stored zips cost no CPU, this is all disk.
+    json_files = libraryChapters(root_directories)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers if workers else os.cpu_count()) as executor:
+        converted = sum(1 for result in executor.map(convertChapter, json_files) if result)
+    printAndLogInfo("".join([timestamp(), ' Converted ', str(converted), ' of ', str(len(json_files)), ' chapters to .cbz']))
+    return converted
+
+
+def dedupeChapter(json_file): # Bytes reclaimed. Page files go into the blob store or become links to it, .cbz members are indexed.
+    data = readChapter(json_file)
+    if (not data):
+        return 0
+    image_files_paths = data.get('image_files_paths')
+    if (archived(data)):
+        archive_file = archivePath(data.get('directory'))
+        if (os.path.isfile(archive_file)):
+            with zipfile.ZipFile(archive_file) as cbz:
+                members = set(cbz.namelist())
+                for name in [memberName(path) for path in image_files_paths if memberName(path) in members]:
+                    blob_store.addMember(archive_file, name, cbz.read(name))
+        return 0
+    reclaimed = 0
+    manifest = data.get('page_manifest') or []
+    for i in range(0, len(image_files_paths)):
+        record = manifest[i] if i < len(manifest) else None
+        try:
+            stat = os.stat(image_files_paths[i])
+        except OSError:
+            continue
+        trusted = record and record.get('size') == stat.st_size and record.get('mtime') == stat.st_mtime # Hash already known.
+        reclaimed += blob_store.addFile(image_files_paths[i], record.get('sha1') if trusted else None)
+        if (trusted):
+            record['mtime'] = os.stat(image_files_paths[i]).st_mtime # A link has the blob's mtime.
+    if (manifest):
+        writeChapter(data, json_file)
+    return reclaimed
+
+
+def dedupeLibrary(root_directories=None, workers=None):
+    json_files = libraryChapters(root_directories)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers if workers else os.cpu_count()) as executor:
+        reclaimed = sum(executor.map(dedupeChapter, json_files))
+    printAndLogInfo("".join([timestamp(), ' Deduplicated ', str(len(json_files)), ' chapters, reclaimed ', str(sizeMegs(reclaimed)), 'MB']))
+    return reclaimed
+
+
+def restoreFromBlobs(data):
+    # Missing page files whose hash the manifest remembers come back as links to the blob store, without a request.
+    if (blob_store is None or archived(data)):
+        return 0
+    restored = 0
+    manifest = data.get('page_manifest') or []
+    for path, record in zip(data.get('image_files_paths'), manifest):
+        if (record and record.get('sha1') and not os.path.isfile(path)):
+            blob = blob_store.find(record.get('sha1'))
+            if (blob and blob_store.linkTo(blob, path)):
+                restored += 1
+    return restored
+
+
+def learnSrcPattern(first_src, first_page, second_src, second_page):
+    # 'http://x/tokyo_ghoul/1/01.jpg' (page 1) and 'http://x/tokyo_ghoul/1/24.jpg' (page 24) -> ('http://x/tokyo_ghoul/1/', 2, '.jpg')
+    # None when the two srcs differ in anything but the page number, e.g. hashed file names.
+    if (not first_src or not second_src or first_page == second_page):
+        return None
+    prefix = os.path.commonprefix([first_src, second_src])
+    suffix = os.path.commonprefix([first_src[len(prefix):][::-1], second_src[len(prefix):][::-1]])[::-1]
+    while (prefix and prefix[-1].isdigit()): # '.../01.jpg' and '.../02.jpg' share the leading 0 of the page number.
+        prefix = prefix[:-1]
+    while (suffix and suffix[0].isdigit()):  # '.../1.jpg' and '.../21.jpg' share its last digit.
+        suffix = suffix[1:]
+    first_number = first_src[len(prefix):len(first_src) - len(suffix)]
+    second_number = second_src[len(prefix):len(second_src) - len(suffix)]
+    if (not first_number.isdigit() or not second_number.isdigit()):
+        return None
+    width = len(first_number) if first_number.startswith('0') else 0 # Zero padded page numbers keep their width.
+    if (int(first_number) != first_page or str(second_page).zfill(width) != second_number):
+        return None
+    return (prefix, width, suffix)
+
+
+def predictSrc(pattern, page):
+    prefix, width, suffix = pattern
+    return "".join([prefix, str(page).zfill(width), suffix])
+
+
+def srcExists(src): # 1 HEAD request, no body.
+    started = time.time()
+    try:
+        response = getClient().head(src)
+    except requests.exceptions.RequestException as exc:
+        recordError(src, 'page_resolve', exc)
+        return False
+    response.close()
+    recordResponse(response, 'page_resolve', 0, started)
+    return response.ok
+
+
+def predictPagesAndSrc(html, page_urls, page_numbers, manga_site, failures=None): # 1 request plus a HEAD per page with --predict_confirm head.
+    # The chapter html we already have is page 1, the last page is fetched as a second sample. Every other src is generated from
+    # the pattern the two share. Pages whose predicted src doesn't check out are resolved from their html like before.
+    if (len(page_numbers) < 3):
+        return None
+    parser = getSite(manga_site).srcParser()
+    parser.feed(html)
+    first_src = parser.src
+    try:
+        last_src = retryCall(requestImageSrc, page_urls[-1], page_numbers[-1], manga_site).get('src')
+    except requests.exceptions.RequestException:
+        return None
+    pattern = learnSrcPattern(first_src, int(page_numbers[0]), last_src, int(page_numbers[-1]))
+    if (pattern is None):
+        logging.info("".join([timestamp(), ' No src pattern in ', str(first_src), ' and ', str(last_src), ', resolving every page.']))
+        return None
+
+    srcs = [first_src] + [predictSrc(pattern, int(page)) for page in page_numbers[1:-1]] + [last_src]
+    misses = []
+    if (predict_confirm == 'head'):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+            found = list(executor.map(srcExists, srcs[1:-1]))
+        misses = [i + 1 for i in range(0, len(found)) if not found[i]]
+    if (misses):
+        printAndLogDebug("".join([timestamp(), ' ', str(len(misses)), ' predicted srcs missed, resolving them from their html.']))
+        resolved = {dic['page']: dic['src'] for dic in buildPagesAndSrc([page_urls[i] for i in misses], [page_numbers[i] for i in misses], manga_site, failures)}
+        for i in misses:
+            srcs[i] = resolved.get(mangaNumbering(page_numbers[i]))
+    return [{'page': mangaNumbering(page), 'src': src} for page, src in zip(page_numbers, srcs)]
+
+
+def resolveFailedPredictions(data, archive=None): # With --predict_confirm download: re-resolve the srcs of pages that didn't download and fetch them again.
+    if (mangabee_resolve != 'predict' or predict_confirm != 'download' or not data.get('chapter_url')):
+        return 0
+    present = pagesPresent(data, archive)
+    failed = [i for i in range(0, len(present)) if not present[i]]
+    manga_site = data.get('manga_site') # Recorded when the chapter was resolved.
+    if (failed and manga_site not in siteNames()): # Resolved before chapters recorded their site.
+        printAndLogInfo("".join([timestamp(), ' ', data.get('directory'), ': no site recorded, ', str(len(failed)), ' pages are left for --check to fetch again.']))
+        return 0
+    if (not failed or not getSite(manga_site).predictable):
+        return 0
+    site = getSite(manga_site)
+    page_numbers = [str(int(data.get('pages_and_src')[i]['page'])) for i in failed]
+    resolved = {dic['page']: dic['src'] for dic in buildPagesAndSrc([site.pageUrl(data.get('chapter_url'), page) for page in page_numbers], page_numbers, manga_site)}
+    fixed = []
+    for i in failed:
+        src = resolved.get(data.get('pages_and_src')[i]['page'])
+        if (src and src != data.get('pages_src')[i]):
+            data['pages_src'][i] = src
+            data['pages_and_src'][i]['src'] = src
+            fixed.append(i)
+    if (fixed):
+        downloadPages([data.get('pages_src')[i] for i in fixed], [data.get('image_files_paths')[i] for i in fixed], archive=archive)
+    return len(fixed)
+
+
+def updateDeadLetters(data, failures=None, archive=None):
+    # Rebuilds data['failed_pages'] after a download: pages still without a src keep their resolve entry, pages with a src that
+    # aren't on disk get a download entry with the error from failures ({src: record} filled in by requestFile).
+    previous = {entry.get('position'): entry for entry in data.get('failed_pages') or []}
+    present = pagesPresent(data, archive)
+    failed = []
+    for i in range(0, len(data.get('image_files_paths'))):
+        if (present[i]):
+            continue
+        src = data.get('pages_src')[i]
+        before = previous.get(i) or {}
+        if (src is None):
+            entry = dict(before, position=i, page=data.get('pages_and_src')[i].get('page'), stage='resolve')
+        else:
+            record = (failures or {}).get(src) or {'error': 'not_downloaded', 'attempts': 0, 'time': timestamp()}
+            entry = dict(record, position=i, page=data.get('pages_and_src')[i].get('page'), stage='download',
+                         attempts=record.get('attempts') + (before.get('attempts', 0) if before.get('stage') == 'download' else 0))
+        failed.append(entry)
+    if (failed):
+        printAndLogInfo("".join([timestamp(), ' ', data.get('directory'), ': ', str(len(failed)), ' pages failed (',
+                                  ', '.join(sorted(set(entry.get('error', '?') for entry in failed))), '). The next run or --check retries only those.']))
+    data['failed_pages'] = failed
+    return failed
+
+
+def logChapterDownloaded(data): # After updateDeadLetters, so failed_pages is this download's.
+    failed = len(data.get('failed_pages') or [])
+    if (failed):
+        logging.info("".join([timestamp(), ' ', data.get('chapter_url'), ' downloaded with ', str(failed), ' of ', str(len(data.get('image_files_paths'))), ' pages failed.']))
+    else:
+        logging.info("".join([timestamp(), ' ', data.get('chapter_url'), ' successfully downloaded.']))
+
+
+def retryDeadLetters(data): # Multiple requests, only for the pages in failed_pages.
+    entries = data.get('failed_pages') or []
+    if (not entries):
+        return 0
+    printAndLogInfo("".join([timestamp(), ' Retrying ', str(len(entries)), ' failed pages of ', data.get('directory')]))
+    for entry in entries:
+        if (entry.get('stage') == 'resolve' and entry.get('page_url')):
+            try:
+                src = retryCall(requestImageSrc, entry.get('page_url'), entry.get('page'), entry.get('site')).get('src')
+                data['pages_src'][entry['position']] = src
+                data['pages_and_src'][entry['position']]['src'] = src
+            except requests.exceptions.RequestException as exc:
+                entry.update(failureRecord(exc), attempts=entry.get('attempts', 0) + getattr(exc, 'attempts', 1))
+    positions = [entry['position'] for entry in entries if data.get('pages_src')[entry['position']]]
+    failures = {}
+    archive = openChapterArchive(data)
+    downloadPages([data.get('pages_src')[i] for i in positions], [data.get('image_files_paths')[i] for i in positions], failures, archive, data.get('directory'))
+    updateDeadLetters(data, failures, archive)
+    closeChapterArchive(data, archive)
+    if (archive):
+        data['page_manifest'] = chapterManifest(data)
+    else:
+        manifest = data.get('page_manifest') or [None] * len(data.get('image_files_paths'))
+        for i in positions:
+            manifest[i] = landedRecord(data.get('image_files_paths')[i])
+        data['page_manifest'] = manifest
+    processChapter(data)
+    writeChapter(data, "".join([data.get('directory'), '.json']))
+    return len(entries) - len(data.get('failed_pages'))
+
+
+def requestImageSrc(url, page, manga_site): # 1 request. Parses the page as it arrives and stops reading once the image src is found.
+    parser = getSite(manga_site).srcParser() # A fresh parser per page, worker threads never share parser state.
+
+    entry = cache.lookup(url, 'src') if cache else None # Only the src is kept, the rest of the page is never read.
+    if (cache and cache.isFresh(entry, 'page_resolve')):
+        src = cache.body(entry)
+        if (src):
+            return {'page': page, 'src': src}
+
+    slot = getController().acquire(url) # Waits for room under this host's concurrency limit.
+    started = time.time()
+    try:
+        response = getClient().get(url, stream=True, headers=cache.validators(entry) if cache else None)
+    except requests.exceptions.RequestException as exc:
+        getController().release(url, slot, error=exc)
+        recordError(url, 'page_resolve', exc)
+        raise
+    if (response.status_code == 304 and entry):
+        response.close()
+        getController().release(url, slot, response.elapsed.total_seconds(), response.status_code)
+        recordResponse(response, 'page_resolve', 0, started)
+        src = cache.body(entry, revalidated=True)
+        if (src):
+            return {'page': page, 'src': src}
+        return requestImageSrc(url, page, manga_site)
+    if (not response.ok): # Raised for retryCall to decide on, see retry.RETRY_POLICIES.
+        response.close()
+        getController().release(url, slot, response.elapsed.total_seconds(), response.status_code)
+        recordResponse(response, 'page_resolve', 0, started)
+        raiseForResponse(response)
+    if (response.encoding is None):
+        response.encoding = 'utf-8'
+    decoded = [0]
+    def counted(chunks):
+        for chunk in chunks:
+            decoded[0] += len(chunk)
+            yield chunk
+    try:
+        src = streamImageSrc(parser, counted(response.iter_content(STREAM_CHUNK_SIZE, decode_unicode=True)))
+    finally:
+        finishResponse(response)
+        getController().release(url, slot, response.elapsed.total_seconds(), response.status_code)
+        recordResponse(response, 'page_resolve', decoded[0], started)
+
+    if (src is None):
+        raise fetchError('parse', url, None)
+    if (cache):
+        cache.store(url, src, response.headers.get('ETag'), response.headers.get('Last-Modified'), kind='src')
+    return {'page': page, 'src': src}
+
+
+def finishResponse(response):
+    # Drain a short tail so the keep-alive connection goes back to the pool, hang up on a long one to save the bytes.
+    length = contentLength(response)
+    if (length is not None and length - response.raw.tell() <= STREAM_DRAIN_LIMIT):
+        response.raw.drain_conn()
+        response.raw.release_conn()
+    else:
+        response.close()
+
+
+def checkChapterIntegrity(search_string, manga_site, deep=False):
     def update(search_result, manga_site):
         master_json_file = "".join([search_result, '_', 'chapters.json'])
-        json_data = open(master_json_file).read() # akame_ga_kiru_chapters.json
-        data = json.loads(json_data)
+        data = readSeries(master_json_file) # akame_ga_kiru_chapters.json
 
         setup = dict(chapter_urls=data.get('chapter_urls'), search_url=data.get('search_url'))
 
         createMasterChapterIntegrityFile(setup, manga_site)
         updateIntegrityFiles(master_json_file)
+        return [json_file for json_file in data.get('chapter_json_files') if chapterResolved(json_file)]
 
     search_string = "".join(['*',search_string,'*'])
-    if (manga_site == 'mangahere'):
-        search_results = glob.glob("".join(os.path.join('mangahere',search_string)))
-    elif (manga_site == 'mangabee'):
-        search_results = glob.glob("".join(os.path.join('mangabee',search_string)))
+    search_results = []
+    if (manga_site in siteNames()):
+        search_results = glob.glob(os.path.join(manga_site, search_string)) # The site name is also its root directory.
     else:
         printAndLogInfo( "".join(['No such manga site.']) )
 
@@ -352,11 +1007,10 @@ def checkChapterIntegrity(search_string, manga_site):
 
     if (len(search_results) == 1): # only one choice so..
 
-        update(search_results[0], manga_site)
-        json_files = glob.glob(os.path.join(search_results[0], '*.json'))
+        json_files = update(search_results[0], manga_site)
 
         for json_file in json_files:
-            verify(json_file)
+            verify(json_file, deep)
             pass
 
     # Example choices:
@@ -376,142 +1030,548 @@ def checkChapterIntegrity(search_string, manga_site):
             printAndLogInfo('\nCancelling...')
             exit()
 
-        update(search_results[index])
-
-        json_files = glob.glob(os.path.join(search_results[index], '*.json'))
+        json_files = update(search_results[index], manga_site)
         if (json_files):
             for json_file in json_files:
-                verify(json_file)
+                verify(json_file, deep)
         else:
             printAndLogInfo("".join([timestamp(), ' No integrity json file found in ',search_results[index], '.']))
     else:
         printAndLogInfo("".join([timestamp(), ' No such manga found.']))
 
 
-def verify(json_file):
-    json_data = open(json_file).read()
-    data = json.loads(json_data)
+def auditChapter(json_file, stats, deep=False): # 0 requests. What verify would find, going by the series scan instead of a stat per page.
+    data = readChapter(json_file)
+    if (data is None):
+        return None
+    image_files_paths = data.get('image_files_paths')
+    if (archived(data)):
+        archive_file = archivePath(data.get('directory'))
+        archive_file = archive_file if archive_file in stats else "".join([archive_file, '.part'])
+        if (archive_file in stats):
+            verifyArchive = verifyArchiveDeep if deep else verifyArchiveFast
+            bad_pages = verifyArchive(archive_file, [memberName(path) for path in image_files_paths], data.get('page_manifest'))[0]
+        else:
+            bad_pages = list(range(0, len(image_files_paths)))
+    elif (deep):
+        bad_pages = verifyPagesDeep(image_files_paths, data.get('page_manifest'))[0]
+    else:
+        bad_pages = verifyPagesFast(image_files_paths, data.get('page_manifest'), stats)[0]
+    bad_pages = sorted(set(bad_pages) | set(entry.get('position') for entry in data.get('failed_pages') or [] if entry.get('position') is not None))
+    return dict(json_file=json_file, directory=data.get('directory'), pages=len(image_files_paths), bad_pages=bad_pages,
+                unresolved=len([i for i in bad_pages if not data.get('pages_src')[i]]))
+
+
+def auditLibrary(root_directories=None, deep=False, workers=None):
+    # Every series under every site: its tree is scanned once, then all its chapters are checked against their manifests on a
+    # thread pool. No requests. Returns (chapter results, chapters never resolved, seconds).
+    started = time.time()
+    results = []
+    unresolved = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers if workers else os.cpu_count()) as executor:
+        for root_directory in root_directories if root_directories else siteNames():
+            for master_file in sorted(glob.glob(os.path.join(root_directory, '*_chapters.json'))):
+                header, chapters = seriesChapters(master_file)
+                stats = scanTree(header.get('base_directory'))
+                json_files = [chapter['json_file'] for chapter in chapters]
+                checked = [result for result in executor.map(lambda json_file: auditChapter(json_file, stats, deep),
+                                                             json_files if catalog else [json_file for json_file in json_files if json_file in stats]) if result]
+                unresolved += len(json_files) - len(checked)
+                results += checked
+    return results, unresolved, round(time.time() - started, 2)
+
+
+def printAuditReport(results, unresolved, seconds):
+    damaged = [result for result in results if result['bad_pages']]
+    printAndLogInfo("".join([timestamp(), ' Checked ', str(len(results)), ' chapters, ', str(sum(result['pages'] for result in results)), ' pages in ', str(seconds), 's']))
+    for result in damaged[:AUDIT_REPORT_LINES]:
+        state = 'missing' if len(result['bad_pages']) == result['pages'] else 'short'
+        printAndLogInfo("".join(['  ', result['directory'], ': ', state, ', ', str(len(result['bad_pages'])), ' of ', str(result['pages']), ' pages (',
+                                 ', '.join([mangaNumbering(str(i + 1)) for i in result['bad_pages'][:10]]), ', ...' if len(result['bad_pages']) > 10 else '', ')',
+                                 "".join([', ', str(result['unresolved']), ' without a src']) if result['unresolved'] else '']))
+    if (len(damaged) > AUDIT_REPORT_LINES):
+        printAndLogInfo("".join(['  ... and ', str(len(damaged) - AUDIT_REPORT_LINES), ' more chapters']))
+    if (unresolved):
+        printAndLogInfo("".join(['  ', str(unresolved), ' chapters were never resolved. Download their series again to fetch them.']))
+    printAndLogInfo("".join([timestamp(), ' To repair: ', str(sum(len(result['bad_pages']) for result in damaged)), ' pages in ', str(len(damaged)), ' chapters']))
+    return damaged
+
+
+def verifyLibrary(deep=False, dry_run=False):
+    # Audits the whole library first, then only chapters with missing or bad pages go to verify, several at a time.
+    results, unresolved, seconds = auditLibrary(deep=deep)
+    damaged = printAuditReport(results, unresolved, seconds)
+    if (dry_run or not damaged):
+        return damaged
+    with concurrent.futures.ThreadPoolExecutor(max_workers=REPAIR_CHAPTERS) as executor:
+        list(executor.map(lambda result: verify(result['json_file'], deep, pause=False), damaged))
+    return damaged
+
+
+def verify(json_file, deep=False, pause=True):
+    data = readChapter(json_file)
     printAndLogInfo( "".join([timestamp(), ' Verifying ', data.get('directory') , '...']) )
-
-    img_file_count = imageFileCount(data.get('directory'))
-    directory = data.get('directory')
-
-    if ( data.get('downloaded') == 'Not Downloaded' or int(img_file_count) != int(data.get('len')) ):
-
-        if not os.path.exists(directory):
+    retryDeadLetters(data) # Pages that failed last time first, they need resolving or are known to be missing.
+    restoreFromBlobs(data)
+
+    directory         = data.get('directory')
+    image_files_paths = data.get('image_files_paths')
+    pages_src         = [dic.get('src') for dic in data.get('pages_and_src')]
+    archive_file      = archivePath(directory) if archived(data) else None
+    names             = [memberName(path) for path in image_files_paths]
+
+    if (archive_file): # Members' sizes come from the central directory, --deep reads and hashes each one.
+        verifyArchive = verifyArchiveDeep if deep else verifyArchiveFast
+        bad_pages, manifest = verifyArchive(archive_file if os.path.isfile(archive_file) else "".join([archive_file, '.part']), names, data.get('page_manifest'))
+    elif (deep): # Re-hash every page on all cores.
+        bad_pages, manifest = verifyPagesDeep(image_files_paths, data.get('page_manifest'))
+    else:      # Re-hash only pages whose size or mtime moved since the manifest was written.
+        bad_pages, manifest = verifyPagesFast(image_files_paths, data.get('page_manifest'))
+
+    if (bad_pages):
+        if (not archive_file and not os.path.exists(directory)):
             os.mkdir(directory) # ..mangahere/tokyo_ghouls/
             logging.info("".join([timestamp(), ' Created directory: ', directory]))
 
-        pages_src = []
-        for dic in data.get('pages_and_src'):
-            pages_src.append(dic.get('src'))
-
-        downloadConcurrently(pages_src, data.get('image_files_paths')) # Parameter examples: http://z.mhcdn.net/store/manga/3249/01-001.0/compressed/gokko_story01_w.s_001.jpg?v=11216726214d, "mangahere\\gokko\\gokko_c001\\001.jpg" ...
-        data['downloaded'] = 'Downloaded'
-        printAndLogInfo( "".join([data.get('chapter_url'), ' Chapter downloaded successfully.']) )
-        seconds = str(randomSleep(3,5)) # Introduce a longer delay after you downloaded a whole chapter.
-        print("".join(['waiting ', seconds, ' seconds...']))
-        writeToJson(data, json_file) # Write again and specify that the whole chapter is downloaded successfully.
-    else:
-        if ( int(img_file_count) == int(data.get('len')) ):
-            printAndLogInfo( "".join([timestamp(), ' ', data.get('directory'), ' Integrity check is good for this chapter.']) )
+        printAndLogInfo( "".join([timestamp(), ' ', directory, ' is missing or has bad pages: ', ', '.join([mangaNumbering(str(i + 1)) for i in bad_pages])]) )
+        for i in bad_pages:
+            if (not archive_file and os.path.isfile(image_files_paths[i])):
+                os.remove(image_files_paths[i]) # Corrupt, fetch it again from scratch.
+        archive = openChapterArchive(data, replace=set(names[i] for i in bad_pages)) # Bad members are left out of the rewritten archive.
+        failures = {}
+        downloadPages([pages_src[i] for i in bad_pages], [image_files_paths[i] for i in bad_pages], failures, archive, directory) # Parameter examples: http://z.mhcdn.net/store/manga/3249/01-001.0/compressed/gokko_story01_w.s_001.jpg?v=11216726214d, "mangahere\\gokko\\gokko_c001\\001.jpg" ...
+        updateDeadLetters(data, failures, archive)
+        closeChapterArchive(data, archive)
+        if (archive):
+            manifest = chapterManifest(data)
+        for i in bad_pages:
+            if (not archive):
+                manifest[i] = landedRecord(image_files_paths[i])
+            if (catalog):
+                catalog.markPage(directory, i, manifest[i]) # Committed page by page.
+        if (None not in manifest):
+            data['downloaded'] = 'Downloaded'
+            printAndLogInfo( "".join([data.get('chapter_url'), ' Chapter downloaded successfully.']) )
         else:
-            printAndLogDebug( "".join([timestamp(), ' ', data.get('directory'), ' Integrity check failed. Something went deeply wrong. File a bug report please.']) )
-
-
-def mangaNumbering(s):
-    if (len(s) == 1):
-        return "".join(['00',s])
-    elif (len(s) == 2):
-        return "".join(['0',s]) # 019, 020, 021 ...
-    elif (len(s) == 3):
-        return s                # 100, 211, 321 ... 599
+            printAndLogInfo( "".join([timestamp(), ' ', directory, ' still has ', str(manifest.count(None)), ' missing pages.']) )
+        if (pause): # Repairs from --verify_library run side by side and are paced per host instead.
+            seconds = randomSleep(3,5) # Introduce a longer delay after you downloaded a whole chapter.
+            if (seconds):
+                getProgress().write("".join(['waited ', str(seconds), ' seconds...']))
+    else:
+        data['downloaded'] = 'Downloaded'
+        printAndLogInfo( "".join([timestamp(), ' ', directory, ' Integrity check is good for this chapter.']) )
 
-    logging.info('Abnormal numbering encountered') # Multiple requests.
-    return "".join(['0',s])
+    data['page_manifest'] = manifest
+    processChapter(data, redo=bad_pages) # Also catches up chapters downloaded before --process_format was set.
+    writeChapter(data, json_file) # Write again with the refreshed manifest.
 
 
-def downloadConcurrently(urls, paths):
-    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor: # Multiple requests.
+def downloadConcurrently(urls, paths, failures=None, archive=None):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=getController().maximum) as executor: # Multiple requests. The controller decides how many run at once per host.
+        futures = []
         for path,url in zip(paths, urls):
-            executor.submit(requestFile, path, url)
-            randomSleep(0,1)
-    return True
+            futures.append(executor.submit(requestFile, path, url, failures, archive)) # Paced per host by the controller and --host_rate, not by sleeping here.
+    return all(future.result() for future in futures)
+
+
+def downloadPages(urls, paths, failures=None, archive=None, chapter=None): # Downloads one chapter with the engine picked by --engine. Pages without a src are skipped.
+    pairs = [(url, path) for url, path in zip(urls, paths) if url]
+    urls, paths = [url for url, path in pairs], [path for url, path in pairs]
+    mirrors = getMirrors()
+    if (mirrors): # New image hosts join their mirror group, groups with a new host get probed in the background.
+        mirrors.addDomains([domain for site in loadedSites() for domain in site.mirror_domains])
+        mirrors.learn(urls)
+    if (chapter):
+        getProgress().startChapter(chapter, paths) # Shown with its pages done next to the run totals while it downloads.
+    try:
+        if (download_engine == 'async'):
+            return all(downloadChapters(lambda path, url: requestFile(path, url, failures, archive), [(urls, paths)], request_rate, async_concurrency)[0])
+        return downloadConcurrently(urls, paths, failures, archive)
+    finally:
+        if (chapter):
+            getProgress().endChapter(chapter)
+        if (archive is None):
+            getWriter().syncChapter(paths) # --fsync chapter: once per chapter instead of per page.
+
+
+def requestFile(output, url, failures=None, archive=None): # True once output is on disk. failures: {url: dead letter record} for pages that gave up.
+    try:
+        retryCall(transferFile, output, url, archive)
+        return True
+    except requests.exceptions.RequestException as exc:
+        if (failures is not None):
+            failures[url] = failureRecord(exc)
+        getProgress().pageFailed(output)
+        return False
 
 
-def requestFile(output, url):
-    with open(output, 'wb') as f:
-        response = requests.get(url, stream=True)
-        writeBytes(int(response.headers.get('Content-Length')))
-        print("".join(['Downloading ', url, ' to ', output]))
+def transferFile(output, url, archive=None): # Raises for retryCall on anything but a whole file on disk.
+    # From the fastest healthy mirror of the src's host, failing over to the src's own host straight away.
+    mirror_url = getMirrors().rewrite(url) if getMirrors() else url
+    if (mirror_url != url):
+        try:
+            return transferFrom(output, mirror_url, archive)
+        except requests.exceptions.RequestException as exc: # Its score took the hit, the next page goes elsewhere.
+            logging.debug("".join([timestamp(), ' Mirror failed, back to ', url, ' ', repr(exc)]))
+    return transferFrom(output, url, archive)
+
+
+def transferFrom(output, url, archive=None):
+    if (archive is not None):
+        return transferToArchive(output, url, archive)
+    part_file = "".join([output, '.part']) # Bytes land here and only become output once complete, so a *.jpg on disk is always whole.
+    offset    = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+    if (getWriter().preallocate and os.path.isfile("".join([output, '.alloc']))): # Killed mid-page with --preallocate, its size says nothing.
+        os.remove("".join([output, '.alloc']))
+    headers   = {'Range': "".join(['bytes=', str(offset), '-'])} if offset else {} # Resume an interrupted transfer.
+
+    slot      = getController().acquire(url) # Waits for room under this host's concurrency limit.
+    started   = time.time()
+    response  = None
+    error     = None
+
+    try:
+        response = getClient().get(url, stream=True, headers=headers)
+        logging.debug("".join([timestamp(), ' Downloading ', url, ' to ', output])) # Per page detail only goes to the log, with --log_level debug.
+
+        if (response.status_code == 416): # Nothing left past our offset. Either the .part is already whole or it is junk.
+            total = contentRangeTotal(response.headers.get('Content-Range'))
+            response.close()
+            recordResponse(response, 'image_download', 0, started)
+            if (total is not None and total == offset):
+                os.replace(part_file, output)
+                markLanded(output, pageRecord(output))
+                return True
+            os.remove(part_file)
+            raise fetchError('incomplete', url, 416) # The retry starts from scratch.
 
         if not response.ok:
-            print("".join(['Could not download from: ', url]))
+            response.close()
+            recordResponse(response, 'image_download', 0, started)
             logging.debug( "".join([timestamp(), ' Could not download from: ', url]))
-            return False
+            raiseForResponse(response)
+
+        if (response.status_code == 206): # Server honoured the Range header, append to what we have.
+            mode  = 'ab'
+            total = contentRangeTotal(response.headers.get('Content-Range'))
+        else:                             # Full body, start over.
+            mode   = 'wb'
+            offset = 0
+            total  = contentLength(response)
+
+        writer = getWriter()
+        response.raw.decode_content = True # The bytes iter_content gave, gzip or deflate bodies decoded.
+        head = b''
+        if (blob_store and offset == 0 and total and blob_store.hasSize(total)): # Maybe a page we already hold, e.g. a credits page.
+            head = writer.readHead(response.raw, PARTIAL_HASH_BYTES)
+            blob = blob_store.lookup(total, partialHash(head))
+            if (blob and blob_store.linkTo(blob, output)): # The rest of the body is never read.
+                response.close()
+                recordResponse(response, 'image_download', len(head), started)
+                getProgress().page(output, total)
+                markLanded(output, pageRecord(output, blob['sha1']))
+                return True
+
+        written  = 0
+        digest   = fileDigest(part_file) if mode == 'ab' else hashlib.new(HASH_ALGORITHM) # Resumed: the bytes already on disk first.
+        reserved = mode == 'wb' and writer.reserves(total)
+        target   = "".join([output, '.alloc']) if reserved else part_file # A preallocated file is full size from the start, so it can't be the .part resumes go by.
+        try:
+            with open(target, mode) as f:
+                if (reserved):
+                    writer.reserve(f, total)
+                written = writer.copy(response.raw, f, head, reserved, digest) # readinto one reusable buffer, --read_kb at a time.
+        finally:
+            if (reserved and os.path.isfile(target)): # Truncated to what arrived, a retry resumes from it like any .part.
+                os.replace(target, part_file)
+        recordResponse(response, 'image_download', written, started)
+    except fetchError:
+        raise
+    except requests.exceptions.RequestException as exc: # Connection dropped mid-transfer. Keep the .part so the next try resumes.
+        error = exc
+        recordError(url, 'image_download', exc)
+        logging.debug("".join([timestamp(), ' Interrupted download from: ', url, ' ', repr(exc)]))
+        raise
+    finally:
+        if (response is not None): # Gives the socket back even when something besides requests failed mid-body, e.g. a full disk.
+            response.close()
+        if (response is not None and error is None):
+            getController().release(url, slot, response.elapsed.total_seconds(), response.status_code)
+        else:
+            getController().release(url, slot, error=error)
+        observeHost(url, response, error)
+
+    if (total is not None and offset + written != total):
+        logging.debug("".join([timestamp(), ' Incomplete download from: ', url, ' got ', str(offset + written), ' of ', str(total), ' bytes.']))
+        raise fetchError('incomplete', url)
+
+    os.replace(part_file, output)
+    getProgress().page(output, offset + written)
+    record = pageRecord(output, digest.hexdigest())
+    markLanded(output, record)
+    if (blob_store):
+        blob_store.addFile(output, record.get('sha1'))
+    if (post_processor):
+        post_processor.submit(output) # Converted on another core while the download threads carry on.
+    return True
 
-        for chunk in response.iter_content(1024):
-            f.write(chunk)
 
+def transferToArchive(output, url, archive): # The page goes from memory into the chapter's .cbz, no file per page. Raises like transferFile.
+    name = memberName(output)
+    if (archive.has(name)):
+        return True
+    slot     = getController().acquire(url)
+    started  = time.time()
+    response = None
+    error    = None
+    try:
+        response = getClient().get(url, stream=True)
+        logging.debug("".join([timestamp(), ' Downloading ', url, ' to ', archive.path, ':', name]))
+        if not response.ok:
+            response.close()
+            recordResponse(response, 'image_download', 0, started)
+            raiseForResponse(response)
+        total  = contentLength(response)
+        writer = getWriter()
+        response.raw.decode_content = True
+        head   = b''
+        body   = None # From the store when a page with the same size and head is already held.
+        if (blob_store and total and blob_store.hasSize(total)):
+            head = writer.readHead(response.raw, PARTIAL_HASH_BYTES)
+            blob = blob_store.lookup(total, partialHash(head))
+            body = blob_store.read(blob) if blob else None
+            if (body is not None): # Copied out of the store, the rest of the body is never read.
+                response.close()
+                recordResponse(response, 'image_download', len(head), started)
+                blob_store.countReuse(len(body))
+        from_store = body is not None
+        if (not from_store):
+            body = writer.readAll(response.raw, total, head) # Straight into one buffer of Content-Length bytes.
+            recordResponse(response, 'image_download', len(body), started)
+    except fetchError:
+        raise
+    except requests.exceptions.RequestException as exc:
+        error = exc
+        recordError(url, 'image_download', exc)
+        logging.debug("".join([timestamp(), ' Interrupted download from: ', url, ' ', repr(exc)]))
+        raise
+    finally:
+        if (response is not None): # Gives the socket back even when something besides requests failed mid-body, e.g. a full disk.
+            response.close()
+        if (response is not None and error is None):
+            getController().release(url, slot, response.elapsed.total_seconds(), response.status_code)
+        else:
+            getController().release(url, slot, error=error)
+        observeHost(url, response, error)
+
+    if (total is not None and len(body) != total):
+        raise fetchError('incomplete', url)
+    record = archive.add(name, body)
+    getProgress().page(output, len(body))
+    markLanded(output, record)
+    if (blob_store and not from_store):
+        blob_store.addMember(archive.path, name, body)
+    if (post_processor):
+        post_processor.submit(output, body) # Converted on another core while the download threads carry on.
     return True
 
 
-def requestWithHeaders(url):
-    headers = {'User-Agent':'Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.125 Safari/537.36',
-                'Content-Type':'text/plain; charset=utf-8', 'Accept':'*/*', 'Accept-Encoding':'gzip,deflate,sdch,text'}
-    req = requests.get(url, headers = headers)
+def markLanded(output, record):
+    # record: the page's {'size', 'mtime', 'sha1'}, hashed while it downloaded. Kept for the chapter manifest, see landedRecord.
+    # With --catalog each page is also committed as it lands, a crash mid-chapter keeps the pages already in.
+    with landed_lock:
+        landed[output] = record
+    if (catalog):
+        catalog.markPagePath(output, record)
 
-    writeBytes(sys.getsizeof(req)) # Add bandwidth usage (GZIP compressed.)
 
-    return req
+def landedRecord(path, read=True): # The record markLanded kept for path, taken so it's used once. Without one, read reads path's.
+    with landed_lock:
+        record = landed.pop(path, None)
+    return record if record or not read else pageRecord(path)
 
 
-def requestContentWithHeaders(url):
-    headers = {'User-Agent':'Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.125 Safari/537.36',
-                'Content-Type':'text/plain; charset=utf-8', 'Accept':'*/*', 'Accept-Encoding':'gzip,deflate,sdch,text'}
-    req = requests.get(url, headers = headers)
+def observeHost(url, response=None, error=None): # Feeds the mirror scores from every image fetch.
+    if (getMirrors()):
+        if (response is not None and error is None):
+            getMirrors().observe(url, response.elapsed.total_seconds(), not response.ok)
+        else:
+            getMirrors().observe(url, error=True)
 
-    writeBytes(sys.getsizeof(req)) # Add bandwidth usage (GZIP compressed.)
 
-    return req.text
+def contentLength(response): # Expected size on disk, None when the server didn't say or the body is re-encoded on the way.
+    length = response.headers.get('Content-Length')
+    if (length is None or not length.isdigit() or response.headers.get('Content-Encoding') not in (None, 'identity')):
+        return None
+    return int(length)
+
 
+def requestWithHeaders(url, phase='setup', headers=None): # phase is one of metrics.PHASES, bandwidth and latency are counted per phase and host.
+    started = time.time()
+    try:
+        req = getClient().get(url, headers=headers) # Shared keep-alive session, default headers are set on the session.
+    except requests.exceptions.RequestException as exc:
+        recordError(url, phase, exc)
+        raise
 
-def requestContentWithHeadersAndKey(url, key):
-    headers = {'User-Agent':'Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.125 Safari/537.36',
-                'Content-Type':'text/plain; charset=utf-8', 'Accept':'*/*', 'Accept-Encoding':'gzip,deflate,sdch,text'}
-    req = requests.get(url, headers = headers)
+    recordResponse(req, phase, len(req.content), started)
+    if (req.status_code == 429 or req.status_code >= 500): # Overloaded, let retryCall back off instead of parsing an error page.
+        raiseForResponse(req)
+
+    return req
+
+
+def requestTextWithHeaders(url, phase='setup'): # Html through the --cache response cache when it is on.
+    if (not cache):
+        return requestWithHeaders(url, phase).text
+
+    entry = cache.lookup(url)
+    if (cache.isFresh(entry, phase)):
+        html = cache.body(entry)
+        if (html is not None):
+            return html
+
+    req = requestWithHeaders(url, phase, cache.validators(entry))
+    if (req.status_code == 304 and entry):
+        html = cache.body(entry, revalidated=True)
+        if (html is not None):
+            return html
+        req = requestWithHeaders(url, phase) # Lost the cached copy in between, fetch it whole.
+    if (req.ok):
+        cache.store(url, req.text, req.headers.get('ETag'), req.headers.get('Last-Modified'))
+    return req.text
 
-    writeBytes(sys.getsizeof(req)) # Add bandwidth usage (GZIP compressed.)
 
-    return {'page':key, 'html': req.text}
+def requestContentWithHeaders(url, phase='search'):
+    return requestTextWithHeaders(url, phase)
 
 
-def writeBytes(b):
-     global bytes
-     bytes += b
+def requestContentWithHeadersAndKey(url, key, phase='page_resolve'):
+    return {'page':key, 'html': requestWithHeaders(url, phase).text}
 
-def printAndLogInfo(string):
-    print(string)
+def printAndLogInfo(string): # Printed above the progress line instead of through it.
+    getProgress().write(string)
     logging.info(string)
 
-def printAndLogDebug(string):
-    print(string)
+def printAndLogDebug(string): # Per page detail, only in the log and only with --log_level debug.
     logging.debug(string)
 
-bytes = 0 # Keep track of bytes used.
+def ttlOption(value): # --cache_ttl parsed up front, so a typo is a usage error and not a traceback.
+    try:
+        return parseTtls(value)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc))
+
+download_engine   = 'threads' # 'threads' or 'async'. Set from the --engine option.
+request_rate      = 2.0       # Requests per second per host for the async engine.
+async_concurrency = 8         # Image transfers in flight for the async engine.
+cache             = None      # responseCache when --cache is set, html requests then go through it.
+catalog           = None      # mangaCatalog when --catalog is set, chapter state then lives in SQLite instead of per-chapter json files.
+mangabee_resolve  = 'full'    # 'full' fetches every page's html for its src, 'predict' generates srcs from sampled pages.
+predict_confirm   = 'head'    # 'head' checks predicted srcs before saving them, 'download' only re-resolves pages that fail to download.
+output_format     = 'directory' # 'directory' writes a file per page, 'cbz' writes each chapter into <directory>.cbz. Set from --format.
+post_processor    = None        # imagePostProcessor when --process_format is set.
+blob_store        = None        # blobStore when --blobs is set, identical pages are then stored once.
+landed            = {}          # {page path: manifest record} for pages downloaded this run, until their chapter's manifest takes them.
+landed_lock       = threading.Lock()
 
 @click.command()
 @click.option('--manga_site', default='mangahere', help='Usage: mangaget.py --manga_site=mangabee bleach\nAvailable: mangahere mangabeet')
 @click.option('--check', default=False, help='Usage: mangaget.py --check=True naruto\nDownload ALL manga chapters you are missing. And redownloads chapter if it is missing pages. Gives a choice if there are similar manga names.')
 @click.option('--no_dl', default=0, help='Usage: mangaget --no_dl=True naruto\nJust searches.')
 @click.option('--select', default=(0,0), nargs=2, type=int, help='Usage: mangaget --select 1 3 naruto\n...--select 4 4 ...\t\t\tto download only chapter 4')
-@click.argument('search_term')
-
-def mangaget(search_term, select, manga_site, no_dl, check):
-    global bytes
+@click.option('--timeout', default=30, type=float, help='Usage: mangaget --timeout 60 naruto\nSeconds to wait on a server before giving up on a request.')
+@click.option('--pool_size', default=50, type=int, help='Usage: mangaget --pool_size 20 naruto\nKeep-alive connections kept open per host.')
+@click.option('--engine', default='threads', type=click.Choice(['threads', 'async']), help='Usage: mangaget --engine async naruto\nthreads: a chapter at a time, requests in flight per host adapted to latency and errors (see --workers, --host_rate). async: all pages at once, paced per host by --rate.')
+@click.option('--rate', default=2.0, type=float, help='Usage: mangaget --engine async --rate 4 naruto\nRequests per second per host for the async engine.')
+@click.option('--concurrency', default=8, type=int, help='Usage: mangaget --engine async --concurrency 16 naruto\nImage downloads in flight for the async engine.')
+@click.option('--pipeline', is_flag=True, help='Usage: mangaget --pipeline naruto\nResolve, download and verify chapters in overlapping stages so the first pages land right away.')
+@click.option('--stage_workers', default=(4,2,1), nargs=3, type=int, help='Usage: mangaget --pipeline --stage_workers 4 2 1 naruto\nChapters worked on at once in the resolve, download and verify stages.')
+@click.option('--deep', is_flag=True, help='Usage: mangaget --check=True --deep naruto\nRe-hash every page on all cores instead of only pages whose size or date changed.')
+@click.option('--catalog', 'catalog_path', default=None, help='Usage: mangaget --catalog mangaget.db naruto\nKeep chapter and page state in a SQLite catalog instead of per-chapter json files.')
+@click.option('--import_catalog', is_flag=True, help='Usage: mangaget --catalog mangaget.db --import_catalog\nImport existing mangahere/ and mangabee/ json integrity files into the catalog and exit.')
+@click.option('--metrics_json', default=None, help='Usage: mangaget --metrics_json run.json naruto\nWrite bytes, requests, errors and latency per host and phase as json when the run finishes.')
+@click.option('--metrics_prom', default=None, help='Usage: mangaget --metrics_prom /var/lib/node_exporter/mangaget.prom naruto\nWrite the same metrics as a Prometheus textfile.')
+@click.option('--cache', 'cache_dir', default=None, help='Usage: mangaget --cache .mangaget_cache naruto\nCache search, chapter list and page html on disk and revalidate it with ETag/Last-Modified. Images are never cached.')
+@click.option('--cache_mb', default=200, type=int, help='Usage: mangaget --cache .mangaget_cache --cache_mb 500 naruto\nSize cap for the cache, least recently used entries are dropped past it.')
+@click.option('--cache_ttl', default='', callback=lambda ctx, param, value: ttlOption(value), help='Usage: mangaget --cache .mangaget_cache --cache_ttl search=3600,setup=600,page_resolve=2592000 naruto\nSeconds a cached page is used without asking the server, per page type.')
+@click.option('--update', is_flag=True, help='Usage: mangaget --update naruto\nOnly resolve and download chapters added or moved since the last run of this series.')
+@click.option('--batch', 'batch_file', default=None, help='Usage: mangaget --batch library.txt\nDownload every series listed in the file without prompting. Lines: site | url  or  site | search term | first/exact/N')
+@click.option('--series_workers', default=4, type=int, help='Usage: mangaget --batch library.txt --series_workers 8\nSeries worked on at once in --batch mode.')
+@click.option('--max_connections', default=0, type=int, help='Usage: mangaget --batch library.txt --max_connections 8\nHard cap on open connections per host, threads wait for a free one. 0 for no cap.')
+@click.option('--host_rate', default=0.0, type=float, help='Usage: mangaget --batch library.txt --host_rate 4\nRequests per second per host across every series and thread. 0 for unlimited.')
+@click.option('--mangabee_resolve', 'resolve_mode', default='full', type=click.Choice(['full', 'predict']), help='Usage: mangaget --manga_site mangabee --mangabee_resolve predict naruto\nfull: fetch every page\'s html for its image src. predict: learn the src pattern from two sampled pages and generate the rest.')
+@click.option('--predict_confirm', 'confirm_mode', default='head', type=click.Choice(['head', 'download']), help='Usage: mangaget --manga_site mangabee --mangabee_resolve predict --predict_confirm download naruto\nhead: check each predicted src with a HEAD request. download: only re-resolve pages that fail to download.')
+@click.option('--workers', default=0, type=int, help='Usage: mangaget --workers 10 naruto\nPin requests in flight per host. 0 adapts it to latency, 429/503s and connection errors.')
+@click.option('--latency_target', default=2.0, type=float, help='Usage: mangaget --latency_target 1 naruto\nSeconds to first byte above which a host counts as overloaded and gets fewer requests in flight.')
+@click.option('--format', 'format_mode', default='directory', type=click.Choice(['directory', 'cbz']), help='Usage: mangaget --format cbz naruto\ndirectory: a folder of page files per chapter. cbz: each chapter written straight into one stored zip, <chapter>.cbz.')
+@click.option('--to_cbz', is_flag=True, help='Usage: mangaget --to_cbz\nPack every downloaded chapter under mangahere/ and mangabee/ into .cbz archives, several at a time, and exit.')
+@click.option('--process_format', default=None, type=click.Choice(['webp', 'jpeg']), help='Usage: mangaget --process_format webp --process_width 1072 naruto\nRe-encode pages on all cores as they download, into <chapter>_<settings>/. Needs Pillow.')
+@click.option('--process_width', default=0, type=int, help='Usage: mangaget --process_format jpeg --process_width 758 --process_gray naruto\nScale processed pages down to this width. 0 keeps the width.')
+@click.option('--process_gray', is_flag=True, help='Usage: mangaget --process_format jpeg --process_gray naruto\nProcessed pages in grayscale, for e-ink readers.')
+@click.option('--process_quality', default=80, type=int, help='Usage: mangaget --process_format webp --process_quality 70 naruto\nEncoder quality of processed pages.')
+@click.option('--blobs', 'blob_dir', default=None, help='Usage: mangaget --blobs blobs naruto\nStore identical pages once, keyed by hash, and skip downloading pages already held (credit pages, covers).')
+@click.option('--verify_library', is_flag=True, help='Usage: mangaget --verify_library --dry_run\nCheck every chapter of every series on disk against its manifest, report missing or short chapters and re-download only their bad pages.')
+@click.option('--dry_run', is_flag=True, help='Usage: mangaget --verify_library --dry_run\nOnly report what --verify_library would repair, no requests.')
+@click.option('--mirrors', 'mirror_groups', multiple=True, help='Usage: mangaget --mirrors z.mhcdn.net,m.mhcdn.net naruto\nImage hosts that serve the same files, comma separated, one group per --mirrors. Hosts on a site\'s CDN domain are learned on their own.')
+@click.option('--no_mirrors', is_flag=True, help='Usage: mangaget --no_mirrors naruto\nFetch every image from the host in its src, no probing or rewriting to faster mirrors.')
+@click.option('--log_level', default='info', type=click.Choice(['info', 'debug']), help='Usage: mangaget --log_level debug naruto\ndebug also logs every page request and failed attempt to mangaget.py.log. The file rolls over past 10MB.')
+@click.option('--serve', is_flag=True, help='Usage: mangaget --serve  or  mangaget --serve naruto\nRead the library in a browser at http://127.0.0.1:8642/. Chapters download as they are opened, the next few ahead of the reader. With a search term the series is set up first, nothing downloaded.')
+@click.option('--serve_port', default=8642, type=int, help='Usage: mangaget --serve --serve_port 9000\nPort of the --serve reader.')
+@click.option('--prefetch', default=2, type=int, help='Usage: mangaget --serve --prefetch 5\nChapters --serve downloads ahead of the one being read.')
+@click.option('--read_kb', default=READ_SIZE // 1024, type=int, help='Usage: mangaget --read_kb 1024 naruto\nKB read from the connection and written to disk at a time per page.')
+@click.option('--preallocate', is_flag=True, help='Usage: mangaget --preallocate naruto\nReserve each page\'s Content-Length on disk before writing it (Linux), against fragmentation on busy disks.')
+@click.option('--fsync', 'fsync_policy', default='never', type=click.Choice(['never', 'file', 'chapter']), help='Usage: mangaget --fsync chapter naruto\nFlush pages to the disk: never (the OS decides), file (each page before it is renamed into place) or chapter (once per chapter).')
+@click.option('--dedupe', is_flag=True, help='Usage: mangaget --blobs blobs --dedupe\nMove every page under mangahere/ and mangabee/ into the blob store, replacing duplicates with hard links, and exit.')
+@click.argument('search_term', required=False)
+
+def mangaget(search_term, select, manga_site, no_dl, check, timeout, pool_size, engine, rate, concurrency, pipeline, stage_workers, deep, catalog_path, import_catalog, metrics_json, metrics_prom, cache_dir, cache_mb, cache_ttl, update, batch_file, series_workers, max_connections, host_rate, resolve_mode, confirm_mode, workers, latency_target, format_mode, to_cbz, process_format, process_width, process_gray, process_quality, blob_dir, verify_library, dry_run, mirror_groups, no_mirrors, log_level, serve, serve_port, prefetch, read_kb, preallocate, fsync_policy, dedupe):
+    global download_engine, request_rate, async_concurrency, catalog, cache, mangabee_resolve, predict_confirm, output_format, post_processor, blob_store
     """A program that downloads manga from mangahere and mangabee."""
     index = 888
 
+    configureLogging(log_level)
+    getProgress().start() # Pages, MB/s and ETA for the run and the chapters in flight, redrawn every second.
+    configureClient(pool_maxsize=max_connections if max_connections else pool_size, timeout=(min(timeout, 10), timeout), # All page, search and image requests share this pooled session.
+                    pool_block=bool(max_connections), host_rate=host_rate)
+    configureController(fixed=workers if workers else None, latency_target=latency_target)
+    configureWriter(read_kb * 1024, preallocate, fsync_policy)
+    if (not no_mirrors):
+        configureMirrors(parseMirrorGroups(mirror_groups))
+    download_engine   = engine
+    request_rate      = rate
+    async_concurrency = concurrency
+    mangabee_resolve  = resolve_mode
+    predict_confirm   = confirm_mode
+    output_format     = format_mode
+
+    if (process_format):
+        if (not pillowAvailable()):
+            print('--process_format needs Pillow. Try pip install Pillow')
+            exit()
+        post_processor = imagePostProcessor(processSettings(process_format, process_width, process_gray, process_quality))
+    if (blob_dir or dedupe):
+        blob_store = blobStore(blob_dir if blob_dir else 'blobs')
+
+    if (cache_dir):
+        cache = responseCache(cache_dir, cache_mb * 1000000, cache_ttl)
+    if (catalog_path or import_catalog):
+        catalog = mangaCatalog(catalog_path if catalog_path else 'mangaget.db')
+    if (import_catalog):
+        series, chapters = importJsonTree(catalog, siteNames())
+        printAndLogInfo("".join([timestamp(), ' Imported ', str(series), ' series and ', str(chapters), ' chapters into ', catalog.path]))
+        exit()
+    if (to_cbz):
+        convertLibrary()
+        exit()
+    if (dedupe):
+        dedupeLibrary()
+        exit()
+    if (not search_term and not batch_file and not verify_library and not serve):
+        print('Missing SEARCH_TERM. Try mangaget.py --help')
+        exit()
+
     if (select):
         if (select[1] < select[0]):
             print('Not a valid manga range. try ...--select 1 3... downloads chapters 1 to 3')
@@ -524,13 +1584,19 @@ def mangaget(search_term, select, manga_site, no_dl, check):
             #print('Generating integrity json files for all chapters..')
             pass
 
-    if (manga_site == 'mangahere' or manga_site == 'mangabee'):
-        pass
-    else:
+    if (manga_site not in siteNames()):
         printAndLogInfo('Not a valid manga site')
 
-    if (check): ## --check integrity of selected manga.
-        checkChapterIntegrity(search_term, manga_site)
+    if (batch_file): ## --batch: many series, no prompts.
+        runBatch(readBatchFile(batch_file), series_workers, update)
+    elif (verify_library): ## --verify_library: every series on disk, damaged chapters only.
+        verifyLibrary(deep, dry_run)
+        shutdownHashPool()
+    elif (serve and not search_term): ## --serve: read what's on disk, download as it's read.
+        serveLibrary(serve_port, prefetch)
+    elif (check): ## --check integrity of selected manga.
+        checkChapterIntegrity(search_term, manga_site, deep)
+        shutdownHashPool()
     else:
         ### Search for manga on manga site ###
         search_results = search(search_term, manga_site)
@@ -557,13 +1623,37 @@ def mangaget(search_term, select, manga_site, no_dl, check):
         if (no_dl): # Don't download if set.
             exit()
 
-        setup = initializeSetup(search_results[index], manga_site) # Initialize the downloading process.
-        chapter_json_file = createMasterChapterIntegrityFile(setup, manga_site)
-        updateIntegrityFiles(chapter_json_file.get('file_path'), select[0], select[1])
-        downloadManga(chapter_json_file.get('file_path'), select)
-
-    printAndLogInfo("".join([timestamp(), ' Finished... ', 'Usage: ', str(sizeMegs(bytes)), 'MB']))
-    printAndLogInfo("".join([timestamp(), ' Finished... ', 'Usage: ', str(sizeKilo(bytes)), 'KB', '\n']))
+        if (update): # Work scales with new chapters instead of all chapters.
+            updateSeries(search_results[index], manga_site)
+        else:
+            setup = initializeSetup(search_results[index], manga_site) # Initialize the downloading process.
+            chapter_json_file = createMasterChapterIntegrityFile(setup, manga_site)
+            if (serve): # Chapters are resolved and downloaded as they are read.
+                serveLibrary(serve_port, prefetch, chapter_json_file.get('file_path'))
+            elif (pipeline):
+                pipelineManga(chapter_json_file.get('file_path'), select, stage_workers)
+            else:
+                updateIntegrityFiles(chapter_json_file.get('file_path'), select[0], select[1])
+                downloadManga(chapter_json_file.get('file_path'), select)
+
+    getProgress().stop()
+    wire_bytes = getMetrics().totalWireBytes()
+    printAndLogInfo("".join([timestamp(), ' Finished... ', 'Usage: ', str(sizeMegs(wire_bytes)), 'MB']))
+    printAndLogInfo("".join([timestamp(), ' Finished... ', 'Usage: ', str(sizeKilo(wire_bytes)), 'KB', '\n']))
+    if (cache):
+        printAndLogInfo(cache.statsLine())
+    if (blob_store):
+        printAndLogInfo(blob_store.statsLine())
+    if (post_processor):
+        printAndLogInfo(post_processor.statsLine())
+        post_processor.shutdown()
+    if (metrics_json):
+        getMetrics().writeJson(metrics_json)
+    if (metrics_prom):
+        getMetrics().writePrometheus(metrics_prom)
+    for line in connectionStatsLines(getClient().stats()) + getController().statsLines() + (getMirrors().statsLines() if getMirrors() else []): # Confirm connections are being reused.
+        logging.info("".join([timestamp(), ' ', line]))
+        print(line)
 
 ###
 ### Main
@@ -1,5 +1,10 @@
 from html.parser import HTMLParser
+import os
 import re
+import urllib.parse
+
+from sites import siteAdapter
+from helper import mangahereUrlify
 
 def onlyNumbers(s):
     s = re.sub(r'[^\d.]+', '', s) # Remove all characters and whitespace
@@ -150,3 +155,44 @@ class mangahereHTMLGetImageSrcs(HTMLParser):
 
     def handle_data(self, data):
         pass
+
+class mangahereSite(siteAdapter):
+    name           = 'mangahere'
+    url            = 'http://www.mangahere.co'
+    mirror_domains = ('mhcdn.net',) # Pages come off z.mhcdn.net and its siblings.
+
+    def searchUrl(self, manga_name):
+        return self.url + '/search.php?name=%s' % urllib.parse.quote(mangahereUrlify(manga_name))
+
+    def searchResults(self, html):
+        parser = mangahereSearchParser()
+        parser.feed(html)
+        return parser.urls # ['http://www.mangahere.co/manga/boku_to_kanojo_no_game_sensou/', 'http://www.mangahere.co/manga/no_game_no_life/', ...]
+
+    def seriesSlug(self, manga_name):
+        return mangahereUrlify(manga_name).lower() # 'No Game No Life' -> 'no_game_no_life'
+
+    def chapterUrls(self, html, series_url):
+        parser = mangahereVolumeChapterParser() # Grabs all the chapters from the manga's html page.
+        parser.feed(html)
+        return parser.urls # ['http://www.mangahere.co/manga/hack_legend_of_twilight/v03/c000.4/' ... 'http://www.mangahere.co/manga/hack_legend_of_twilight/v03/c000.3/']
+
+    def mangaName(self, first_chapter_url):
+        if (len(first_chapter_url.split('/')) < 8):
+            return first_chapter_url.rsplit('/',4)[2]  # volume based: ['http:', '', 'www.mangahere.co', 'manga', 'hack_legend_of_twilight', 'v01', 'c000', ''] count: 8
+        else:
+            return first_chapter_url.rsplit('/',4)[1]  # !volumebased: ['http:', '', 'www.mangahere.co', 'manga', 'tora_kiss_a_school_odyssey', 'c001.1', '']  count: 7
+
+    def chapterNumber(self, chapter_url):
+        return chapter_url.rsplit('/',2)[1] # Use the part of the url for chapter numbering, e.g. c019.
+
+    def chapterDirectory(self, base_directory, manga_name, chapter_number):
+        return os.path.join( base_directory, "".join( [manga_name, '_', chapter_number] ) )  # 'mangahere/Tokyo_Ghoul/Tokyo_Ghoul_c001 ... Tokyo_Ghoul_c135'
+
+    def pageList(self, html, chapter_url):
+        parser = mangahereHTMLGetImageUrls()
+        parser.feed(html)
+        return parser.page_urls, parser.page_numbers
+
+    def srcParser(self):
+        return mangahereHTMLGetImageSrcs()
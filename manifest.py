@@ -0,0 +1,186 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+
+from helper import timestamp
+from sites import getSite
+
+###
+### Config
+###
+MANIFEST_FORMAT = 2 # Files without a format key are the original layout and are still read.
+
+# Chapter file (one json object):
+#   {"format": 2, "chapter_url": .., "chapter_number": .., "directory": .., "downloaded": true, "src_base": "http://z.mhcdn.net/store/manga/3249/",
+#    "pages": [["001", "01-001.0/compressed/a_001.jpg", 123456, 1408960000.0, "sha1.."], ["002", "01-001.0/compressed/a_002.jpg"], ["003", null]]}
+#   One row per page: number, src after src_base, then size, mtime and sha1 once the page is downloaded. Paths, page count and
+#   base_directory are derived. failed_pages, processed and manga_site are only written when there are any.
+#
+# Series file (json lines, so a reader only ever holds one chapter):
+#   {"format": 2, "root_directory": "mangahere", "base_directory": .., "manga_name": .., "search_url": .., "file_path": ..}
+#   ["c001", "http://www.mangahere.co/manga/abc/c001/"]
+#   One line per chapter: number and url. Directory and json file are derived from the number, a third field holds the
+#   directory only when it doesn't match.
+
+###
+### Functions
+###
+_upgrade_lock = threading.Lock() # One thread at a time upgrades original layout chapter files, see readChapterFile.
+
+def replaceFile(file_path, write):
+    # write(f) into a temp file of its own next to file_path, then rename it over file_path. --serve threads reading the file see
+    # the old one or the new one, and two threads writing it never share a temp file.
+    fd, part = tempfile.mkstemp(prefix="".join([os.path.basename(file_path), '.']), suffix='.part', dir=os.path.dirname(file_path) or '.')
+    try:
+        with os.fdopen(fd, 'w') as outfile:
+            write(outfile)
+        os.chmod(part, 0o644) # mkstemp makes it owner only, manifests were always plain files.
+        os.replace(part, file_path)
+    except BaseException:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        raise
+
+def pagePath(directory, page): # 'mangahere/abc/abc_c001', '001' -> 'mangahere/abc/abc_c001/001.jpg'
+    return os.path.join(directory, "".join([page, '.jpg']))
+
+def legacyPagePath(directory, page): # Where the original layout put pages: a '\\' in the file name on anything but Windows.
+    return "".join([directory, '\\', page, '.jpg'])
+
+### Chapters ###
+def compactChapter(data): # Chapter integrity dict -> what goes in the chapter file.
+    rows = []
+    srcs = [dic.get('src') for dic in data.get('pages_and_src')]
+    src_base = os.path.commonprefix([src for src in srcs if src]) if any(srcs) else ''
+    manifest = data.get('page_manifest') or [None] * len(srcs)
+    for dic, record in zip(data.get('pages_and_src'), manifest):
+        src = dic.get('src')
+        row = [dic.get('page'), src[len(src_base):] if src else None]
+        if (record):
+            row += [record.get('size'), record.get('mtime'), record.get('sha1')]
+        rows.append(row)
+    compact = {'format':         MANIFEST_FORMAT,
+               'chapter_url':    data.get('chapter_url'),
+               'chapter_number': data.get('chapter_number'),
+               'directory':      data.get('directory'),
+               'downloaded':     data.get('downloaded') == 'Downloaded',
+               'src_base':       src_base,
+               'pages':          rows}
+    if (data.get('manga_site')):
+        compact['manga_site'] = data.get('manga_site')
+    paths = data.get('image_files_paths')
+    if (paths != [pagePath(data.get('directory'), dic.get('page')) for dic in data.get('pages_and_src')]): # Never written by mangaget itself.
+        compact['paths'] = paths
+    if (data.get('failed_pages')):
+        compact['failed_pages'] = data.get('failed_pages')
+    if (data.get('processed')):
+        compact['processed'] = data.get('processed')
+    return compact
+
+def expandChapter(compact): # What the chapter file holds -> the chapter integrity dict the rest of mangaget works with.
+    directory = compact.get('directory')
+    src_base  = compact.get('src_base') or ''
+    rows      = compact.get('pages')
+    srcs      = ["".join([src_base, row[1]]) if row[1] is not None else None for row in rows]
+    data = {'downloaded':        'Downloaded' if compact.get('downloaded') else 'Not Downloaded.',
+            'chapter_number':    compact.get('chapter_number'),
+            'len':               len(rows),
+            'pages_and_src':     [{'page': row[0], 'src': src} for row, src in zip(rows, srcs)],
+            'pages_src':         srcs,
+            'image_files_paths': compact.get('paths') or [pagePath(directory, row[0]) for row in rows],
+            'chapter_url':       compact.get('chapter_url'),
+            'directory':         directory,
+            'base_directory':    os.path.dirname(directory),
+            'page_manifest':     [{'size': row[2], 'mtime': row[3], 'sha1': row[4]} if len(row) > 2 else None for row in rows],
+            'failed_pages':      compact.get('failed_pages') or [],
+            'manga_site':        compact.get('manga_site')}
+    if (compact.get('processed')):
+        data['processed'] = compact.get('processed')
+    return data
+
+def upgradeChapter(data):
+    # Original layout: paths are derived from now on. Pages saved under a 'dir\\001.jpg' file name (anything but Windows) are
+    # moved into the chapter directory where the derived path expects them.
+    directory = data.get('directory')
+    paths = []
+    for dic, old_path in zip(data.get('pages_and_src'), data.get('image_files_paths')):
+        path = pagePath(directory, dic.get('page'))
+        if (old_path != path and old_path == legacyPagePath(directory, dic.get('page'))):
+            if (os.path.isfile(old_path) and not os.path.isfile(path)):
+                os.makedirs(directory, exist_ok=True)
+                os.replace(old_path, path)
+                logging.info("".join([timestamp(), ' Moved ', old_path, ' to ', path]))
+            old_path = path
+        paths.append(old_path)
+    data['image_files_paths'] = paths
+    return data
+
+def readChapterFile(json_file): # Files in the original layout are rewritten in the compact one the first time they're read.
+    with open(json_file) as f:
+        data = json.load(f)
+    if (data.get('format')):
+        return expandChapter(data)
+    with _upgrade_lock: # Moving pages and rewriting the file is check-then-act, another thread may have done it while we waited.
+        with open(json_file) as f:
+            data = json.load(f)
+        if (data.get('format')):
+            return expandChapter(data)
+        data = upgradeChapter(data)
+        writeChapterFile(data, json_file)
+    return data
+
+def writeChapterFile(data, json_file): # Written aside and renamed into place, --serve reads chapter files while they are rewritten.
+    replaceFile(json_file, lambda outfile: json.dump(compactChapter(data), outfile, separators=(',', ':')))
+
+### Series ###
+def writeSeriesFile(data, file_path): # data: the master dict from createMasterChapterIntegrityFile. Renamed into place like chapter files.
+    site = getSite(data.get('root_directory'))
+
+    def write(outfile):
+        header = {key: data.get(key) for key in ('root_directory', 'base_directory', 'manga_name', 'search_url', 'file_path')}
+        outfile.write(json.dumps(dict(header, format=MANIFEST_FORMAT), separators=(',', ':')))
+        outfile.write('\n')
+        for number, url, directory in zip(data.get('chapter_numbers'), data.get('chapter_urls'), data.get('chapter_directories')):
+            row = [number, url]
+            if (directory != site.chapterDirectory(data.get('base_directory'), data.get('manga_name'), number)):
+                row.append(directory)
+            outfile.write(json.dumps(row, separators=(',', ':')))
+            outfile.write('\n')
+    replaceFile(file_path, write)
+
+def seriesHeader(file_path): # Series fields without its chapters. Only the first line is read.
+    with open(file_path) as f:
+        return json.loads(f.readline())
+
+def seriesChapters(file_path):
+    # (header, chapters) where chapters yields {'chapter_number', 'chapter_url', 'directory', 'json_file'} one line at a time.
+    f = open(file_path)
+    header = json.loads(f.readline())
+    if (not header.get('format')): # Original layout, the whole series is that one line.
+        f.close()
+        rows = zip(header.get('chapter_numbers'), header.get('chapter_urls'), header.get('chapter_directories'), header.get('chapter_json_files'))
+        return header, ({'chapter_number': number, 'chapter_url': url, 'directory': directory, 'json_file': json_file} for number, url, directory, json_file in rows)
+
+    def chapters():
+        site = getSite(header.get('root_directory'))
+        with f:
+            for line in f:
+                row = json.loads(line)
+                directory = row[2] if len(row) > 2 else site.chapterDirectory(header.get('base_directory'), header.get('manga_name'), row[0])
+                yield {'chapter_number': row[0], 'chapter_url': row[1], 'directory': directory, 'json_file': "".join([directory, '.json'])}
+    return header, chapters()
+
+def readSeries(file_path): # The whole series as the master dict, for code that edits the chapter list.
+    header, chapters = seriesChapters(file_path)
+    data = {key: value for key, value in header.items() if not key.startswith('chapter_') and key != 'format'}
+    data.update(chapter_urls=[], chapter_numbers=[], chapter_directories=[], chapter_json_files=[])
+    for chapter in chapters:
+        data['chapter_urls'].append(chapter['chapter_url'])
+        data['chapter_numbers'].append(chapter['chapter_number'])
+        data['chapter_directories'].append(chapter['directory'])
+        data['chapter_json_files'].append(chapter['json_file'])
+    return data
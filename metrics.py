@@ -0,0 +1,165 @@
+import json
+import time
+import bisect
+import threading
+
+from http_client import hostOf
+from manifest import replaceFile
+
+###
+### Config
+###
+PHASES          = ('search', 'setup', 'page_resolve', 'image_download')
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0) # Seconds, Prometheus style upper bounds.
+
+###
+### Classes
+###
+class latencyHistogram():
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot is +Inf.
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def cumulative(self):
+        running = 0
+        results = []
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            running += count
+            results.append((bound, running))
+        return results
+
+    def summary(self):
+        return {'count': self.count, 'sum': round(self.total, 6), 'buckets': {str(bound): count for bound, count in self.cumulative()}}
+
+
+class runMetrics():
+    # Thread-safe per-host, per-phase counters for one run. Wire bytes are what came off the socket (compressed body plus headers),
+    # decoded bytes are what we got after decompression, i.e. what the parsers saw or what landed on disk.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.wire_bytes = {}    # {(host, phase): int}
+        self.decoded_bytes = {} # {(host, phase): int}
+        self.requests = {}      # {(host, phase): int}
+        self.errors = {}        # {(host, phase, kind): int}
+        self.ttfb = {}          # {phase: latencyHistogram} time until response headers arrived.
+        self.duration = {}      # {phase: latencyHistogram} time until the body was read.
+
+    def observe(self, url, phase, wire_bytes, decoded_bytes, ttfb=None, duration=None):
+        key = (hostOf(url), phase)
+        with self.lock:
+            self.wire_bytes[key] = self.wire_bytes.get(key, 0) + wire_bytes
+            self.decoded_bytes[key] = self.decoded_bytes.get(key, 0) + decoded_bytes
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if (ttfb is not None):
+                self.ttfb.setdefault(phase, latencyHistogram()).observe(ttfb)
+            if (duration is not None):
+                self.duration.setdefault(phase, latencyHistogram()).observe(duration)
+
+    def error(self, url, phase, kind):
+        key = (hostOf(url), phase, kind)
+        with self.lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def totalWireBytes(self):
+        with self.lock:
+            return sum(self.wire_bytes.values())
+
+    def totalDecodedBytes(self):
+        with self.lock:
+            return sum(self.decoded_bytes.values())
+
+    ### Exports ###
+    def summary(self):
+        with self.lock:
+            elapsed = time.time() - self.started
+            hosts = {}
+            for (host, phase), count in self.requests.items():
+                entry = hosts.setdefault(host, {}).setdefault(phase, {})
+                entry['requests'] = count
+                entry['wire_bytes'] = self.wire_bytes.get((host, phase), 0)
+                entry['decoded_bytes'] = self.decoded_bytes.get((host, phase), 0)
+            for (host, phase, kind), count in self.errors.items():
+                hosts.setdefault(host, {}).setdefault(phase, {}).setdefault('errors', {})[kind] = count
+            return {'started': self.started,
+                    'elapsed_seconds': round(elapsed, 3),
+                    'wire_bytes': sum(self.wire_bytes.values()),
+                    'decoded_bytes': sum(self.decoded_bytes.values()),
+                    'requests': sum(self.requests.values()),
+                    'errors': sum(self.errors.values()),
+                    'wire_bytes_per_second': round(sum(self.wire_bytes.values()) / elapsed, 1) if elapsed > 0 else 0,
+                    'hosts': hosts,
+                    'ttfb_seconds': {phase: h.summary() for phase, h in self.ttfb.items()},
+                    'duration_seconds': {phase: h.summary() for phase, h in self.duration.items()}}
+
+    def prometheusText(self):
+        lines = []
+        with self.lock:
+            for name, helptext, values in (('mangaget_wire_bytes_total', 'Bytes received on the wire.', self.wire_bytes),
+                                           ('mangaget_decoded_bytes_total', 'Bytes after decompression.', self.decoded_bytes),
+                                           ('mangaget_requests_total', 'HTTP requests completed.', self.requests)):
+                lines.append("".join(['# HELP ', name, ' ', helptext]))
+                lines.append("".join(['# TYPE ', name, ' counter']))
+                for (host, phase), value in sorted(values.items()):
+                    lines.append("".join([name, '{host="', host, '",phase="', phase, '"} ', str(value)]))
+            lines.append('# HELP mangaget_errors_total Failed HTTP requests.')
+            lines.append('# TYPE mangaget_errors_total counter')
+            for (host, phase, kind), value in sorted(self.errors.items()):
+                lines.append("".join(['mangaget_errors_total{host="', host, '",phase="', phase, '",kind="', kind, '"} ', str(value)]))
+            for name, helptext, histograms in (('mangaget_ttfb_seconds', 'Time until response headers arrived.', self.ttfb),
+                                               ('mangaget_duration_seconds', 'Time until the response body was read.', self.duration)):
+                lines.append("".join(['# HELP ', name, ' ', helptext]))
+                lines.append("".join(['# TYPE ', name, ' histogram']))
+                for phase, histogram in sorted(histograms.items()):
+                    for bound, count in histogram.cumulative():
+                        lines.append("".join([name, '_bucket{phase="', phase, '",le="', str(bound), '"} ', str(count)]))
+                    lines.append("".join([name, '_sum{phase="', phase, '"} ', str(round(histogram.total, 6))]))
+                    lines.append("".join([name, '_count{phase="', phase, '"} ', str(histogram.count)]))
+        lines.append('# HELP mangaget_last_run_timestamp_seconds When this run started.')
+        lines.append('# TYPE mangaget_last_run_timestamp_seconds gauge')
+        lines.append("".join(['mangaget_last_run_timestamp_seconds ', str(int(self.started))]))
+        return "".join(['\n'.join(lines), '\n'])
+
+    def writeJson(self, path):
+        writeAtomically(path, json.dumps(self.summary(), indent=2, sort_keys=True))
+
+    def writePrometheus(self, path): # For node_exporter's textfile collector, which must never see a half written file.
+        writeAtomically(path, self.prometheusText())
+
+###
+### Functions
+###
+def writeAtomically(path, text): # Through a temp file of its own, two runs exporting to the same path never write into each other's.
+    replaceFile(path, lambda f: f.write(text))
+
+def headerBytes(response):
+    # Rough size of the status line and headers, requests doesn't keep the raw bytes around.
+    return 17 + sum(len(k) + len(v) + 4 for k, v in response.headers.items())
+
+def recordResponse(response, phase, decoded_bytes, started):
+    # Call once the body has been read (or abandoned). started is time.time() from before the request went out.
+    getMetrics().observe(response.url, phase, headerBytes(response) + response.raw.tell(), decoded_bytes,
+                         response.elapsed.total_seconds(), time.time() - started)
+    if (not response.ok):
+        getMetrics().error(response.url, phase, "".join(['http_', str(response.status_code)]))
+
+def recordError(url, phase, exc):
+    getMetrics().error(url, phase, type(exc).__name__)
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def getMetrics():
+    global _metrics
+    if (_metrics is None):
+        with _metrics_lock:
+            if (_metrics is None):
+                _metrics = runMetrics()
+    return _metrics
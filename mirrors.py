@@ -0,0 +1,212 @@
+import time
+import logging
+import threading
+import urllib.parse
+
+from helper import timestamp
+from http_client import getClient
+from metrics import recordResponse, recordError
+
+###
+### Config
+###
+SMOOTHING          = 0.3   # Weight of the newest observation in a host's moving latency and error scores.
+ERROR_WEIGHT       = 4.0   # A host erring on every request scores as 5x slower than its latency.
+DOWN_AFTER_ERRORS  = 2     # Errors in a row before a host is skipped outright.
+DOWN_SECONDS       = 30.0  # How long a host that went down is skipped before it is probed again.
+PROBE_INTERVAL     = 60.0  # Seconds between probes of a mirror group.
+PROBE_TIMEOUT      = 5.0
+
+###
+### Classes
+###
+class hostScore():
+    def __init__(self):
+        self.latency = None      # Moving average of seconds to response headers.
+        self.errors = 0.0        # Moving average of 1 for an error, 0 for a response.
+        self.in_a_row = 0        # Errors since the last good response.
+        self.down_until = 0.0
+        self.confirmed = False   # Served the group's sample with the same size as the host it came from.
+        self.requests = 0
+
+    def observe(self, latency=None, error=False):
+        self.requests += 1
+        self.errors = self.errors + SMOOTHING * ((1.0 if error else 0.0) - self.errors)
+        if (error):
+            self.in_a_row += 1
+            if (self.in_a_row >= DOWN_AFTER_ERRORS):
+                self.down_until = time.time() + DOWN_SECONDS
+            return
+        self.in_a_row = 0
+        self.down_until = 0.0
+        if (latency is not None):
+            self.latency = latency if self.latency is None else self.latency + SMOOTHING * (latency - self.latency)
+
+    def healthy(self):
+        return self.confirmed and self.latency is not None and self.down_until <= time.time()
+
+    def cost(self): # Lower is better.
+        return self.latency * (1.0 + ERROR_WEIGHT * self.errors)
+
+    def summary(self):
+        return {'latency': self.latency, 'errors': self.errors, 'confirmed': self.confirmed, 'down': self.down_until > time.time(), 'requests': self.requests}
+
+
+class mirrorGroup():
+    def __init__(self, name, hosts=()):
+        self.name = name
+        self.hosts = list(hosts)  # 'z.mhcdn.net', or host:port for the stand-ins.
+        self.sample = None        # A src seen on one of the hosts, probed on all of them.
+        self.probed = 0.0
+        self.probing = False
+
+
+class mirrorSet():
+    # Image hosts that serve the same files under the same paths, e.g. the sibling hosts of a site's CDN. Hosts join a group
+    # from --mirrors or, for a site adapter's mirror_domains, when a src on that domain is first seen. They are only used once a
+    # probe has fetched the group's sample src from them with the same Content-Length as its own host.
+    # Every image fetch and probe updates a moving latency and error score per host. rewrite() points a src at the group's
+    # cheapest healthy host, so after an error the next retry goes to another mirror.
+    def __init__(self, groups=(), domains=(), probe=True):
+        self.lock = threading.Lock()
+        self.groups = {}    # {group name: mirrorGroup}
+        self.group_of = {}  # {host: mirrorGroup}
+        self.scores = {}    # {host: hostScore}
+        self.domains = set(domains)
+        self.probe_enabled = probe
+        for i, hosts in enumerate(groups):
+            self.addGroup("".join(['mirrors', str(i + 1)]), hosts)
+
+    def addGroup(self, name, hosts):
+        with self.lock:
+            group = self.groups.get(name)
+            if (group is None):
+                group = self.groups[name] = mirrorGroup(name)
+            for host in hosts:
+                if (host not in self.group_of):
+                    group.hosts.append(host)
+                    self.group_of[host] = group
+                    self.scores[host] = hostScore()
+        return group
+
+    def addDomains(self, domains):
+        with self.lock:
+            self.domains.update(domains)
+
+    def learn(self, urls):
+        # Hosts of resolved srcs. A host on a mirror domain joins that domain's group, and each group keeps one src to probe with.
+        fresh = set()
+        for url in urls:
+            if (not url):
+                continue
+            host = netlocOf(url)
+            group = self.group_of.get(host)
+            if (group is None):
+                domain = host.split('.', 1)[1] if '.' in host else None
+                if (domain not in self.domains):
+                    continue
+                group = self.addGroup(domain, [host])
+                logging.info("".join([timestamp(), ' Mirror ', host, ' joins ', domain]))
+                fresh.add(group)
+                group.probed = 0.0
+            if (group.sample is None):
+                group.sample = url
+                fresh.add(group)
+        for group in fresh:
+            self.probeLater(group)
+
+    ### Scores ###
+    def observe(self, url, latency=None, error=False):
+        with self.lock:
+            score = self.scores.get(netlocOf(url))
+            if (score is not None):
+                score.observe(latency, error)
+
+    def rewrite(self, url): # url on the cheapest healthy mirror of its host, or url itself.
+        host = netlocOf(url)
+        group = self.group_of.get(host)
+        if (group is None):
+            return url
+        if (time.time() - group.probed > PROBE_INTERVAL):
+            self.probeLater(group)
+        with self.lock:
+            healthy = [candidate for candidate in group.hosts if self.scores[candidate].healthy()]
+            if (not healthy):
+                return url
+            best = min(healthy, key=lambda candidate: self.scores[candidate].cost())
+        return url if best == host else withNetloc(url, best)
+
+    ### Probes ###
+    def probeLater(self, group): # One probe per group at a time, on its own thread so downloads never wait for it.
+        with self.lock:
+            if (not self.probe_enabled or group.probing or group.sample is None or len(group.hosts) < 2):
+                return
+            group.probing = True
+        threading.Thread(target=self.probe, args=(group,), name="".join(['probe ', group.name]), daemon=True).start()
+
+    def probe(self, group):
+        # HEADs the sample on every host of the group. The sample's own host sets the expected size.
+        try:
+            sizes = {}
+            for host in list(group.hosts):
+                url = withNetloc(group.sample, host)
+                started = time.time()
+                try:
+                    response = getClient().head(url, timeout=PROBE_TIMEOUT)
+                    response.close()
+                    recordResponse(response, 'mirror_probe', 0, started)
+                except Exception as exc: # Connection refused, timeouts, anything: the host is just unhealthy.
+                    recordError(url, 'mirror_probe', exc)
+                    self.observe(url, error=True)
+                    continue
+                self.observe(url, response.elapsed.total_seconds(), not response.ok)
+                if (response.ok):
+                    sizes[host] = response.headers.get('Content-Length')
+            expected = sizes.get(netlocOf(group.sample))
+            with self.lock:
+                for host in group.hosts:
+                    score = self.scores[host]
+                    confirmed = host in sizes and (expected is None or sizes[host] == expected)
+                    if (confirmed != score.confirmed):
+                        logging.info("".join([timestamp(), ' Mirror ', host, ' (', group.name, ') ', 'confirmed' if confirmed else 'no longer matches']))
+                    score.confirmed = confirmed or (score.confirmed and host not in sizes) # An error says nothing about the files.
+        finally:
+            with self.lock:
+                group.probed = time.time()
+                group.probing = False
+
+    def stats(self):
+        with self.lock:
+            return {host: dict(self.scores[host].summary(), group=group.name) for host, group in self.group_of.items()}
+
+    def statsLines(self):
+        lines = []
+        for host, s in sorted(self.stats().items(), key=lambda item: (item[1]['group'], item[0])):
+            lines.append("".join(['Mirror ', host, ' (', s['group'], '): ', str(round(s['latency'] * 1000)) if s['latency'] is not None else '-', ' ms, ',
+                                  str(round(s['errors'] * 100)), '% errors, ', str(s['requests']), ' requests',
+                                  '' if s['confirmed'] else ', unconfirmed', ', down' if s['down'] else '']))
+        return lines
+
+###
+### Functions
+###
+def netlocOf(url): # 'z.mhcdn.net' or '127.0.0.1:8801'. Unlike http_client.hostOf this keeps the port.
+    return urllib.parse.urlsplit(url).netloc
+
+def withNetloc(url, netloc):
+    return urllib.parse.urlunsplit(urllib.parse.urlsplit(url)._replace(netloc=netloc))
+
+def parseMirrorGroups(values): # ('a.net,b.net', '127.0.0.1:8801,127.0.0.1:8803') -> [['a.net', 'b.net'], [...]]
+    return [[host.strip() for host in value.split(',') if host.strip()] for value in values]
+
+_mirrors = None
+_mirrors_lock = threading.Lock()
+
+def configureMirrors(groups=(), domains=(), probe=True):
+    global _mirrors
+    with _mirrors_lock:
+        _mirrors = mirrorSet(groups, domains, probe)
+    return _mirrors
+
+def getMirrors(): # None until configureMirrors, image srcs are then fetched as they are.
+    return _mirrors
@@ -0,0 +1,119 @@
+import threading
+import queue
+import time
+import logging
+
+from helper import timestamp
+
+###
+### Config
+###
+DEFAULT_QUEUE_SIZE = 4 # Chapters allowed to wait between two stages before the stage in front of it blocks.
+
+_DONE = object() # Sentinel telling a stage worker there is no more work.
+
+###
+### Classes
+###
+class pipelineStage():
+    def __init__(self, name, work, workers, queue_size):
+        self.name = name
+        self.work = work               # work(item) -> item to pass on, or None/False to drop it.
+        self.workers = max(1, workers)
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.max_depth = 0
+        self.done = 0
+        self.failed = 0
+        self.failures = []             # Chapter urls (or the items themselves) this stage dropped.
+
+    def put(self, item):
+        self.inbox.put(item) # Blocks when the stage is backed up, which pushes back on the stage in front of it.
+        with self.lock:
+            self.max_depth = max(self.max_depth, self.inbox.qsize())
+
+    def stats(self):
+        with self.lock:
+            return {'workers': self.workers, 'queued': self.inbox.qsize(), 'max_queued': self.max_depth, 'done': self.done, 'failed': self.failed, 'failures': list(self.failures)}
+
+
+class chapterPipeline():
+    # chapter list -> stage 1 -> stage 2 -> ... Each stage has its own worker threads and a bounded queue in front of it, so
+    # chapter N+1 can be resolving its page srcs while chapter N is downloading.
+    def __init__(self, stages, queue_size=DEFAULT_QUEUE_SIZE, report_interval=30):
+        self.stages = [pipelineStage(name, work, workers, queue_size) for name, work, workers in stages] # [('resolve', fn, 4), ...]
+        self.report_interval = report_interval
+
+    def worker(self, index):
+        stage = self.stages[index]
+        following = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = stage.inbox.get()
+            if (item is _DONE):
+                break
+            try:
+                result = stage.work(item)
+            except Exception as exc: # The chapter drops out of the run, say which one and why.
+                result = None
+                logging.warning("".join([timestamp(), ' ', stage.name, ' stage failed for ', itemName(item), ': ', repr(exc)]))
+            with stage.lock:
+                if (result):
+                    stage.done += 1
+                else:
+                    stage.failed += 1
+                    stage.failures.append(itemName(item))
+            if (result and following):
+                following.put(result)
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            for i in range(0, stage.workers):
+                thread = threading.Thread(target=self.worker, args=(index,), name="".join([stage.name, '-', str(i)]), daemon=True)
+                thread.start()
+                stage.threads.append(thread)
+
+    def run(self, items):
+        self.start()
+        feeder = threading.Thread(target=self.feed, args=(items,), daemon=True)
+        feeder.start()
+        last_report = time.time()
+        for stage in self.stages: # Drain stage by stage, a stage is finished once everything in front of it is.
+            for thread in stage.threads:
+                while thread.is_alive():
+                    thread.join(1)
+                    if (self.report_interval and time.time() - last_report >= self.report_interval):
+                        logging.info("".join([timestamp(), ' Pipeline: ', self.statsLine()]))
+                        last_report = time.time()
+            if (stage is not self.stages[-1]):
+                following = self.stages[self.stages.index(stage) + 1]
+                for i in range(0, following.workers):
+                    following.put(_DONE)
+        feeder.join()
+        return self.stats()
+
+    def feed(self, items):
+        first = self.stages[0]
+        for item in items:
+            first.put(item)
+        for i in range(0, first.workers):
+            first.put(_DONE)
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def statsLine(self):
+        parts = []
+        for stage in self.stages:
+            s = stage.stats()
+            parts.append("".join([stage.name, ' queued=', str(s['queued']), ' max=', str(s['max_queued']), ' done=', str(s['done']), ' failed=', str(s['failed'])]))
+        return ', '.join(parts)
+
+    def failureLines(self): # One line per chapter a stage dropped, for the end of the run.
+        return ["".join(['  ', stage.name, ' failed: ', name]) for stage in self.stages for name in stage.stats()['failures']]
+
+###
+### Functions
+###
+def itemName(item): # Chapter jobs and chapter data both carry their url.
+    return str(item.get('chapter_url')) if isinstance(item, dict) and item.get('chapter_url') else repr(item)
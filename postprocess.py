@@ -0,0 +1,116 @@
+import os
+import io
+import logging
+import threading
+import importlib.util
+import concurrent.futures
+
+from helper import timestamp
+
+###
+### Config
+###
+DEFAULT_QUEUE_SIZE = 16  # Pages handed to the pool and not finished yet. Past this the download thread waits.
+DEFAULT_QUALITY    = 80
+FORMATS            = {'webp': ('WEBP', '.webp'), 'jpeg': ('JPEG', '.jpg')} # --process_format: (Pillow format, extension)
+
+###
+### Classes
+###
+class imagePostProcessor():
+    # Pages are re-encoded in a process pool sized to the cores as they finish downloading, so the download threads only hand
+    # over a path (or the bytes, for pages that live in a .cbz) and go back to the network. submit() blocks once queue_size
+    # pages are waiting, which slows the downloads down to what the cores can convert instead of piling up work in memory.
+    # Output goes to <chapter directory>_<settings tag>/, so a page already converted with the same settings is skipped.
+    def __init__(self, settings, workers=None, queue_size=DEFAULT_QUEUE_SIZE):
+        self.settings = settings
+        self.tag = settingsTag(settings)
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers if workers else os.cpu_count())
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.lock = threading.Lock()
+        self.futures = {}  # {output path: future} not collected by sizes() yet.
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def submit(self, page_path, source=None):
+        # source: the page's bytes when it isn't a file on disk. Returns the future, or None when the output already exists.
+        output = processedPath(page_path, self.tag)
+        with self.lock:
+            if (output in self.futures):
+                return self.futures[output]
+        if (os.path.isfile(output)):
+            with self.lock:
+                self.skipped += 1
+            return None
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        self.slots.acquire()
+        future = self.pool.submit(processImage, source if source is not None else page_path, output, self.settings)
+        future.add_done_callback(lambda f: self.slots.release())
+        with self.lock:
+            self.futures[output] = future
+        return future
+
+    def sizes(self, page_paths):
+        # Waits for the given pages and returns the size of each one's output, None where it failed or was never submitted.
+        sizes = []
+        for page_path in page_paths:
+            output = processedPath(page_path, self.tag)
+            with self.lock:
+                future = self.futures.pop(output, None)
+            if (future is not None):
+                try:
+                    sizes.append(future.result())
+                    with self.lock:
+                        self.processed += 1
+                    continue
+                except Exception as exc:
+                    logging.debug("".join([timestamp(), ' Could not process ', page_path, ': ', repr(exc)]))
+                    with self.lock:
+                        self.failed += 1
+            sizes.append(os.path.getsize(output) if os.path.isfile(output) else None)
+        return sizes
+
+    def statsLine(self):
+        with self.lock:
+            return "".join(['Processed pages (', self.tag, '): ', str(self.processed), ' converted, ', str(self.skipped), ' already done, ', str(self.failed), ' failed'])
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+###
+### Functions
+###
+def pillowAvailable(): # Pillow is optional (pip install Pillow) and only imported by the pool's workers.
+    return importlib.util.find_spec('PIL') is not None
+
+def processSettings(image_format, width=0, gray=False, quality=DEFAULT_QUALITY):
+    return {'format': image_format, 'width': width, 'gray': gray, 'quality': quality}
+
+def settingsTag(settings): # {'format': 'webp', 'width': 800, 'gray': False, 'quality': 80} -> 'webp_w800_q80'
+    parts = [settings.get('format'), "".join(['w', str(settings.get('width'))]) if settings.get('width') else 'full']
+    if (settings.get('gray')):
+        parts.append('gray')
+    parts.append("".join(['q', str(settings.get('quality'))]))
+    return '_'.join(parts)
+
+def processedPath(page_path, tag):
+    # 'mangahere/tokyo_ghoul/tokyo_ghoul_c001\\001.jpg' -> 'mangahere/tokyo_ghoul/tokyo_ghoul_c001_webp_w800_q80/001.webp'
+    directory, name = page_path.replace('\\', '/').rsplit('/', 1)
+    return os.path.join("".join([directory, '_', tag]), "".join([os.path.splitext(name)[0], FORMATS[tag.split('_')[0]][1]]))
+
+def processImage(source, output, settings): # Module level so it can be pickled into the process pool. Returns the output's size.
+    from PIL import Image
+    image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    image.load()
+    if (settings.get('gray')):
+        image = image.convert('L')
+    elif (image.mode not in ('RGB', 'L')):
+        image = image.convert('RGB')
+    width = settings.get('width')
+    if (width and image.width > width): # Only ever scaled down.
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+    part_file = "".join([output, '.part'])
+    image.save(part_file, format=FORMATS[settings.get('format')][0], quality=settings.get('quality'))
+    os.replace(part_file, output)
+    return os.path.getsize(output)
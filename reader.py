@@ -0,0 +1,286 @@
+import os
+import glob
+import html
+import time
+import logging
+import zipfile
+import threading
+import http.server
+import urllib.parse
+
+from helper import timestamp
+from archive import archivePath, memberName
+from manifest import seriesHeader, seriesChapters
+
+###
+### Config
+###
+READER_PORT       = 8642
+PREFETCH_CHAPTERS = 2     # Chapters fetched ahead of the one being read.
+FETCH_WORKERS     = 2     # Chapters fetched at once, the one being read and the next. The controller still decides requests in flight per host.
+PAGE_WAIT         = 60.0  # Seconds a page request waits for its download before giving up.
+POLL_INTERVAL     = 0.05  # Seconds between looks at the disk while a page request waits.
+
+# Pages: /<site>/<manga_name>/<chapter>/<page>, chapter and page counted from 1 in reading order. Everything else is html.
+READER_STYLE = 'body{background:#111;color:#ddd;font-family:sans-serif;margin:0 auto;max-width:1000px}a{color:#8af}img{display:block;width:100%;margin:0 0 4px}li.missing{color:#777}'
+
+###
+### Classes
+###
+class prefetchQueue():
+    # Chapters to fetch, front first. focus() puts the chapter being read at the front, the next few behind it, and drops
+    # prefetches the reader has moved away from. A chapter is never fetched twice at once, and once fetched it is only
+    # fetched again when one of its pages is asked for and still missing (a failed page, a deleted file).
+    def __init__(self, fetch, workers=FETCH_WORKERS, ahead=PREFETCH_CHAPTERS):
+        self.fetch = fetch       # fetch(job, first_page): resolve the chapter if needed, download its missing pages from first_page on.
+        self.workers = max(1, workers)
+        self.ahead = ahead
+        self.lock = threading.Condition()
+        self.pending = []        # [(job, first_page)] front first. job: a chapterJobs dict.
+        self.running = set()     # json files being fetched.
+        self.fetched = set()     # json files fetched since the server started.
+        self.threads = []
+        self.stopping = False
+
+    def start(self):
+        for i in range(0, self.workers):
+            thread = threading.Thread(target=self.work, name="".join(['prefetch-', str(i)]), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self): # Chapters being fetched are finished, pending ones are dropped.
+        with self.lock:
+            self.stopping = True
+            self.pending = []
+            self.lock.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def focus(self, chapters, index, first_page=None):
+        # chapters: the series' jobs in reading order, index: the chapter being read. first_page: a page that was asked for,
+        # which also brings a fetched chapter back.
+        window = [(chapters[index], first_page or 0)] + [(job, 0) for job in chapters[index + 1:index + 1 + self.ahead]]
+        with self.lock:
+            self.pending = [(job, first) for i, (job, first) in enumerate(window)
+                            if job['json_file'] not in self.running and (job['json_file'] not in self.fetched or (i == 0 and first_page is not None))]
+            self.lock.notify_all()
+
+    def queued(self, json_file): # Caller holds the lock.
+        return json_file in self.running or any(job['json_file'] == json_file for job, first in self.pending)
+
+    def waitFor(self, ready, json_file, timeout=PAGE_WAIT):
+        # True once ready(). False when json_file's fetch ends without it, or after timeout.
+        deadline = time.time() + timeout
+        while not ready():
+            with self.lock:
+                if (not self.queued(json_file)):
+                    return ready()
+                self.lock.wait(POLL_INTERVAL)
+            if (time.time() > deadline):
+                return False
+        return True
+
+    def work(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.stopping:
+                    self.lock.wait()
+                if (self.stopping):
+                    return
+                job, first_page = self.pending.pop(0)
+                self.running.add(job['json_file'])
+            try:
+                self.fetch(job, first_page)
+            except Exception as exc: # One bad chapter mustn't take the worker down with it.
+                logging.info("".join([timestamp(), ' Prefetch of ', job['directory'], ' failed: ', repr(exc)]))
+            finally:
+                with self.lock:
+                    self.running.discard(job['json_file'])
+                    self.fetched.add(job['json_file'])
+                    self.lock.notify_all()
+
+    def stats(self):
+        with self.lock:
+            return {'pending': len(self.pending), 'running': len(self.running), 'fetched': len(self.fetched)}
+
+
+class readerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'mangaget'
+
+    def do_GET(self):
+        parts = [urllib.parse.unquote(part) for part in urllib.parse.urlsplit(self.path).path.split('/') if part]
+        try:
+            if (not parts):
+                self.sendHtml(self.server.indexPage())
+            elif (len(parts) == 2):
+                self.sendHtml(self.server.seriesPage(parts[0], parts[1]))
+            elif (len(parts) == 3 and parts[2].isdigit()):
+                self.sendHtml(self.server.chapterPage(parts[0], parts[1], int(parts[2])))
+            elif (len(parts) == 4 and parts[2].isdigit() and parts[3].isdigit()):
+                self.sendPage(parts[0], parts[1], int(parts[2]), int(parts[3]))
+            else:
+                self.sendError(404, 'No such page')
+        except (LookupError, OSError, ValueError): # Unknown series or chapter, or files moved under us.
+            self.sendError(404, 'No such series or chapter')
+
+    def sendPage(self, root_directory, manga_name, chapter, page):
+        status, body = self.server.page(root_directory, manga_name, chapter, page)
+        if (body is None):
+            self.sendError(status, 'Page could not be downloaded' if status == 502 else 'Page is still downloading')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'max-age=3600')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def sendHtml(self, text, status=200):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def sendError(self, status, message):
+        self.sendHtml(readerHtml(str(status), "".join(['<p>', html.escape(message), '</p><p><a href="/">Library</a></p>'])), status)
+
+    def log_message(self, format, *args): # Requests go to the log at debug level, not over the progress line.
+        logging.debug("".join([timestamp(), ' Reader: ', format % args]))
+
+
+class readerServer(http.server.ThreadingHTTPServer):
+    # Serves the library on disk to a browser: series, chapters, and a chapter's pages one under another. Opening a chapter
+    # focuses the prefetch queue on it, a page that isn't on disk yet waits for its chapter to fetch it (its own pages first)
+    # instead of for the rest of the series.
+    daemon_threads = True
+
+    def __init__(self, address, root_directories, read, fetch, workers=FETCH_WORKERS, ahead=PREFETCH_CHAPTERS):
+        http.server.ThreadingHTTPServer.__init__(self, address, readerHandler)
+        self.root_directories = list(root_directories)
+        self.read = read       # read(json_file): chapter integrity data, None while the chapter isn't resolved.
+        self.queue = prefetchQueue(fetch, workers, ahead)
+
+    def handle_error(self, request, client_address): # Browsers drop image requests when the reader scrolls or leaves.
+        logging.debug("".join([timestamp(), ' Reader: connection from ', str(client_address[0]), ' dropped']))
+
+    def start(self):
+        self.queue.start()
+        threading.Thread(target=self.serve_forever, name='reader', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.queue.stop()
+        self.server_close()
+
+    ### Library ###
+    def seriesFile(self, root_directory, manga_name):
+        if (root_directory not in self.root_directories or os.sep in manga_name or '/' in manga_name):
+            raise LookupError(manga_name)
+        file_path = os.path.join(root_directory, "".join([manga_name, '_chapters.json']))
+        if (not os.path.isfile(file_path)):
+            raise LookupError(manga_name)
+        return file_path
+
+    def chapterJobs(self, root_directory, manga_name): # Every chapter of the series in reading order, what fetch needs for each.
+        header, chapters = seriesChapters(self.seriesFile(root_directory, manga_name))
+        return [dict(chapter, base_directory=header.get('base_directory'), manga_site=header.get('root_directory')) for chapter in chapters]
+
+    def page(self, root_directory, manga_name, chapter, page): # (status, bytes or None) for one page, fetched first if it isn't on disk.
+        jobs = self.chapterJobs(root_directory, manga_name)
+        if (chapter < 1 or chapter > len(jobs) or page < 1):
+            raise LookupError(chapter)
+        job = jobs[chapter - 1]
+        data = self.read(job['json_file'])
+        if (data is None or pageSource(data, page - 1, busy=True) is None):
+            self.queue.focus(jobs, chapter - 1, page - 1)
+            if (not self.queue.waitFor(lambda: self.pageReady(job['json_file'], page - 1), job['json_file'])):
+                with self.queue.lock:
+                    return (504 if self.queue.queued(job['json_file']) else 502), None
+            data = self.read(job['json_file'])
+        if (page > len(data.get('image_files_paths'))):
+            raise LookupError(page)
+        with self.queue.lock:
+            busy = self.queue.queued(job['json_file'])
+        return 200, readPage(pageSource(data, page - 1, busy))
+
+    def pageReady(self, json_file, i):
+        data = self.read(json_file)
+        return data is not None and (i >= len(data.get('image_files_paths')) or pageSource(data, i, busy=True) is not None)
+
+    ### Html ###
+    def indexPage(self):
+        items = []
+        for root_directory in self.root_directories:
+            for file_path in sorted(glob.glob(os.path.join(root_directory, '*_chapters.json'))):
+                manga_name = seriesHeader(file_path).get('manga_name')
+                items.append("".join(['<li><a href="/', urlPart(root_directory), '/', urlPart(manga_name), '/">', html.escape(manga_name), '</a> ', html.escape(root_directory), '</li>']))
+        return readerHtml('mangaget', "".join(['<h1>Library</h1><ul>', ''.join(items) if items else '<li>Nothing downloaded yet.</li>', '</ul>']))
+
+    def seriesPage(self, root_directory, manga_name):
+        items = []
+        for i, job in enumerate(self.chapterJobs(root_directory, manga_name)):
+            data = self.read(job['json_file'])
+            state = 'downloaded' if data and data.get('downloaded') == 'Downloaded' and not data.get('failed_pages') else 'missing'
+            items.append("".join(['<li class="', state, '"><a href="', str(i + 1), '/">', html.escape(job['chapter_number']), '</a></li>']))
+        return readerHtml(manga_name, "".join(['<p><a href="/">Library</a></p><h1>', html.escape(manga_name), '</h1><ol>', ''.join(items), '</ol>']))
+
+    def chapterPage(self, root_directory, manga_name, chapter):
+        jobs = self.chapterJobs(root_directory, manga_name)
+        if (chapter < 1 or chapter > len(jobs)):
+            raise LookupError(chapter)
+        job = jobs[chapter - 1]
+        self.queue.focus(jobs, chapter - 1)
+        if (not self.queue.waitFor(lambda: self.read(job['json_file']) is not None, job['json_file'])): # Page count comes from resolving it.
+            return readerHtml(manga_name, "".join(['<p>', html.escape(job['chapter_number']), ' could not be resolved. <a href="">Try again</a></p>']))
+        pages = len(self.read(job['json_file']).get('image_files_paths'))
+        links = "".join(['<p><a href="../">', html.escape(manga_name), '</a>',
+                         "".join([' | <a href="../', str(chapter - 1), '/">Previous</a>']) if chapter > 1 else '',
+                         "".join([' | <a href="../', str(chapter + 1), '/">Next</a>']) if chapter < len(jobs) else '', '</p>'])
+        images = ''.join(["".join(['<img src="', str(page), '" alt="', str(page), '">']) for page in range(1, pages + 1)])
+        return readerHtml("".join([manga_name, ' ', job['chapter_number']]), "".join([links, images, links]))
+
+###
+### Functions
+###
+def pageSource(data, i, busy=False):
+    # Where page i is: ('file', path) or ('zip', archive). None when it isn't there yet. A .part archive is only read once
+    # nothing is writing to it.
+    path = data.get('image_files_paths')[i]
+    if (os.path.isfile(path)):
+        return ('file', path)
+    archive = archivePath(data.get('directory'))
+    for candidate in ((archive,) if busy else (archive, "".join([archive, '.part']))):
+        try:
+            with zipfile.ZipFile(candidate) as cbz:
+                cbz.getinfo(memberName(path))
+            return ('zip', candidate, memberName(path))
+        except (OSError, KeyError, zipfile.BadZipFile):
+            pass
+    return None
+
+def readPage(source):
+    if (source is None):
+        return None
+    if (source[0] == 'file'):
+        with open(source[1], 'rb') as f:
+            return f.read()
+    with zipfile.ZipFile(source[1]) as cbz:
+        return cbz.read(source[2])
+
+def urlPart(string):
+    return urllib.parse.quote(string, safe='')
+
+def readerHtml(title, body):
+    return "".join(['<!DOCTYPE html><html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width">',
+                    '<title>', html.escape(title), '</title><style>', READER_STYLE, '</style></head><body>', body, '</body></html>'])
+
+def startReader(root_directories, read, fetch, port=READER_PORT, host='127.0.0.1', workers=FETCH_WORKERS, ahead=PREFETCH_CHAPTERS):
+    # Returns (server, 'http://127.0.0.1:port/'). Pages are served and fetched on background threads until server.stop().
+    server = readerServer((host, port), root_directories, read, fetch, workers, ahead).start()
+    return server, "".join(['http://', host, ':', str(server.server_address[1]), '/'])
@@ -0,0 +1,180 @@
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+from helper import sizeMegs
+
+###
+### Config
+###
+LOG_MAX_BYTES     = 10 * 1000000 # mangaget.py.log rolls over to .1, .2 .. past this.
+LOG_BACKUPS       = 3
+PROGRESS_INTERVAL = 1.0          # Seconds between progress refreshes.
+PROGRESS_CHAPTERS = 3            # Chapters in flight shown next to the run totals.
+
+###
+### Classes
+###
+class progressDisplay():
+    # Pages, bytes, rate and ETA for the run and for each chapter in flight, redrawn every interval on one line by a background
+    # thread. Workers only bump counters under a lock, they never touch the terminal. On a terminal the line is redrawn in place,
+    # piped output gets a plain line per interval instead.
+    def __init__(self, interval=PROGRESS_INTERVAL, stream=None):
+        self.interval = interval
+        self.stream = stream if stream else sys.stdout
+        self.tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.lock = threading.Lock()
+        self.chapters = {}  # {directory: [pages done, pages expected, bytes]} for chapters in flight.
+        self.owners = {}    # {page path: directory} so a finished page finds its chapter.
+        self.pages = 0
+        self.expected = 0
+        self.bytes = 0
+        self.failed = 0
+        self.started = time.time()
+        self.line = ''      # What's on screen now, so a message can clear it first.
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        if (self.thread is None):
+            self.thread = threading.Thread(target=self.run, name='progress', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        if (self.thread is not None):
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+            if (self.pages or self.failed): # Nothing to say after a run that didn't download, e.g. --verify_library --dry_run.
+                self.draw(self.summary(), final=True)
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            with self.lock:
+                busy = bool(self.chapters)
+            if (busy):
+                self.draw(self.statusLine())
+            else:
+                with self.lock: # Nothing downloading, don't leave a stale line under the next prompt or summary.
+                    self.clear()
+
+    ### Counters, called from worker threads ###
+    def startChapter(self, directory, page_paths):
+        with self.lock:
+            self.chapters[directory] = [0, len(page_paths), 0]
+            self.owners.update((path, directory) for path in page_paths)
+            self.expected += len(page_paths)
+
+    def page(self, page_path, size):
+        with self.lock:
+            self.pages += 1
+            self.bytes += size
+            chapter = self.chapters.get(self.owners.pop(page_path, None))
+            if (chapter is not None):
+                chapter[0] += 1
+                chapter[2] += size
+
+    def pageFailed(self, page_path):
+        with self.lock:
+            self.failed += 1
+
+    def endChapter(self, directory):
+        with self.lock:
+            chapter = self.chapters.pop(directory, None)
+            if (chapter is not None):
+                self.expected -= chapter[1] - chapter[0] # Pages that didn't come are no longer expected.
+            for path in [path for path, owner in self.owners.items() if owner == directory]:
+                del self.owners[path]
+            if (not self.chapters):
+                self.clear()
+
+    ### Output ###
+    def write(self, string): # A message between refreshes. Clears the progress line so the two don't mix.
+        with self.lock:
+            self.clear()
+            self.stream.write("".join([string, '\n']))
+            self.stream.flush()
+
+    def clear(self): # Caller holds the lock.
+        if (self.tty and self.line):
+            self.stream.write("".join(['\r', ' ' * len(self.line), '\r']))
+            self.stream.flush()
+            self.line = ''
+
+    def draw(self, line, final=False):
+        with self.lock:
+            if (self.tty):
+                self.stream.write("".join(['\r', line.ljust(len(self.line)), '\n' if final else '']))
+                self.line = '' if final else line
+            else:
+                self.stream.write("".join([line, '\n']))
+            self.stream.flush()
+
+    def statusLine(self):
+        with self.lock:
+            elapsed = max(time.time() - self.started, 0.001)
+            rate = self.pages / elapsed
+            remaining = self.expected - self.pages
+            eta = formatSeconds(remaining / rate) if rate > 0 and remaining > 0 else '-'
+            parts = ["".join([str(self.pages), '/', str(self.expected), ' pages ', str(sizeMegs(self.bytes)), 'MB ',
+                              str(round(self.bytes / elapsed / 1000000, 2)), 'MB/s ETA ', eta])]
+            if (self.failed):
+                parts.append("".join([str(self.failed), ' failed']))
+            for directory, (done, pages, size) in list(self.chapters.items())[:PROGRESS_CHAPTERS]:
+                parts.append("".join([directory.replace('\\', '/').rsplit('/', 1)[-1], ' ', str(done), '/', str(pages)]))
+            if (len(self.chapters) > PROGRESS_CHAPTERS):
+                parts.append("".join(['+', str(len(self.chapters) - PROGRESS_CHAPTERS), ' more']))
+        return ' | '.join(parts)
+
+    def summary(self):
+        with self.lock:
+            elapsed = max(time.time() - self.started, 0.001)
+            return "".join(['Downloaded ', str(self.pages), ' pages, ', str(sizeMegs(self.bytes)), 'MB in ', formatSeconds(elapsed), ' (',
+                            str(round(self.pages / elapsed, 1)), ' pages/s, ', str(round(self.bytes / elapsed / 1000000, 2)), 'MB/s)',
+                            "".join([', ', str(self.failed), ' failed']) if self.failed else ''])
+
+###
+### Functions
+###
+def formatSeconds(seconds): # 75 -> '1m15s'
+    seconds = int(seconds)
+    if (seconds >= 3600):
+        return "".join([str(seconds // 3600), 'h', str(seconds % 3600 // 60).zfill(2), 'm'])
+    if (seconds >= 60):
+        return "".join([str(seconds // 60), 'm', str(seconds % 60).zfill(2), 's'])
+    return "".join([str(seconds), 's'])
+
+_listener = None
+
+def startLogging(path, level=logging.INFO, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+    # Worker threads only put records on a queue, one listener thread formats them and writes the rotating log file.
+    global _listener
+    if (_listener is not None):
+        return _listener
+    records = queue.SimpleQueue()
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    logging.getLogger("requests").setLevel(logging.WARNING) #Disable logging for requests by setting it to WARNING which we won't use.
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+    _listener = logging.handlers.QueueListener(records, file_handler)
+    _listener.start()
+    atexit.register(stopLogging) # exit() is called from a few places, the queue still gets written out.
+    return _listener
+
+def stopLogging():
+    global _listener
+    if (_listener is not None):
+        _listener.stop()
+        _listener = None
+
+_progress = progressDisplay()
+
+def getProgress():
+    return _progress
@@ -0,0 +1,91 @@
+import time
+import random
+import logging
+
+import requests
+
+from helper import timestamp
+
+###
+### Config
+###
+# (tries in total, first wait in seconds doubled on every retry before jitter, longest single wait) per kind of failure.
+RETRY_POLICIES = {'throttled':  (5, 2.0, 60.0),  # 429/503, the server asked us to back off.
+                  'server':     (4, 1.0, 30.0),  # Other 5xx.
+                  'connection': (4, 0.5, 20.0),  # Refused, reset, timed out.
+                  'incomplete': (3, 0.5, 10.0),  # Body shorter than promised. The .part resumes from where it stopped.
+                  'parse':      (2, 1.0, 5.0),   # 200 without an image src, usually a half served page.
+                  'missing':    (1, 0.0, 0.0),   # 404/410, asking again won't help.
+                  'client':     (1, 0.0, 0.0)}   # Other 4xx and bad urls.
+
+###
+### Classes
+###
+class fetchError(requests.exceptions.RequestException):
+    # A response that came back but isn't usable: a bad status, a short body, a page without an image src.
+    # Subclasses RequestException so the existing except clauses around requests treat it like any other failed request.
+    def __init__(self, kind, url=None, status=None, retry_after=None):
+        requests.exceptions.RequestException.__init__(self, "".join([kind, ' ', str(status) if status else '', ' ', str(url or '')]).strip())
+        self.kind = kind
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after # Seconds from a Retry-After header, if the server sent one.
+
+###
+### Functions
+###
+def kindOfStatus(status):
+    if (status in (429, 503)):
+        return 'throttled'
+    if (status in (404, 410)):
+        return 'missing'
+    if (status >= 500):
+        return 'server'
+    return 'client'
+
+def classify(exc):
+    if (isinstance(exc, fetchError)):
+        return exc.kind
+    if (isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError))):
+        return 'connection'
+    return 'client'
+
+def retryAfter(response): # Retry-After in seconds, only the delta form. None when absent or a date.
+    value = response.headers.get('Retry-After')
+    return float(value) if value and value.isdigit() else None
+
+def raiseForResponse(response): # fetchError for anything but 2xx.
+    if (not response.ok):
+        raise fetchError(kindOfStatus(response.status_code), response.url, response.status_code, retryAfter(response))
+
+def backoffDelay(policy, attempt, retry_after=None):
+    # Full jitter: anywhere between 0 and the exponential step, so workers that failed together don't come back together.
+    attempts, base, cap = policy
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if (retry_after is not None):
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+def retryCall(fn, *args, policies=RETRY_POLICIES, sleep=time.sleep):
+    # fn(*args), retried per the policy of whatever it raised. The last exception is re-raised with .kind and .attempts set.
+    attempt = 0
+    while True:
+        try:
+            return fn(*args)
+        except requests.exceptions.RequestException as exc:
+            kind = classify(exc)
+            policy = policies.get(kind, policies['client'])
+            attempt += 1
+            if (attempt >= policy[0]):
+                exc.kind = kind
+                exc.attempts = attempt
+                raise
+            delay = backoffDelay(policy, attempt - 1, getattr(exc, 'retry_after', None))
+            logging.debug("".join([timestamp(), ' Retrying (', kind, ', attempt ', str(attempt + 1), ' of ', str(policy[0]), ') in ',
+                                   str(round(delay, 2)), 's: ', str(exc)]))
+            sleep(delay)
+
+def failureRecord(exc): # What goes into a dead letter entry.
+    return {'error': getattr(exc, 'kind', classify(exc)) if not getattr(exc, 'status', None) else "".join(['http_', str(exc.status)]),
+            'attempts': getattr(exc, 'attempts', 1),
+            'time': timestamp()}
@@ -1,11 +1,13 @@
 import sys
 from cx_Freeze import setup, Executable
 
+from sites import SITE_ADAPTERS
+
 # Dependencies are automatically detected, but it might need fine tuning.
 #build_exe_options = {"packages": ["os"], "excludes": ["tkinter"]}
 
-includefiles = ['mangabee_parsers.py', 'mangahere_parsers.py', 'helper.py'] # include any files here that you wish
-includes = []
+includefiles = ['mangabee_parsers.py', 'mangahere_parsers.py', 'helper.py', 'http_client.py', 'async_download.py', 'pipeline.py', 'verification.py', 'catalog.py', 'metrics.py', 'http_cache.py', 'concurrency.py', 'retry.py', 'archive.py', 'postprocess.py', 'blobstore.py', 'sites.py', 'reporting.py', 'manifest.py', 'mirrors.py', 'reader.py', 'diskwrite.py'] # include any files here that you wish
+includes = [module for module, class_name in SITE_ADAPTERS.values()] # Site adapters are imported by name at runtime, cx_Freeze can't see them.
 excludes = []
 packages = []
 
@@ -26,7 +28,7 @@ exe = Executable(
 setup(  name = "mangaget",
         version = "1.0.0",
         description = "Downloads manga from mangahere and mangabee",
-        options = {"build_exe": {"excludes":excludes,"packages":packages,
+        options = {"build_exe": {"includes":includes,"excludes":excludes,"packages":packages,
             "include_files":includefiles}},
         executables = [exe]
 )
@@ -0,0 +1,83 @@
+import importlib
+import threading
+
+###
+### Config
+###
+# site name: (module, adapter class). A module is only imported the first time its site is used, so --help and a run against
+# one site don't pay for the others. Adding a site is a module with a siteAdapter subclass and a line here (or registerSite).
+SITE_ADAPTERS = {'mangahere': ('mangahere_parsers', 'mangahereSite'),
+                 'mangabee':  ('mangabee_parsers', 'mangabeeSite')}
+
+###
+### Classes
+###
+class siteAdapter():
+    # Everything mangaget needs to know about one site: its urls, how to read its search, chapter list and chapter pages, and how
+    # chapters are named on disk. Adapters never make requests. mangaget fetches (retries, cache, metrics) and hands them the html.
+    name        = None
+    url         = None   # Site root searches start from. benchmark.py points it at bench_server.py.
+    predictable = False  # Image srcs follow a pattern predictPagesAndSrc can learn from two pages.
+    mirror_domains = ()  # CDN domains whose hosts serve the same images under the same paths, see mirrors.py.
+
+    def searchUrl(self, manga_name):
+        raise NotImplementedError
+
+    def searchResults(self, html): # ['http://www.mangahere.co/manga/no_game_no_life/', ...]
+        raise NotImplementedError
+
+    def seriesSlug(self, manga_name): # The last part of the series url a search term names, lowercase, for --batch pick=exact.
+        raise NotImplementedError
+
+    def chapterListUrl(self, series_url): # Page listing every chapter of a series.
+        return series_url
+
+    def chapterUrls(self, html, series_url):
+        raise NotImplementedError
+
+    def mangaName(self, first_chapter_url): # Name of the series directory, e.g. 'tokyo_ghoul'.
+        raise NotImplementedError
+
+    def chapterNumber(self, chapter_url):
+        raise NotImplementedError
+
+    def chapterDirectory(self, base_directory, manga_name, chapter_number):
+        raise NotImplementedError
+
+    def chapterLayout(self, chapter_url, base_directory, manga_name): # (chapter_number, chapter_directory) for one chapter url.
+        chapter_number = self.chapterNumber(chapter_url)
+        return chapter_number, self.chapterDirectory(base_directory, manga_name, chapter_number)
+
+    def sortChapters(self, chapter_numbers, chapter_directories):
+        return sorted(chapter_numbers), sorted(chapter_directories)
+
+    def pageList(self, html, chapter_url): # (page_urls, page_numbers) from a chapter's first page.
+        raise NotImplementedError
+
+    def srcParser(self): # A fresh HTMLParser with a .src for streamImageSrc. One per page, threads never share one.
+        raise NotImplementedError
+
+###
+### Functions
+###
+_sites = {}
+_sites_lock = threading.Lock()
+
+def siteNames():
+    return list(SITE_ADAPTERS)
+
+def loadedSites(): # Adapters imported so far.
+    return list(_sites.values())
+
+def registerSite(name, module, class_name):
+    SITE_ADAPTERS[name] = (module, class_name)
+
+def getSite(name): # The site's adapter, imported and created on first use. KeyError for a site nobody registered.
+    site = _sites.get(name)
+    if (site is None):
+        with _sites_lock:
+            site = _sites.get(name)
+            if (site is None):
+                module, class_name = SITE_ADAPTERS[name]
+                site = _sites[name] = getattr(importlib.import_module(module), class_name)()
+    return site
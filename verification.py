@@ -0,0 +1,139 @@
+import os
+import hashlib
+import threading
+import concurrent.futures
+
+###
+### Config
+###
+HASH_ALGORITHM = 'sha1'
+HASH_BLOCK     = 1024 * 1024
+
+###
+### Functions
+###
+def hashFile(path): # Module level so it can be pickled into the process pool.
+    return fileDigest(path).hexdigest()
+
+
+def fileDigest(path): # The hash object after path's bytes, e.g. a resumed .part that the rest of the page is appended to.
+    digest = hashlib.new(HASH_ALGORITHM)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest
+
+
+def pageRecord(path, sha1=None):
+    # {'size': 123456, 'mtime': 1408950000.0, 'sha1': 'a9993e36...'} or None when the page isn't on disk.
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': sha1 if sha1 else hashFile(path)}
+
+
+def buildManifest(paths):
+    # One record per page, in the same order as image_files_paths.
+    return [pageRecord(path) for path in paths]
+
+
+def verifyPagesFast(paths, manifest, stats=None):
+    # Trusts a page when its size and mtime still match the manifest. Only pages that changed on disk are re-hashed.
+    # stats: {path: (size, mtime)} from scanTree, used instead of a stat per page. Returns (indices of bad pages, refreshed manifest).
+    bad = []
+    manifest = list(manifest) if manifest else []
+    manifest += [None] * (len(paths) - len(manifest))
+    for i, path in enumerate(paths):
+        stat = statPage(path, stats)
+        if (stat is None):
+            bad.append(i)                     # Missing page.
+            manifest[i] = None
+            continue
+        size, mtime = stat
+        record = manifest[i]
+        if (size == 0):
+            bad.append(i)
+            manifest[i] = None
+        elif (record is None):
+            manifest[i] = pageRecord(path)    # Page predates the manifest, adopt it.
+        elif (record.get('size') == size and record.get('mtime') == mtime):
+            pass
+        elif (record.get('size') != size or hashFile(path) != record.get('sha1')):
+            bad.append(i)                     # Truncated or rewritten.
+            manifest[i] = None
+        else:
+            record['mtime'] = mtime           # Touched but the content is the same.
+    return bad, manifest
+
+
+def statPage(path, stats=None): # (size, mtime), None when the page isn't there.
+    if (stats is not None):
+        return stats.get(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+
+def scanTree(directory):
+    # {path: (size, mtime)} for every file under directory, one os.scandir pass per directory. Paths are joined the way
+    # os.path.join would, so they match image_files_paths.
+    stats = {}
+    pending = [directory]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if (entry.is_dir(follow_symlinks=False)):
+                    pending.append(entry.path)
+                else:
+                    try:
+                        stat = entry.stat()
+                    except OSError: # Gone since the directory was listed.
+                        continue
+                    stats[entry.path] = (stat.st_size, stat.st_mtime)
+    return stats
+
+
+def verifyPagesDeep(paths, manifest, pool=None):
+    # Re-hashes every page on all cores and compares against the manifest.
+    pool = pool if pool else getHashPool()
+    bad = []
+    manifest = list(manifest) if manifest else []
+    manifest += [None] * (len(paths) - len(manifest))
+    existing = [i for i, path in enumerate(paths) if os.path.isfile(path) and os.path.getsize(path) > 0]
+    hashes = dict(zip(existing, pool.map(hashFile, [paths[i] for i in existing], chunksize=8)))
+    for i, path in enumerate(paths):
+        if (i not in hashes):
+            bad.append(i)
+            manifest[i] = None
+        elif (manifest[i] is not None and manifest[i].get('sha1') != hashes[i]):
+            bad.append(i)
+            manifest[i] = None
+        else:
+            manifest[i] = pageRecord(path, hashes[i])
+    return bad, manifest
+
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+def getHashPool():
+    # One process pool sized to the cores, shared by every chapter that gets a deep check.
+    global _hash_pool
+    with _hash_pool_lock:
+        if (_hash_pool is None):
+            _hash_pool = concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _hash_pool
+
+def shutdownHashPool():
+    global _hash_pool
+    with _hash_pool_lock:
+        if (_hash_pool):
+            _hash_pool.shutdown()
+            _hash_pool = None